@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Batch preparation of the submission folders of many exciting calculations.
+
+The database is only accessed in the calling process, to resolve the LAPW
+basis families and to read the input nodes; the input.xml files are then
+rendered concurrently in a process pool, with the same content as in
+ExcitingCalculation._prepare_for_submission (see
+input_xml.get_input_contents), band-structure paths and restarts from a
+parent folder excepted. Each distinct family is resolved once, each
+distinct species file is placed once in a shared store and hard-linked
+into the folders, and each distinct groundstate block is rendered once.
+"""
+import os
+import shutil
+import traceback
+from collections import namedtuple
+
+# name of the directory, inside the destination, with the shared species
+SPECIES_STORE_NAME = '_species'
+
+class BatchItemResult(namedtuple('BatchItemResult',
+                                 ['index', 'folder', 'local_copy_list',
+                                  'error'])):
+    """
+    Result of the preparation of one item of a batch.
+
+    :param index: position of the item in the batch
+    :param folder: the submission folder, with input.xml and the species
+    :param local_copy_list: the (absolute path, filename) of the species
+        files, as in the calcinfo of _prepare_for_submission
+    :param error: None on success, otherwise the formatted error
+    """
+    __slots__ = ()
+
+def _get_family_species(family_name, families):
+    """
+    Return the {chemical symbol: LapwbasisData} map of a family, resolving
+    each family only once per batch.
+    """
+    from aiida_exciting.data.lapwbasis import get_lapwbasis_family_map
+
+    if family_name not in families:
+        families[family_name] = get_lapwbasis_family_map(family_name)
+    return families[family_name]
+
+def _link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy(src, dest)
+
+def _write_item(args):
+    """
+    Render the input.xml of one item; run in the worker processes.
+    """
+    from aiida_exciting.calculations.input_xml import write_input_xml
+
+    (index, folder, cell, species, groundstate_xml, elements,
+     species_links) = args
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'input.xml'), 'w') as handle:
+            write_input_xml(handle, cell, species, groundstate_xml, elements)
+        for src, filename in species_links:
+            dest = os.path.join(folder, filename)
+            if not os.path.exists(dest):
+                _link_or_copy(src, dest)
+    except Exception:
+        return index, traceback.format_exc()
+    return index, None
+
+def prepare_batch(items, dest_folder, processes=None):
+    """
+    Prepare the submission folders of many calculations concurrently.
+
+    Failures are reported per item and do not abort the batch.
+
+    :param items: an iterable of (structure, kpoints, parameters, family)
+        tuples, where family is the name of a LAPW basis family; all the
+        parameters are written (groundstate, structureoptimization,
+        properties and xs)
+    :param dest_folder: the directory in which the folders are created, one
+        per item, named after the index of the item
+    :param processes: the number of worker processes (default: one per CPU)
+    :return: a list of BatchItemResult, in the order of the items
+    """
+    from multiprocessing import Pool
+    from aiida_exciting.calculations.input_xml import (get_species_coordinates,
+                                                       get_input_contents,
+                                                       render_groundstate)
+
+    store = os.path.join(dest_folder, SPECIES_STORE_NAME)
+    if not os.path.isdir(store):
+        os.makedirs(store)
+
+    families = {}
+    stored_species = {}
+    groundstate_blocks = {}
+    results = {}
+    tasks = []
+
+    for index, (structure, kpoints, parameters, family) in enumerate(items):
+        folder = os.path.join(dest_folder, str(index))
+        try:
+            family_species = _get_family_species(family, families)
+            speciesfiles = {}
+            local_copy_list = []
+            species_links = []
+            for kind in structure.kinds:
+                lapw_basis = family_species[kind.symbol]
+                if lapw_basis.md5 not in stored_species:
+                    shared = os.path.join(store, lapw_basis.md5)
+                    if not os.path.isdir(shared):
+                        os.makedirs(shared)
+                    shared = os.path.join(shared, lapw_basis.filename)
+                    if not os.path.exists(shared):
+                        _link_or_copy(lapw_basis.get_file_abs_path(), shared)
+                    stored_species[lapw_basis.md5] = shared
+                speciesfiles[kind.symbol] = lapw_basis.filename
+                local_copy_list.append((lapw_basis.get_file_abs_path(),
+                                        lapw_basis.filename))
+                species_links.append((stored_species[lapw_basis.md5],
+                                      lapw_basis.filename))
+            species = get_species_coordinates(structure, speciesfiles)
+
+            kmesh, koffset = kpoints.get_kpoints_mesh()
+            groundstate_attrib, elements = get_input_contents(
+                parameters.get_dict(), kmesh)
+            key = repr(sorted(groundstate_attrib.iteritems()))
+            if key not in groundstate_blocks:
+                groundstate_blocks[key] = render_groundstate(groundstate_attrib)
+        except Exception:
+            results[index] = BatchItemResult(index, folder, [],
+                                             traceback.format_exc())
+            continue
+        results[index] = BatchItemResult(index, folder, local_copy_list, None)
+        tasks.append((index, folder, structure.cell, species,
+                      groundstate_blocks[key], elements, species_links))
+
+    pool = Pool(processes)
+    try:
+        for index, error in pool.imap_unordered(_write_item, tasks):
+            if error is not None:
+                results[index] = results[index]._replace(error=error)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [results[index] for index in sorted(results)]
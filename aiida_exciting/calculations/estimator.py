@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Estimate of the walltime and memory of exciting calculations from their
+inputs, used to size the scheduler request.
+
+The cost model is log-linear in a few features of the inputs: the number
+of irreducible k-points, the size of the LAPW basis (estimated from the
+cell volume, rgkmax and the smallest muffin-tin radius, plus the local
+orbitals of the species) and the number of atoms. It is calibrated by
+least squares on finished calculations; the exponents are regularized
+towards the scaling of a dense diagonalization, so that a handful of
+calculations is enough for a usable model.
+
+Typical use::
+
+    estimator = ResourceEstimator.from_calculations()
+    calc.set_resources_from_estimate(estimator)
+"""
+import math
+
+import numpy
+
+from aiida_exciting.parsers.parse_xml_output import au2angs
+
+# extra of a calculation with its peak memory per MPI process, in kB (for
+# instance set from the accounting of the scheduler); calculations without
+# it only calibrate the walltime
+MEMORY_EXTRA = 'peak_memory_kb'
+
+# defaults of exciting, for species and parameters that do not set them
+DEFAULT_RGKMAX = 7.
+DEFAULT_MUFFIN_TIN_RADIUS = 2.
+
+# names of the regression features, after the constant term
+MODEL_FEATURES = ['nkpoints', 'basis_size', 'natoms']
+
+# exponents towards which the fits are regularized: the core time of a
+# k-point grows as the cube of the basis size, the memory of a process
+# (Hamiltonian and overlap matrices) as its square
+_PRIOR_CORE_SECONDS = [1., 3., 0.]
+_PRIOR_MEMORY_KB = [0., 2., 0.]
+
+def get_cost_features(structure, kmesh, parameters_dict, lapwbasis_map,
+                      koffset=(0., 0., 0.)):
+    """
+    Return the features of the cost model for a set of inputs.
+
+    :param structure: the StructureData
+    :param kmesh: the k-point mesh
+    :param parameters_dict: the dictionary of the input parameters
+    :param lapwbasis_map: dictionary kind symbol -> LapwbasisData
+    :param koffset: the offset of the k-point mesh
+    :return: a dictionary with natoms, nkinds, nkpoints (irreducible),
+        rgkmax, volume (bohr^3) and basis_size (estimated number of basis
+        functions)
+    :raise KeyError: if lapwbasis_map has no entry for a kind symbol
+    """
+    from aiida_exciting.calculations.symmetry import get_irreducible_kpoint_count
+
+    rgkmax = float(parameters_dict.get('groundstate', {}).get(
+        'rgkmax', DEFAULT_RGKMAX))
+    volume = abs(numpy.linalg.det(numpy.array(structure.cell))) / au2angs**3
+
+    symbols = dict((kind.name, kind.symbol) for kind in structure.kinds)
+    radii = []
+    nlo = 0
+    for site in structure.sites:
+        lapwbasis = lapwbasis_map[symbols[site.kind_name]]
+        radius = lapwbasis.muffin_tin_radius
+        radii.append(DEFAULT_MUFFIN_TIN_RADIUS if radius is None else radius)
+        nlo += lapwbasis.num_local_orbitals or 0
+
+    # number of plane waves with |G+k| < rgkmax / min(rmt)
+    gkmax = rgkmax / min(radii)
+    npw = volume * gkmax**3 / (6. * math.pi**2)
+
+    # exciting only computes the irreducible k-points
+    nkpoints = get_irreducible_kpoint_count(structure, kmesh, koffset)
+
+    return {
+        'natoms': len(structure.sites),
+        'nkinds': len(structure.kinds),
+        'nkpoints': nkpoints,
+        'rgkmax': rgkmax,
+        'volume': volume,
+        'basis_size': npw + nlo,
+        }
+
+def _get_design_row(features):
+    return [1.] + [math.log(max(float(features[name]), 1.))
+                   for name in MODEL_FEATURES]
+
+def _fit(rows, targets, prior, regularization):
+    """
+    Least-squares fit of log(targets), with the exponents regularized
+    towards prior. Return (coefficients, standard deviation of the
+    residuals in log space).
+    """
+    design = numpy.array(rows, dtype=float)
+    values = numpy.log(numpy.array(targets, dtype=float))
+    weight = math.sqrt(regularization)
+    nexp = len(prior)
+    penalty = numpy.zeros((nexp, nexp + 1))
+    penalty[:, 1:] = weight * numpy.eye(nexp)
+    coeffs = numpy.linalg.lstsq(
+        numpy.vstack([design, penalty]),
+        numpy.concatenate([values, weight * numpy.array(prior)]),
+        rcond=-1)[0]
+    residuals = values - design.dot(coeffs)
+    if len(values) > 1:
+        log_std = float(numpy.sqrt((residuals**2).sum() / (len(values) - 1)))
+    else:
+        log_std = 0.
+    return [float(c) for c in coeffs], log_std
+
+class ResourceEstimator(object):
+    """
+    Log-linear model of the core time (walltime times number of MPI
+    processes) and of the peak memory per process of a calculation.
+    """
+
+    def __init__(self, core_seconds_coeffs, core_seconds_log_std=0.,
+                 memory_kb_coeffs=None, memory_kb_log_std=0., nsamples=0):
+        self.core_seconds_coeffs = list(core_seconds_coeffs)
+        self.core_seconds_log_std = core_seconds_log_std
+        self.memory_kb_coeffs = (None if memory_kb_coeffs is None
+                                 else list(memory_kb_coeffs))
+        self.memory_kb_log_std = memory_kb_log_std
+        self.nsamples = nsamples
+
+    @classmethod
+    def calibrate(cls, samples, regularization=1.):
+        """
+        Fit the model to samples.
+
+        :param samples: a list of (features, core_seconds, memory_kb)
+            tuples; memory_kb may be None
+        :param regularization: weight of the prior exponents; smaller
+            values trust the data more
+        """
+        samples = [s for s in samples if s[1] > 0]
+        if not samples:
+            raise ValueError("No calculation with timing data to calibrate "
+                             "the resource estimator")
+        core_seconds_coeffs, core_seconds_log_std = _fit(
+            [_get_design_row(f) for f, t, m in samples],
+            [t for f, t, m in samples], _PRIOR_CORE_SECONDS, regularization)
+
+        memory_samples = [(f, m) for f, t, m in samples if m]
+        if memory_samples:
+            memory_kb_coeffs, memory_kb_log_std = _fit(
+                [_get_design_row(f) for f, m in memory_samples],
+                [m for f, m in memory_samples], _PRIOR_MEMORY_KB,
+                regularization)
+        else:
+            memory_kb_coeffs, memory_kb_log_std = None, 0.
+
+        return cls(core_seconds_coeffs, core_seconds_log_std,
+                   memory_kb_coeffs, memory_kb_log_std, len(samples))
+
+    @classmethod
+    def from_calculations(cls, calculations=None, regularization=1.):
+        """
+        Calibrate the model on finished ExcitingCalculations.
+
+        :param calculations: the calculations to use (default: all the
+            finished ExcitingCalculations of the database)
+        """
+        if calculations is None:
+            calculations = get_finished_calculations()
+        samples = []
+        for calc in calculations:
+            try:
+                sample = get_calculation_sample(calc)
+            except KeyError:
+                # e.g. a LAPW basis linked for several kinds at once
+                continue
+            if sample is not None:
+                samples.append(sample)
+        return cls.calibrate(samples, regularization)
+
+    def estimate(self, features):
+        """
+        Return the estimate for a set of features as a dictionary with
+        core_seconds, core_seconds_log_std and, if the memory model was
+        calibrated, memory_kb (per process) and memory_kb_log_std.
+        """
+        row = numpy.array(_get_design_row(features))
+        estimate = {
+            'core_seconds': math.exp(row.dot(self.core_seconds_coeffs)),
+            'core_seconds_log_std': self.core_seconds_log_std,
+            }
+        if self.memory_kb_coeffs is not None:
+            estimate['memory_kb'] = math.exp(row.dot(self.memory_kb_coeffs))
+            estimate['memory_kb_log_std'] = self.memory_kb_log_std
+        return estimate
+
+    def as_dict(self):
+        """
+        Return the calibrated model as a dictionary, e.g. to store it in a
+        ParameterData.
+        """
+        return {
+            'features': list(MODEL_FEATURES),
+            'core_seconds_coeffs': self.core_seconds_coeffs,
+            'core_seconds_log_std': self.core_seconds_log_std,
+            'memory_kb_coeffs': self.memory_kb_coeffs,
+            'memory_kb_log_std': self.memory_kb_log_std,
+            'nsamples': self.nsamples,
+            }
+
+    @classmethod
+    def from_dict(cls, model):
+        """
+        Rebuild a model from the dictionary returned by as_dict.
+        """
+        if model.get('features', MODEL_FEATURES) != MODEL_FEATURES:
+            raise ValueError("The model was calibrated with different "
+                             "features: {}".format(model['features']))
+        return cls(model['core_seconds_coeffs'],
+                   model.get('core_seconds_log_std', 0.),
+                   model.get('memory_kb_coeffs', None),
+                   model.get('memory_kb_log_std', 0.),
+                   model.get('nsamples', 0))
+
+def get_resource_request(estimate, nkpoints, num_mpiprocs_per_machine,
+                         max_wallclock_seconds=86400, max_num_machines=None,
+                         min_wallclock_seconds=600, safety_factor=None):
+    """
+    Size the scheduler request of a calculation from its estimate.
+
+    The number of machines is the smallest one that fits the estimated
+    core time in max_wallclock_seconds, without using more MPI processes
+    than k-points.
+
+    :param estimate: the dictionary returned by ResourceEstimator.estimate
+    :param nkpoints: the number of k-points of the calculation
+    :param safety_factor: factor applied to the estimates (default: two
+        standard deviations of the calibration residuals, at least 1.25)
+    :return: a dictionary with num_machines, num_mpiprocs_per_machine,
+        max_wallclock_seconds and, if memory was estimated, max_memory_kb
+        (per machine)
+    """
+    def get_margin(log_std):
+        if safety_factor is not None:
+            return safety_factor
+        return max(1.25, math.exp(2. * log_std))
+
+    core_seconds = estimate['core_seconds'] * get_margin(
+        estimate['core_seconds_log_std'])
+
+    num_machines = int(math.ceil(
+        core_seconds / (num_mpiprocs_per_machine * max_wallclock_seconds)))
+    num_machines = min(num_machines, int(math.ceil(
+        float(nkpoints) / num_mpiprocs_per_machine)))
+    if max_num_machines is not None:
+        num_machines = min(num_machines, max_num_machines)
+    num_machines = max(num_machines, 1)
+
+    walltime = core_seconds / (num_machines * num_mpiprocs_per_machine)
+    # whole minutes, within the limits
+    walltime = 60 * int(math.ceil(walltime / 60.))
+    walltime = min(max(walltime, min_wallclock_seconds), max_wallclock_seconds)
+
+    request = {
+        'num_machines': num_machines,
+        'num_mpiprocs_per_machine': num_mpiprocs_per_machine,
+        'max_wallclock_seconds': walltime,
+        }
+    if 'memory_kb' in estimate:
+        request['max_memory_kb'] = int(math.ceil(
+            estimate['memory_kb'] * num_mpiprocs_per_machine *
+            get_margin(estimate['memory_kb_log_std'])))
+    return request
+
+def get_finished_calculations():
+    """
+    Return the finished ExcitingCalculations of the database.
+    """
+    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_exciting.calculations.exciting import ExcitingCalculation
+
+    qb = QueryBuilder()
+    qb.append(ExcitingCalculation, filters={'attributes.state': 'FINISHED'},
+              project=['*'])
+    return [calc for calc, in qb.iterall()]
+
+def get_calculation_sample(calc):
+    """
+    Return the calibration sample (features, core_seconds, memory_kb) of a
+    finished calculation, or None if it has no timing data.
+
+    The walltime is taken from the scheduler if it reported it, otherwise
+    from the SCF timing of the output parameters; the memory from the
+    MEMORY_EXTRA extra. A KeyError is raised if the LAPW basis of a kind
+    cannot be found.
+    """
+    outputs = calc.get_outputs_dict()
+    output_parameters = outputs.get('output_parameters', None)
+
+    walltime = None
+    jobinfo = calc.get_last_jobinfo()
+    if jobinfo is not None:
+        walltime = getattr(jobinfo, 'wallclock_time_seconds', None)
+    if not walltime and output_parameters is not None:
+        walltime = output_parameters.get_dict().get('wall_time', None)
+    if not walltime:
+        return None
+
+    resources = calc.get_resources()
+    nprocs = (resources.get('num_machines', 1) *
+              resources.get('num_mpiprocs_per_machine', 1))
+
+    features = calc.get_cost_features()
+    return features, walltime * nprocs, calc.get_extra(MEMORY_EXTRA, None)
@@ -5,14 +5,15 @@ Plugin to create an Exciting input file.
 import os
 
 from aiida.orm.calculation.job import JobCalculation
-from aiida.orm.data.array.kpoints import KpointsData
-from aiida.orm.data.structure import StructureData
-from aiida.orm.data.parameter import ParameterData
-from aiida.orm.data.remote import RemoteData
-from aiida_exciting.data.lapwbasis import LapwbasisData
+from aiida_exciting.data.lapwbasis_cache import is_cached, get_cached_path
 from aiida.common.utils import classproperty
 from aiida.common.datastructures import CalcInfo
 from aiida.common.datastructures import CodeInfo
+from aiida.common.exceptions import InputValidationError
+from aiida_exciting.calculations.monitor import get_scf_monitor_criteria
+from aiida_exciting.timing import get_timer
+# The data classes, numpy and the helpers of the other modules are imported
+# where they are used, so that loading the plugin entry point stays cheap
 __copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
 __license__ = "MIT license, see LICENSE.txt file"
 __version__ = "0.4.1"
@@ -26,6 +27,16 @@ class ExcitingCalculation(JobCalculation):
 
     _OUTPUT_FILE_NAME = 'aiida.out'
 
+    # Files taken from the parent folder to restart from its density and
+    # potential
+    _RESTART_FILES = ['STATE.OUT', 'EFERMI.OUT']
+
+    # Files retrieved when the PARSE_BANDS setting is True
+    _BANDS_FILES = ['EIGVAL.OUT', 'BAND.OUT', 'bandstructure.xml']
+
+    # Files retrieved when the PARSE_DOS setting is True
+    _DOS_FILES = ['TDOS.OUT', ['PDOS_S*_A*.OUT', '.', 0]]
+
     def _init_internal_params(self):
         super(ExcitingCalculation, self)._init_internal_params()
 
@@ -34,6 +45,17 @@ class ExcitingCalculation(JobCalculation):
         self._DEFAULT_OUTPUT_FILE = self._OUTPUT_FILE_NAME
 
     def _prepare_for_submission(self, tempfolder, inputdict):
+        from aiida.orm.data.array.kpoints import KpointsData
+        from aiida.orm.data.structure import StructureData
+        from aiida.orm.data.parameter import ParameterData
+        from aiida.orm.data.remote import RemoteData
+        from aiida_exciting.parsers.archive import (get_archive_command,
+                                                    RETRIEVE_ARCHIVE_NAME)
+        from aiida_exciting.calculations.input_xml import (get_species_coordinates,
+                                                           get_input_contents,
+                                                           get_restart_mode,
+                                                           write_input_xml)
+        from aiida_exciting.parsers.parse_xs_output import get_xs_retrieve_list
 
         settings = inputdict.pop(self.get_linkname('settings'), None)
         if settings is None:
@@ -62,6 +84,24 @@ class ExcitingCalculation(JobCalculation):
         # Empty command line by default
         cmdline_params = settings_dict.pop('CMDLINE', [])
 
+        # The SCF monitor reads its criteria from the stored settings node;
+        # only check here that they are valid
+        try:
+            get_scf_monitor_criteria(settings_dict)
+        except ValueError as e:
+            raise InputValidationError("Invalid SCF_MONITOR settings: "
+                                       "{}".format(e))
+        settings_dict.pop('SCF_MONITOR', None)
+
+        # Phase timing, reported in the log and in the prepare_timing extra
+        timer = get_timer(settings_dict.pop('TIMING', False))
+
+        # Directory of the remote species cache, if used
+        lapwbasis_cache = settings_dict.pop('LAPWBASIS_REMOTE_CACHE', None)
+        if lapwbasis_cache is not None and not os.path.isabs(lapwbasis_cache):
+            raise InputValidationError("LAPWBASIS_REMOTE_CACHE must be an "
+                                       "absolute path")
+
         #calcinfo.stdin_name = self._INPUT_FILE_NAME
         #calcinfo.stdout_name = self._OUTPUT_FILE_NAME
 
@@ -72,15 +112,42 @@ class ExcitingCalculation(JobCalculation):
         codeinfo.code_uuid = code.uuid
         calcinfo.codes_info = [codeinfo]
         #
-        #calcinfo.remote_copy_list = remote_copy_list
-        #calcinfo.remote_symlink_list = remote_symlink_list
-
         calcinfo.local_copy_list = []
+        calcinfo.remote_copy_list = []
+        calcinfo.remote_symlink_list = []
 
         # Retrieve by default the output file and the xml file
         calcinfo.retrieve_list = []
         calcinfo.retrieve_list.append(self._OUTPUT_FILE_NAME)
         calcinfo.retrieve_list.append("info.xml")
+        # The band-structure and DOS files are also retrieved when these
+        # properties are computed
+        parameters_dict = parameters.get_dict()
+        properties_dict = parameters_dict.get('properties', {})
+        bands_kpoints = inputdict.pop(self.get_linkname('bandskpoints'), None)
+        if bands_kpoints is not None and not isinstance(bands_kpoints, KpointsData):
+            raise InputValidationError("bandskpoints, if specified, must be "
+                                       "of type KpointsData")
+        if (settings_dict.pop('PARSE_BANDS', False) or
+                'bandstructure' in properties_dict or bands_kpoints is not None):
+            calcinfo.retrieve_list.extend(self._BANDS_FILES)
+        if settings_dict.pop('PARSE_DOS', False) or 'dos' in properties_dict:
+            calcinfo.retrieve_list.extend(self._DOS_FILES)
+        # and so are the spectra and excitons of an excited-state run
+        if 'xs' in parameters_dict:
+            calcinfo.retrieve_list.extend(get_xs_retrieve_list())
+
+        # Bundle the files to retrieve in a single compressed archive at the
+        # end of the job; the parser extracts it. Only the output file is
+        # still retrieved as it is, to diagnose a job that died before
+        # writing the archive
+        if settings_dict.pop('COMPRESS_RETRIEVED', False):
+            plain_files = [self._OUTPUT_FILE_NAME]
+            patterns = [entry if isinstance(entry, basestring) else entry[0]
+                        for entry in calcinfo.retrieve_list
+                        if entry not in plain_files]
+            calcinfo.append_text = get_archive_command(patterns)
+            calcinfo.retrieve_list = plain_files + [RETRIEVE_ARCHIVE_NAME]
         #calcinfo.retrieve_list.append(self._DATAFILE_XML)
         #settings_retrieve_list = settings_dict.pop('ADDITIONAL_RETRIEVE_LIST', [])
 
@@ -106,63 +173,277 @@ class ExcitingCalculation(JobCalculation):
                 kindstring = link[len("lapwbasis_"):]
                 lapw_basis_list[kindstring] = inputdict.pop(link)
 
-        import xml.etree.ElementTree as ET
-        root = ET.Element("input")
-        ET.SubElement(root, "title").text = "input file created with AiiDA"
-        struct = ET.SubElement(root, "structure", attrib={'speciespath' : './', 'autormt' : 'true'})
-        cryst = ET.SubElement(struct, "crystal", attrib={'scale' : '1.889725989'})
-
-        from numpy import matrix
-        lat_vec = matrix(structure.cell)
-        inv_lat_vec = lat_vec.T.I;
-
-        for vector in structure.cell:
-            ET.SubElement(cryst, "basevect").text = " ".join(['%18.10f'%e for e in vector])
-
-        for kind in structure.kinds:
-            lapw_basis = lapw_basis_list[kind.symbol]
-            calcinfo.local_copy_list.append((lapw_basis.get_file_abs_path(), lapw_basis.filename))
-
-            s = ET.SubElement(struct, "species", attrib={'speciesfile' : lapw_basis.filename})
-            for site in structure.sites:
-                if site.kind_name == kind.name:
-                    pos_cart = matrix(site.position)
-                    pos_lat = inv_lat_vec * pos_cart.T
-                    ET.SubElement(s, "atom", attrib={'coord' : " ".join(['%18.10f'%e for e in pos_lat])})
-       
-        parameters_dict = parameters.get_dict()
-        groundstate_attrib = {}
-        if 'groundstate' in parameters_dict:
-            groundstate_attrib = parameters_dict['groundstate']
-        groundstate_attrib['ngridk'] = " ".join(['%i'%e for e in kmesh])
-        ET.SubElement(root, "groundstate", attrib=groundstate_attrib)
+        computer = self.get_computer()
+        speciesfiles = {}
+        with timer.phase('resolve_lapwbasis'):
+            for kind in structure.kinds:
+                lapw_basis = lapw_basis_list[kind.symbol]
+                # Symlink the species file from the remote cache if it is there,
+                # upload it otherwise
+                if (lapwbasis_cache is not None and
+                        is_cached(computer, lapwbasis_cache, lapw_basis)):
+                    calcinfo.remote_symlink_list.append(
+                        (computer.uuid, get_cached_path(lapwbasis_cache, lapw_basis),
+                         lapw_basis.filename))
+                else:
+                    calcinfo.local_copy_list.append((lapw_basis.get_file_abs_path(), lapw_basis.filename))
+                speciesfiles[kind.symbol] = lapw_basis.filename
+
+        with timer.phase('convert_coordinates'):
+            species = get_species_coordinates(structure, speciesfiles)
 
-        tree = ET.ElementTree(root)
-        tree.write(tempfolder.get_abs_path("input.xml"))
+        try:
+            if bands_kpoints is None:
+                groundstate_attrib, input_elements = get_input_contents(
+                    parameters_dict, kmesh)
+            else:
+                groundstate_attrib, input_elements = get_input_contents(
+                    parameters_dict, kmesh, bands_kpoints.get_kpoints(),
+                    bands_kpoints.labels)
+        except ValueError as e:
+            raise InputValidationError("Invalid parameters: {}".format(e))
+
+        parent_calc_folder = inputdict.pop(self.get_linkname('parent_folder'), None)
+        if parent_calc_folder is not None:
+            if not isinstance(parent_calc_folder, RemoteData):
+                raise InputValidationError("parent_calc_folder, if specified, "
+                                           "must be of type RemoteData")
+            if parent_calc_folder.get_computer().uuid != computer.uuid:
+                raise InputValidationError("The parent_calc_folder must be on "
+                                           "the same computer as the calculation")
+            # exciting rewrites STATE.OUT during the SCF cycle, so the files
+            # are copied unless symlinks are explicitly requested; when the
+            # SCF is skipped they are only read, and symlinked by default
+            restart_mode = groundstate_attrib.setdefault(
+                'do', get_restart_mode(parameters_dict))
+            symlink = settings_dict.pop('PARENT_FOLDER_SYMLINK',
+                                        restart_mode == 'skip')
+            if symlink:
+                remote_list = calcinfo.remote_symlink_list
+            else:
+                remote_list = calcinfo.remote_copy_list
+            for filename in self._RESTART_FILES:
+                remote_list.append(
+                    (computer.uuid,
+                     os.path.join(parent_calc_folder.get_remote_path(), filename),
+                     filename))
+
+        with timer.phase('write_input'):
+            with open(tempfolder.get_abs_path("input.xml"), 'w') as handle:
+                write_input_xml(handle, structure.cell, species, groundstate_attrib,
+                                input_elements)
+
+        if timer.enabled:
+            timer.log(self.logger, 'prepare')
+            # submit_test prepares unstored calculations, which take no extras
+            if self.is_stored:
+                self.set_extra('prepare_timing', timer.as_dict())
 
         return calcinfo
 
     def use_lapwbasis_from_family(self, family_name):
-        from collections import defaultdict
-
         try:
             structure = self.get_inputs_dict()[self.get_linkname('structure')]
         except AttributeError:
             raise ValueError("Structure is not set yet! Therefore, the method "
                              "use_lapwbasis_from_family cannot automatically set "
                              "the LAPW basis")
+        from aiida_exciting.data.lapwbasis import get_lapwbasis_for_structures
 
-        from aiida.orm import Group
-        lapwbasis_group = Group.get(family_name, type_string=LapwbasisData.lapwbasisfamily_type_string)
-        
-        lapwbasis_list = {}
-        for node in lapwbasis_group.nodes:
-            if isinstance(node, LapwbasisData):
-                lapwbasis_list[node.chemical_symbol] = node
+        # raises NotExistent, naming the missing elements, before any link
+        # is set
+        lapwbasis_list = get_lapwbasis_for_structures([structure], family_name)[0]
+
+        for symbol, lapwbasis in lapwbasis_list.iteritems():
+            self.use_lapwbasis(lapwbasis, symbol)
+
+    @classmethod
+    def use_lapwbasis_from_family_batch(cls, calculations, family_name):
+        """
+        Set the LAPW basis of many calculations from the same family,
+        resolving the family once. The structure of each calculation must
+        be set already.
+        """
+        from aiida_exciting.data.lapwbasis import get_lapwbasis_for_structures
+
+        structures = []
+        for calc in calculations:
+            try:
+                structures.append(calc.get_inputs_dict()[calc.get_linkname('structure')])
+            except KeyError:
+                raise ValueError("Structure is not set yet for calculation "
+                                 "{}".format(calc))
+
+        for calc, lapwbasis_list in zip(
+                calculations, get_lapwbasis_for_structures(structures, family_name)):
+            for symbol, lapwbasis in lapwbasis_list.iteritems():
+                calc.use_lapwbasis(lapwbasis, symbol)
+
+    def get_cost_features(self):
+        """
+        Return the features of the resource estimator for the inputs of
+        this calculation (see estimator.get_cost_features). The structure,
+        kpoints, parameters and LAPW basis must be set already.
+        """
+        from aiida_exciting.calculations.estimator import get_cost_features
+
+        inputs = self.get_inputs_dict()
+        try:
+            structure = inputs[self.get_linkname('structure')]
+            kpoints = inputs[self.get_linkname('kpoints')]
+            parameters = inputs[self.get_linkname('parameters')]
+        except KeyError as e:
+            raise ValueError("Input {} is not set yet, the cost of the "
+                             "calculation cannot be estimated".format(e))
+        lapwbasis_map = dict((link[len("lapwbasis_"):], node)
+                             for link, node in inputs.iteritems()
+                             if link.startswith("lapwbasis_"))
+        kmesh, koffset = kpoints.get_kpoints_mesh()
+        return get_cost_features(structure, kmesh, parameters.get_dict(),
+                                 lapwbasis_map, koffset)
 
-        for kind in structure.kinds:
-            symbol = kind.symbol
-            self.use_lapwbasis(lapwbasis_list[symbol], symbol)
+    def set_resources_from_estimate(self, estimator, num_mpiprocs_per_machine=None,
+                                    max_wallclock_seconds=86400,
+                                    max_num_machines=None, safety_factor=None):
+        """
+        Set the resources, the walltime and, if the estimator models it,
+        the memory of this calculation from the estimated cost of its
+        inputs. To be called before storing the calculation.
+
+        :param estimator: a calibrated estimator.ResourceEstimator
+        :param num_mpiprocs_per_machine: MPI processes per machine (default:
+            the default of the computer)
+        :param max_wallclock_seconds: the longest walltime to request; more
+            machines are used for longer estimates
+        :param max_num_machines: the largest number of machines to request
+        :param safety_factor: factor applied to the estimates (default:
+            from the spread of the calibration)
+        :return: the resource request, as set on the calculation
+        """
+        from aiida_exciting.calculations.estimator import get_resource_request
+
+        features = self.get_cost_features()
+        if num_mpiprocs_per_machine is None:
+            num_mpiprocs_per_machine = (
+                self.get_computer().get_default_mpiprocs_per_machine() or 1)
+
+        request = get_resource_request(
+            estimator.estimate(features), features['nkpoints'],
+            num_mpiprocs_per_machine, max_wallclock_seconds=max_wallclock_seconds,
+            max_num_machines=max_num_machines, safety_factor=safety_factor)
+
+        self.set_resources({
+            'num_machines': request['num_machines'],
+            'num_mpiprocs_per_machine': request['num_mpiprocs_per_machine']})
+        self.set_max_wallclock_seconds(request['max_wallclock_seconds'])
+        if 'max_memory_kb' in request:
+            self.set_max_memory_kb(request['max_memory_kb'])
+        return request
+
+    def set_parallelization_from_kpoints(self, num_cores_per_machine=None,
+                                        num_machines=None, symprec=None,
+                                        openmp_scaling=None):
+        """
+        Choose the MPI/OpenMP layout from the number of irreducible
+        k-points of the structure and k-point mesh, and set the resources
+        and the OMP_NUM_THREADS environment variable accordingly. The
+        layout is also stored in the 'parallelization' attribute. To be
+        called before storing the calculation, after setting the structure
+        and the kpoints (and, possibly, the resources).
+
+        :param num_cores_per_machine: the cores of each machine (default:
+            the default number of MPI processes per machine of the computer)
+        :param num_machines: the number of machines (default: the one in the
+            resources, or 1)
+        :param symprec: tolerance on the positions for the symmetry
+            analysis, in angstrom (default: symmetry.DEFAULT_SYMPREC)
+        :param openmp_scaling: see parallelization.get_parallel_layout
+            (default: parallelization.DEFAULT_OPENMP_SCALING)
+        :return: the layout (see parallelization.get_parallel_layout), with
+            the number of k-points of the mesh and of irreducible k-points
+        """
+        import numpy
+        from aiida_exciting.calculations.symmetry import (get_irreducible_kpoint_count,
+                                                         DEFAULT_SYMPREC)
+        from aiida_exciting.calculations.parallelization import (get_parallel_layout,
+                                                                DEFAULT_OPENMP_SCALING)
+
+        if symprec is None:
+            symprec = DEFAULT_SYMPREC
+        if openmp_scaling is None:
+            openmp_scaling = DEFAULT_OPENMP_SCALING
+        inputs = self.get_inputs_dict()
+        try:
+            structure = inputs[self.get_linkname('structure')]
+            kpoints = inputs[self.get_linkname('kpoints')]
+        except KeyError as e:
+            raise ValueError("Input {} is not set yet, the parallelization "
+                             "cannot be chosen".format(e))
+        if num_cores_per_machine is None:
+            num_cores_per_machine = self.get_computer().get_default_mpiprocs_per_machine()
+            if num_cores_per_machine is None:
+                raise ValueError("The computer has no default number of "
+                                 "MPI processes per machine, pass "
+                                 "num_cores_per_machine")
+        if num_machines is None:
+            num_machines = self.get_resources().get('num_machines', 1)
+
+        kmesh, koffset = kpoints.get_kpoints_mesh()
+        nkpoints_irreducible = get_irreducible_kpoint_count(
+            structure, kmesh, koffset, symprec=symprec)
+        layout = get_parallel_layout(nkpoints_irreducible, num_machines,
+                                     num_cores_per_machine,
+                                     openmp_scaling=openmp_scaling)
+        layout['nkpoints'] = int(numpy.prod(kmesh))
+        layout['nkpoints_irreducible'] = nkpoints_irreducible
+        layout['num_machines'] = num_machines
+
+        self.set_resources({
+            'num_machines': num_machines,
+            'num_mpiprocs_per_machine': layout['num_mpiprocs_per_machine']})
+        environment = dict(self.get_environment_variables())
+        environment['OMP_NUM_THREADS'] = str(layout['omp_num_threads'])
+        self.set_environment_variables(environment)
+        self._set_attr('parallelization', layout)
+        return layout
+
+    def get_input_hash(self):
+        """
+        Return the canonical hash of the inputs (see input_hash): it uses
+        the md5 of the species files instead of the nodes, and does not
+        depend on the order of the sites or on float noise.
+        """
+        from aiida_exciting.calculations.input_hash import get_calculation_input_hash
+
+        return get_calculation_input_hash(self)
+
+    def set_input_hash(self):
+        """
+        Compute the input hash and store it in the 'input_hash' attribute.
+        To be called before storing the calculation.
+        """
+        from aiida_exciting.calculations.input_hash import INPUT_HASH_ATTRIBUTE
+
+        input_hash = self.get_input_hash()
+        self._set_attr(INPUT_HASH_ATTRIBUTE, input_hash)
+        return input_hash
+
+    def get_cached_calculation(self):
+        """
+        Return the last finished ExcitingCalculation with the same input
+        hash as this one, or None. If this calculation is not stored, its
+        input hash attribute is set.
+        """
+        from aiida_exciting.calculations.input_hash import (
+            get_finished_calculation_with_hash, INPUT_HASH_ATTRIBUTE)
+
+        if not self.is_stored:
+            input_hash = self.set_input_hash()
+        else:
+            input_hash = self.get_attr(INPUT_HASH_ATTRIBUTE, None)
+            if input_hash is None:
+                input_hash = self.get_input_hash()
+        return get_finished_calculation_with_hash(input_hash)
 
     @classmethod
     def _get_linkname_lapwbasis(cls, kind):
@@ -183,6 +464,12 @@ class ExcitingCalculation(JobCalculation):
         """
         Extend the parent _use_methods with further keys.
         """
+        from aiida.orm.data.array.kpoints import KpointsData
+        from aiida.orm.data.structure import StructureData
+        from aiida.orm.data.parameter import ParameterData
+        from aiida.orm.data.remote import RemoteData
+        from aiida_exciting.data.lapwbasis import LapwbasisData
+
         tmp = { 
             "structure": {
                 'valid_types': StructureData,
@@ -228,6 +515,14 @@ class ExcitingCalculation(JobCalculation):
                 'additional_parameter': None,
                 'linkname': 'kpoints',
                 'docstring': "Use the node defining the kpoint sampling to use"
+            },
+            "bandskpoints" : {
+                'valid_types': KpointsData,
+                'additional_parameter': None,
+                'linkname': 'bandskpoints',
+                'docstring': ("Use the node defining the k-point path of the "
+                              "band structure; its labelled k-points are the "
+                              "vertices of the path"),
             }
         }
 
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Canonical hash of the inputs of an exciting calculation, used to reuse the
+results of a finished calculation with physically identical inputs.
+
+The hash does not depend on the identity of the nodes: the species files
+enter through their md5 checksum, the sites are sorted, the fractional
+coordinates are wrapped into the cell, and all numbers are rounded as
+floats, so that the order of the sites, integers written as floats and
+numerical noise below the rounding do not change it. Values that differ by
+noise straddling a rounding boundary can still give different hashes,
+which only costs a recomputation.
+"""
+import hashlib
+import json
+import numbers
+
+import numpy
+
+from aiida_exciting.calculations.input_xml import get_fractional_coordinates
+
+# name of the attribute holding the hash
+INPUT_HASH_ATTRIBUTE = 'input_hash'
+# version of the hashed representation, changed whenever it changes
+INPUT_HASH_VERSION = 1
+
+# keys of the settings that change the outputs of a calculation; the others
+# (e.g. TIMING, SCF_MONITOR) only change how it is run or diagnosed
+HASHED_SETTINGS = ['CMDLINE', 'COMPRESS_RETRIEVED', 'PARSE_BANDS', 'PARSE_DOS']
+
+# decimals of the lattice vectors (angstrom) and of the fractional
+# coordinates, and significant digits of the floats of the parameters
+CELL_DECIMALS = 5
+POSITION_DECIMALS = 6
+PARAMETER_DIGITS = 10
+
+def _round(array, decimals):
+    # adding 0. turns -0. into 0.
+    return numpy.round(numpy.asarray(array, dtype=numpy.float64),
+                       decimals) + 0.
+
+def get_canonical_sites(cell, positions, species_md5s):
+    """
+    Return the sites as a sorted list of (species md5, fractional
+    coordinates) with the coordinates wrapped into [0, 1) and rounded.
+
+    :param cell: 3x3 array, one lattice vector per row
+    :param positions: Nx3 array of cartesian positions
+    :param species_md5s: the md5 of the species file of each site
+    """
+    fractional = _round(get_fractional_coordinates(cell, positions),
+                        POSITION_DECIMALS)
+    # wrap after rounding, so that 0.9999999 and 0. are the same site
+    fractional = _round(fractional % 1., POSITION_DECIMALS) % 1.
+    return sorted((md5, [float(x) for x in coords])
+                  for md5, coords in zip(species_md5s, fractional))
+
+def get_canonical_value(value):
+    """
+    Return a copy of a parameter value with the numbers (but not the
+    booleans) turned into floats rounded to PARAMETER_DIGITS significant
+    digits, so that 7 and 7.0 are the same value.
+    """
+    if isinstance(value, dict):
+        return dict((k, get_canonical_value(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [get_canonical_value(v) for v in value]
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        return float('%.*g' % (PARAMETER_DIGITS, value))
+    return value
+
+def get_input_hash(cell, positions, species_md5s, parameters_dict, kmesh,
+                   koffset, extra=None):
+    """
+    Return the canonical hash (a hex string) of a set of inputs.
+
+    :param cell: the lattice vectors (in angstrom), one per row
+    :param positions: the cartesian positions of the sites
+    :param species_md5s: the md5 of the species file of each site
+    :param parameters_dict: the dictionary of the input parameters
+    :param kmesh: the k-point mesh
+    :param koffset: the offset of the k-point mesh
+    :param extra: other hashable inputs (e.g. the band-structure path), as
+        a dictionary of json-serializable values
+    """
+    representation = {
+        'version': INPUT_HASH_VERSION,
+        'cell': _round(cell, CELL_DECIMALS).tolist(),
+        'sites': get_canonical_sites(cell, positions, species_md5s),
+        'parameters': get_canonical_value(parameters_dict),
+        'kmesh': [int(n) for n in kmesh],
+        'koffset': get_canonical_value([float(o) for o in koffset]),
+        'extra': get_canonical_value(extra or {}),
+        }
+    text = json.dumps(representation, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text).hexdigest()
+
+def get_calculation_input_hash(calc):
+    """
+    Return the canonical hash of the inputs of an ExcitingCalculation,
+    stored or not. The code, structure, parameters, kpoints and LAPW basis
+    must be set.
+
+    The code enters through its uuid, the settings through the keys in
+    HASHED_SETTINGS, and a parent folder through the hash of the
+    calculation that created it (or its uuid, if that calculation has no
+    hash).
+    """
+    inputs = calc.get_inputs_dict()
+    try:
+        structure = inputs[calc.get_linkname('structure')]
+        parameters = inputs[calc.get_linkname('parameters')]
+        kpoints = inputs[calc.get_linkname('kpoints')]
+        code = inputs[calc.get_linkname('code')]
+    except KeyError as e:
+        raise ValueError("Input {} is not set yet, the input hash cannot be "
+                         "computed".format(e))
+
+    md5s = {}
+    for link, node in inputs.iteritems():
+        if link.startswith("lapwbasis_"):
+            md5s[link[len("lapwbasis_"):]] = node.md5
+    symbols = dict((kind.name, kind.symbol) for kind in structure.kinds)
+    try:
+        species_md5s = [md5s[symbols[site.kind_name]]
+                        for site in structure.sites]
+    except KeyError as e:
+        raise ValueError("No LAPW basis set for {}".format(e))
+
+    extra = {'code': code.uuid}
+    settings = inputs.get(calc.get_linkname('settings'), None)
+    settings_dict = settings.get_dict() if settings is not None else {}
+    # unset and false (or empty) settings have the same effect
+    extra['settings'] = dict((k, settings_dict[k]) for k in HASHED_SETTINGS
+                             if settings_dict.get(k))
+    bands_kpoints = inputs.get(calc.get_linkname('bandskpoints'), None)
+    if bands_kpoints is not None:
+        extra['bandskpoints'] = _round(bands_kpoints.get_kpoints(),
+                                       POSITION_DECIMALS).tolist()
+        extra['bandslabels'] = [list(l) for l in bands_kpoints.labels or []]
+    parent_folder = inputs.get(calc.get_linkname('parent_folder'), None)
+    if parent_folder is not None:
+        parent_calcs = parent_folder.get_inputs()
+        if parent_calcs:
+            parent = parent_calcs[0]
+            extra['parent'] = parent.get_attr(INPUT_HASH_ATTRIBUTE, parent.uuid)
+        else:
+            extra['parent'] = parent_folder.uuid
+
+    kmesh, koffset = kpoints.get_kpoints_mesh()
+    return get_input_hash(structure.cell,
+                          [site.position for site in structure.sites],
+                          species_md5s, parameters.get_dict(), kmesh, koffset,
+                          extra)
+
+def get_finished_calculation_with_hash(input_hash):
+    """
+    Return the last finished ExcitingCalculation with the given input hash,
+    or None.
+    """
+    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_exciting.calculations.exciting import ExcitingCalculation
+
+    qb = QueryBuilder()
+    qb.append(ExcitingCalculation,
+              filters={'attributes.{}'.format(INPUT_HASH_ATTRIBUTE): input_hash,
+                       'attributes.state': 'FINISHED'},
+              project=['*'], tag='calc')
+    qb.order_by({'calc': [{'id': {'order': 'desc'}}]})
+    qb.limit(1)
+    for calc, in qb.iterall():
+        return calc
+    return None
+
+def submit_or_reuse(calc):
+    """
+    Submit an unstored ExcitingCalculation, unless a finished calculation
+    with identical inputs exists.
+
+    The input hash is stored in the calculation attributes in both cases,
+    so that later calculations can reuse this one.
+
+    :return: (calculation, submitted): the existing finished calculation
+        and False, or calc and True if it was submitted
+    """
+    existing = calc.get_cached_calculation()
+    if existing is not None:
+        return existing, False
+    calc.store_all()
+    calc.submit()
+    return calc, True
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Generation of the exciting input.xml file.
+
+The functions in this module work on plain python and numpy objects, so
+that they can be used (and benchmarked) independently of the AiiDA nodes.
+The file is streamed to disk element by element; atomic coordinates are
+converted and formatted in batches rather than one site at a time.
+"""
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy
+
+INPUT_TITLE = "input file created with AiiDA"
+# Angstrom to bohr
+CRYSTAL_SCALE = '1.889725989'
+
+# elements following groundstate, written from the parameters with the
+# same name
+INPUT_ELEMENTS = ['structureoptimization', 'properties', 'xs']
+
+# types of excited-state calculations of the xs element
+XS_TYPES = ['TDDFT', 'BSE']
+# key of a dictionary written by XmlStreamWriter.nested as the text of the
+# element, instead of an attribute
+TEXT_KEY = '#text'
+
+_COORD_FORMAT = '%18.10f'
+# number of atoms formatted with one string operation
+_ATOMS_BLOCK_SIZE = 4096
+
+def get_fractional_coordinates(cell, positions):
+    """
+    Convert cartesian positions to coordinates in units of the lattice
+    vectors, for all sites at once.
+
+    :param cell: 3x3 array, one lattice vector per row
+    :param positions: Nx3 array of cartesian positions
+    :return: Nx3 array of fractional coordinates
+    """
+    cell = numpy.asarray(cell, dtype=numpy.float64)
+    positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+    if len(positions) == 0:
+        return positions
+    return numpy.linalg.solve(cell.T, positions.T).T
+
+def group_sites_by_kind(site_kind_names, kind_names):
+    """
+    Group the site indices by kind, in a single pass over the sites.
+
+    :param site_kind_names: the kind name of each site
+    :param kind_names: the names of the kinds
+    :return: a dictionary kind name -> array of site indices, in site order
+    """
+    groups = dict((name, []) for name in kind_names)
+    for index, name in enumerate(site_kind_names):
+        groups[name].append(index)
+    return dict((name, numpy.array(indices, dtype=numpy.int64))
+                for name, indices in groups.iteritems())
+
+def get_species_coordinates(structure, speciesfiles):
+    """
+    Return the species blocks of a structure for write_input_xml.
+
+    :param structure: a StructureData (or any object with the same cell,
+        sites and kinds interface)
+    :param speciesfiles: a dictionary chemical symbol -> species file name
+    :return: a list of (speciesfile, coords) tuples, one per kind
+    """
+    sites = structure.sites
+    kinds = structure.kinds
+    positions = numpy.array([site.position for site in sites])
+    frac_coords = get_fractional_coordinates(structure.cell, positions)
+    sites_by_kind = group_sites_by_kind([site.kind_name for site in sites],
+                                        [kind.name for kind in kinds])
+    return [(speciesfiles[kind.symbol], frac_coords[sites_by_kind[kind.name]])
+            for kind in kinds]
+
+def get_groundstate_attrib(parameters_dict, kmesh):
+    """
+    Return the attributes of the groundstate element.
+
+    :param parameters_dict: the dictionary of the input parameters
+    :param kmesh: the k-point mesh
+    """
+    groundstate_attrib = dict(parameters_dict.get('groundstate', {}))
+    groundstate_attrib['ngridk'] = " ".join(['%i'%e for e in kmesh])
+    return groundstate_attrib
+
+def get_restart_mode(parameters_dict):
+    """
+    Return the value of the 'do' attribute of groundstate for a calculation
+    started from the density and potential of a parent calculation: 'skip'
+    if properties or excited states are requested (no SCF cycle),
+    'fromfile' otherwise.
+    """
+    if parameters_dict.get('properties') or parameters_dict.get('xs'):
+        return 'skip'
+    return 'fromfile'
+
+def get_properties(parameters_dict, bands_kpoints=None, bands_labels=None):
+    """
+    Return the properties to write in input.xml, as nested dictionaries
+    (see XmlStreamWriter.nested).
+
+    :param parameters_dict: the dictionary of the input parameters; its
+        'properties' key, if any, holds the properties elements
+    :param bands_kpoints: if given, an Nx3 array with the k-points of the
+        band-structure path, in fractional coordinates. The labelled
+        k-points, or all of them if none is labelled, are the vertices of
+        the path, sampled with N steps unless steps is set in the
+        parameters.
+    :param bands_labels: the (index, label) pairs of the labelled k-points
+    """
+    import copy
+
+    properties = copy.deepcopy(parameters_dict.get('properties', {}))
+    if bands_kpoints is None:
+        return properties
+
+    if bands_labels:
+        vertices = [(bands_kpoints[index], label)
+                    for index, label in bands_labels]
+    else:
+        vertices = [(kpoint, None) for kpoint in bands_kpoints]
+    points = []
+    for kpoint, label in vertices:
+        point = {'coord': [float(e) for e in kpoint]}
+        if label is not None:
+            point['label'] = label
+        points.append(point)
+
+    path = properties.setdefault('bandstructure', {}).setdefault(
+        'plot1d', {}).setdefault('path', {})
+    path['point'] = points
+    path.setdefault('steps', len(bands_kpoints))
+    return properties
+
+def get_xs(parameters_dict, kmesh):
+    """
+    Return the xs element to write in input.xml, as nested dictionaries
+    (see XmlStreamWriter.nested), or None if the parameters have no 'xs'
+    key.
+
+    The k-point mesh defaults to the one of the calculation, and the
+    q-points to Gamma only. The q-points can be given as a list of
+    3-vectors in the qpointset key.
+
+    :param parameters_dict: the dictionary of the input parameters
+    :param kmesh: the k-point mesh
+    :raise ValueError: if xstype is missing or unknown
+    """
+    import copy
+
+    if 'xs' not in parameters_dict:
+        return None
+    xs = copy.deepcopy(parameters_dict['xs'])
+    if xs.get('xstype', None) not in XS_TYPES:
+        raise ValueError("xs needs an xstype among {}".format(
+            ", ".join(XS_TYPES)))
+    xs.setdefault('ngridk', " ".join(['%i'%e for e in kmesh]))
+    qpoints = xs.setdefault('qpointset', [[0., 0., 0.]])
+    if isinstance(qpoints, (list, tuple)):
+        xs['qpointset'] = {'qpoint': [
+            {TEXT_KEY: " ".join(format_attribute_value(float(e)) for e in q)}
+            for q in qpoints]}
+    return xs
+
+def get_input_elements(parameters_dict, properties=None, xs=None):
+    """
+    Return the (tag, content) of the elements of input.xml that follow
+    groundstate, in the order of the exciting input schema, for the keys
+    of the parameters that set them.
+
+    :param properties: the content of the properties element, if it is not
+        taken as is from the parameters (see get_properties)
+    :param xs: the content of the xs element, if it is not taken as is
+        from the parameters (see get_xs)
+    """
+    contents = {'properties': properties, 'xs': xs}
+    elements = []
+    for tag in INPUT_ELEMENTS:
+        content = contents.get(tag, None)
+        if content is None:
+            content = parameters_dict.get(tag, None)
+        if content is not None and (content or tag != 'properties'):
+            elements.append((tag, content))
+    return elements
+
+def get_input_contents(parameters_dict, kmesh, bands_kpoints=None,
+                       bands_labels=None):
+    """
+    Return (groundstate_attrib, elements), the content of input.xml that
+    depends on the parameters, as passed to write_input_xml: the attributes
+    of the groundstate element and the elements that follow it.
+
+    :param parameters_dict: the dictionary of the input parameters
+    :param kmesh: the k-point mesh
+    :param bands_kpoints: the k-points of the band-structure path, if any
+        (see get_properties)
+    :param bands_labels: the (index, label) pairs of the labelled k-points
+    :raise ValueError: if the xs parameters are invalid
+    """
+    groundstate_attrib = get_groundstate_attrib(parameters_dict, kmesh)
+    properties = get_properties(parameters_dict, bands_kpoints, bands_labels)
+    xs = get_xs(parameters_dict, kmesh)
+    return groundstate_attrib, get_input_elements(parameters_dict, properties,
+                                                  xs)
+
+def format_attribute_value(value):
+    """
+    Convert a parameter value to the string used in an xml attribute.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return " ".join(format_attribute_value(v) for v in value)
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+class XmlStreamWriter(object):
+    """
+    Minimal xml writer that writes elements to a file handle as they come,
+    without building a tree in memory.
+    """
+
+    def __init__(self, handle, indent='  '):
+        self._handle = handle
+        self._indent = indent
+        self._stack = []
+
+    def raw(self, text):
+        """
+        Write text that is already formatted, such as the output of
+        render_element.
+        """
+        self._handle.write(text)
+
+    @property
+    def level(self):
+        return len(self._stack)
+
+    def _format_start(self, tag, attrib):
+        parts = [tag]
+        if attrib:
+            for key in sorted(attrib):
+                parts.append('{}={}'.format(
+                    key, quoteattr(format_attribute_value(attrib[key]))))
+        return " ".join(parts)
+
+    def start(self, tag, attrib=None):
+        self._handle.write('{}<{}>\n'.format(self._indent * len(self._stack),
+                                             self._format_start(tag, attrib)))
+        self._stack.append(tag)
+
+    def end(self):
+        tag = self._stack.pop()
+        self._handle.write('{}</{}>\n'.format(self._indent * len(self._stack),
+                                              tag))
+
+    def element(self, tag, attrib=None, text=None):
+        self._handle.write(self.render_element(tag, attrib, text))
+
+    def render_element(self, tag, attrib=None, text=None, level=None):
+        """
+        Return an element without children as a string, indented for the
+        current (or the given) nesting level.
+        """
+        if level is None:
+            level = len(self._stack)
+        prefix = self._indent * level
+        if text is None:
+            return '{}<{}/>\n'.format(prefix, self._format_start(tag, attrib))
+        return '{}<{}>{}</{}>\n'.format(
+            prefix, self._format_start(tag, attrib), escape(text), tag)
+
+    def nested(self, tag, value):
+        """
+        Write an element from nested python objects: the items of a
+        dictionary that are dictionaries (or lists of dictionaries) are
+        written as child elements, in alphabetical order; the others are
+        attributes. A list of dictionaries is written as repeated elements.
+        The value of the TEXT_KEY item, if any, is the text of an element
+        without children.
+        """
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                self.nested(tag, item)
+            return
+        attrib = {}
+        children = []
+        text = value.get(TEXT_KEY, None)
+        for key in sorted(value):
+            item = value[key]
+            if key == TEXT_KEY:
+                continue
+            if isinstance(item, dict) or (
+                    isinstance(item, (list, tuple)) and item and
+                    all(isinstance(e, dict) for e in item)):
+                children.append((key, item))
+            else:
+                attrib[key] = item
+        if not children:
+            self.element(tag, attrib, text)
+            return
+        self.start(tag, attrib)
+        for key, item in children:
+            self.nested(key, item)
+        self.end()
+
+    def atoms(self, coords):
+        """
+        Write one <atom coord="..."/> element per row of coords, formatting
+        blocks of atoms with a single string operation.
+        """
+        coords = numpy.asarray(coords)
+        line = '{}<atom coord="{}"/>\n'.format(
+            self._indent * len(self._stack),
+            " ".join([_COORD_FORMAT] * 3))
+        for start in range(0, len(coords), _ATOMS_BLOCK_SIZE):
+            block = coords[start:start + _ATOMS_BLOCK_SIZE]
+            self._handle.write((line * len(block)) % tuple(block.ravel()))
+
+    def close(self):
+        while self._stack:
+            self.end()
+
+def render_groundstate(groundstate_attrib):
+    """
+    Return the groundstate element, as written by write_input_xml.
+    """
+    return XmlStreamWriter(None).render_element('groundstate',
+                                                groundstate_attrib, level=1)
+
+def write_input_xml(handle, cell, species, groundstate_attrib,
+                    elements=None):
+    """
+    Write the exciting input.xml to an open file handle.
+
+    :param handle: the file handle
+    :param cell: the lattice vectors (in angstrom), one per row
+    :param species: a list of (speciesfile, coords) tuples, where coords is
+        an Nx3 array with the fractional coordinates of the atoms
+    :param groundstate_attrib: the attributes of the groundstate element,
+        or the element already rendered by render_groundstate
+    :param elements: if given, a list of (tag, content) of the elements
+        that follow groundstate, as returned by get_input_elements
+    """
+    writer = XmlStreamWriter(handle)
+    writer.start('input')
+    writer.element('title', text=INPUT_TITLE)
+    writer.start('structure', {'speciespath': './', 'autormt': 'true'})
+    writer.start('crystal', {'scale': CRYSTAL_SCALE})
+    for vector in cell:
+        writer.element('basevect',
+                       text=" ".join([_COORD_FORMAT % e for e in vector]))
+    writer.end()
+    for speciesfile, coords in species:
+        writer.start('species', {'speciesfile': speciesfile})
+        writer.atoms(coords)
+        writer.end()
+    writer.end()
+    if isinstance(groundstate_attrib, basestring):
+        writer.raw(groundstate_attrib)
+    else:
+        writer.element('groundstate', groundstate_attrib)
+    for tag, content in elements or []:
+        writer.nested(tag, content)
+    writer.close()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Live monitoring of the SCF convergence of running exciting calculations.
+
+The info.xml file in the remote working directory is read incrementally
+while the job is running; when the deltae series meets one of the
+divergence or stagnation criteria set in the 'SCF_MONITOR' key of the
+calculation settings, the job is killed. Killed calculations are FAILED and
+never retrieved nor parsed, so the verdict of the monitor is recorded
+beforehand in the SCF_MONITOR_EXTRA extra (see get_scf_monitor_status).
+
+Typical use, in a script running alongside the daemon::
+
+    from aiida_exciting.calculations.monitor import ScfMonitor
+    ScfMonitor().run(calcs, interval=120)
+"""
+import time
+
+from aiida_exciting.parsers.parse_xml_output import IncrementalInfoXmlParser
+
+# key of the calculation settings holding the monitoring criteria
+SCF_MONITOR_KEY = 'SCF_MONITOR'
+# name of the extra in which the monitor stores the failure status
+SCF_MONITOR_EXTRA = 'scf_monitor'
+
+SCF_DIVERGED = 'SCF_DIVERGED'
+SCF_STAGNATED = 'SCF_STAGNATED'
+
+_DEFAULT_CRITERIA = {
+    # do not judge the run before this number of iterations
+    'min_iterations': 5,
+    # stop if |deltae| grows above this factor times its best value
+    'divergence_factor': 10.,
+    # stop if the best |deltae| did not improve over this many iterations
+    # (None disables the check)
+    'stagnation_window': None,
+    # improvement of the best |deltae| required within the window
+    'stagnation_ratio': 0.5,
+    }
+
+def get_scf_monitor_criteria(settings_dict):
+    """
+    Return the monitoring criteria from the calculation settings.
+
+    :param settings_dict: the calculation settings dictionary
+    :return: the criteria, with defaults filled in, or None if the
+        calculation is not monitored.
+    :raise ValueError: if the criteria are not valid
+    """
+    value = settings_dict.get(SCF_MONITOR_KEY, None)
+    if not value:
+        return None
+    criteria = dict(_DEFAULT_CRITERIA)
+    if value is not True:
+        if not isinstance(value, dict):
+            raise ValueError("{} must be True or a dictionary".format(
+                SCF_MONITOR_KEY))
+        unknown = set(value) - set(_DEFAULT_CRITERIA)
+        if unknown:
+            raise ValueError("Unknown {} criteria: {}".format(
+                SCF_MONITOR_KEY, ", ".join(sorted(unknown))))
+        criteria.update(value)
+    if criteria['min_iterations'] < 1:
+        raise ValueError("min_iterations must be positive")
+    if criteria['divergence_factor'] is not None and \
+            criteria['divergence_factor'] <= 1.:
+        raise ValueError("divergence_factor must be larger than 1")
+    if criteria['stagnation_window'] is not None and \
+            criteria['stagnation_window'] < 1:
+        raise ValueError("stagnation_window must be positive")
+    return criteria
+
+def check_scf_convergence(deltae, criteria):
+    """
+    Apply the monitoring criteria to a deltae series.
+
+    :param deltae: the sequence of deltae values, one per SCF iteration
+    :param criteria: the criteria as returned by get_scf_monitor_criteria
+    :return: None if the run may continue, otherwise a tuple
+        (status, message) with status SCF_DIVERGED or SCF_STAGNATED.
+    """
+    niter = len(deltae)
+    if niter < criteria['min_iterations']:
+        return None
+
+    absde = [abs(de) for de in deltae]
+    best = min(absde)
+
+    factor = criteria['divergence_factor']
+    if factor is not None and best > 0. and absde[-1] > factor * best:
+        return (SCF_DIVERGED,
+                "|deltae| = {:.3e} at iteration {} is more than {} times "
+                "the best value {:.3e}".format(absde[-1], niter, factor, best))
+
+    window = criteria['stagnation_window']
+    if window is not None and niter > window:
+        best_before = min(absde[:-window])
+        best_window = min(absde[-window:])
+        if best_window > criteria['stagnation_ratio'] * best_before:
+            return (SCF_STAGNATED,
+                    "|deltae| did not improve below {:.3e} in the last {} "
+                    "iterations".format(
+                        criteria['stagnation_ratio'] * best_before, window))
+
+    return None
+
+def get_scf_monitor_status(calc):
+    """
+    Return the (status, message) set by the monitor on a calculation,
+    or None if the monitor did not stop it.
+    """
+    value = calc.get_extra(SCF_MONITOR_EXTRA, None)
+    if not value:
+        return None
+    return value['status'], value['message']
+
+class ScfMonitor(object):
+    """
+    Poll the info.xml of running ExcitingCalculations and stop the ones
+    whose SCF diverges or stagnates.
+
+    Only the bytes appended since the previous poll are transferred; the
+    parser state of each calculation is kept between polls.
+    """
+
+    _INFO_FILE_NAME = 'info.xml'
+
+    def __init__(self):
+        self._parsers = {}
+
+    def poll(self, calc):
+        """
+        Read the new part of the remote info.xml of calc and apply its
+        criteria.
+
+        :return: None, or the (status, message) with which calc was stopped
+        """
+        from aiida.common.datastructures import calc_states
+
+        settings = calc.get_inputs_dict().get(calc.get_linkname('settings'),
+                                              None)
+        criteria = get_scf_monitor_criteria(
+            settings.get_dict() if settings is not None else {})
+        if criteria is None:
+            return None
+
+        if calc.get_state() != calc_states.WITHSCHEDULER:
+            return None
+
+        parser = self._parsers.get(calc.pk, None)
+        if parser is None:
+            parser = IncrementalInfoXmlParser()
+
+        data = self._read_new_data(calc, parser.nbytes)
+        if data is None:
+            # the file was rewritten: start over
+            parser = IncrementalInfoXmlParser()
+            data = self._read_new_data(calc, parser.nbytes)
+        self._parsers[calc.pk] = parser
+        if not data:
+            return None
+
+        history = parser.feed(data).history
+        result = check_scf_convergence(history.get('energy_accuracy', []),
+                                       criteria)
+        if result is not None:
+            self.stop(calc, result[0], result[1])
+        return result
+
+    def stop(self, calc, status, message):
+        """
+        Kill the job of calc and mark it with the given failure status.
+        """
+        calc.logger.error("SCF monitor: {}, killing the job: {}".format(
+            status, message))
+        calc.set_extra(SCF_MONITOR_EXTRA, {'status': status,
+                                           'message': message})
+        calc.kill()
+        self._parsers.pop(calc.pk, None)
+
+    def run(self, calcs, interval=60):
+        """
+        Poll the given calculations every `interval` seconds, until none of
+        them is running any more.
+        """
+        from aiida.common.datastructures import calc_states
+
+        pending = list(calcs)
+        while pending:
+            for calc in pending:
+                try:
+                    self.poll(calc)
+                except Exception as e:
+                    calc.logger.warning("SCF monitor: cannot poll {}: "
+                                        "{}".format(calc.pk, e))
+            pending = [c for c in pending if c.get_state() in (
+                calc_states.NEW, calc_states.TOSUBMIT, calc_states.SUBMITTING,
+                calc_states.WITHSCHEDULER)]
+            if pending:
+                time.sleep(interval)
+
+    def _read_new_data(self, calc, offset):
+        """
+        Return the bytes of the remote info.xml from offset onwards, an
+        empty string if the file does not exist yet, or None if the file is
+        now shorter than offset.
+        """
+        import os
+        from aiida.common.utils import escape_for_bash
+
+        path = os.path.join(calc._get_remote_workdir(), self._INFO_FILE_NAME)
+        with calc._get_transport() as t:
+            if not t.isfile(path):
+                return ''
+            size = t.get_attribute(path).st_size
+            if size < offset:
+                return None
+            if size == offset:
+                return ''
+            retval, stdout, stderr = t.exec_command_wait(
+                "tail -c +{} {}".format(offset + 1, escape_for_bash(path)))
+        if retval != 0:
+            raise IOError("Cannot read {}: {}".format(path, stderr))
+        if isinstance(stdout, unicode):
+            stdout = stdout.encode('utf-8')
+        return stdout
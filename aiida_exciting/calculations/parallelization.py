@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Choice of the hybrid MPI/OpenMP layout of exciting jobs.
+
+exciting distributes the irreducible k-points over the MPI processes and
+parallelizes the work on each k-point with OpenMP threads. There are never
+more processes than k-points, since the extra ones would have nothing to
+do, and numbers of processes that divide the k-points evenly are
+preferred; the cores left over go to the threads. Among these layouts,
+the one minimizing the time of the slowest process is chosen, modelling
+the OpenMP speedup on a k-point as threads**openmp_scaling.
+"""
+import math
+
+# exponent of the OpenMP speedup model
+DEFAULT_OPENMP_SCALING = 0.75
+
+def _divisors(n):
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+def get_parallel_layout(nkpoints, num_machines, num_cores_per_machine,
+                        openmp_scaling=DEFAULT_OPENMP_SCALING):
+    """
+    Return the MPI/OpenMP layout for a number of k-points.
+
+    The number of processes per machine divides the number of cores, so
+    that every process has the same number of threads.
+
+    :param nkpoints: the number of irreducible k-points
+    :param num_machines: the number of machines of the job
+    :param num_cores_per_machine: the number of cores of each machine
+    :return: a dictionary with num_mpiprocs_per_machine, num_mpiprocs
+        (in total), omp_num_threads and kpoints_per_mpiproc (of the most
+        loaded process)
+    """
+    if nkpoints < 1 or num_machines < 1 or num_cores_per_machine < 1:
+        raise ValueError("The number of k-points, machines and cores must "
+                         "be positive")
+
+    candidates = [procs_per_machine
+                  for procs_per_machine in _divisors(num_cores_per_machine)
+                  if procs_per_machine * num_machines <= nkpoints]
+    if not candidates:
+        # fewer k-points than machines: one process on each of them
+        candidates = [1]
+
+    best = None
+    for procs_per_machine in candidates:
+        num_mpiprocs = procs_per_machine * num_machines
+        threads = num_cores_per_machine // procs_per_machine
+        kpoints_per_proc = int(math.ceil(float(nkpoints) / num_mpiprocs))
+        cost = kpoints_per_proc / threads**openmp_scaling
+        key = (nkpoints % num_mpiprocs != 0, round(cost, 12), -num_mpiprocs)
+        if best is None or key < best[0]:
+            best = (key, {
+                'num_mpiprocs_per_machine': procs_per_machine,
+                'num_mpiprocs': num_mpiprocs,
+                'omp_num_threads': threads,
+                'kpoints_per_mpiproc': kpoints_per_proc,
+                })
+    return best[1]
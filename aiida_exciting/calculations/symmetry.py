@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Point-group symmetry of a structure and number of irreducible k-points of
+a Monkhorst-Pack mesh, as reduced by exciting.
+
+Rotations are integer matrices acting on fractional coordinates (column
+vectors). Only numpy is used: the lattice rotations are found among all
+the unimodular matrices with entries -1, 0, 1, and the rotations of the
+crystal are those for which a translation maps every atom onto an atom of
+the same kind, found on a hashed grid of the atomic positions.
+"""
+import itertools
+
+import numpy
+
+from aiida_exciting.calculations.input_xml import get_fractional_coordinates
+
+# default tolerance on atomic positions, in angstrom
+DEFAULT_SYMPREC = 1e-3
+
+def _get_candidate_matrices():
+    entries = numpy.array(list(itertools.product((-1, 0, 1), repeat=9)))
+    matrices = entries.reshape(-1, 3, 3)
+    dets = numpy.rint(numpy.linalg.det(matrices)).astype(int)
+    return matrices[numpy.abs(dets) == 1]
+
+_CANDIDATES = None
+
+def get_lattice_rotations(cell, tolerance=1e-5):
+    """
+    Return the rotations (in fractional coordinates) that leave the lattice
+    invariant, as an array of shape (nrot, 3, 3).
+
+    :param cell: 3x3 array, one lattice vector per row
+    :param tolerance: relative tolerance on the metric tensor
+    """
+    global _CANDIDATES
+    if _CANDIDATES is None:
+        _CANDIDATES = _get_candidate_matrices()
+
+    cell = numpy.asarray(cell, dtype=numpy.float64)
+    metric = cell.dot(cell.T)
+    # R^T G R for all the candidates at once
+    rotated = numpy.einsum('nji,jk,nkl->nil', _CANDIDATES, metric, _CANDIDATES)
+    error = numpy.abs(rotated - metric).reshape(len(_CANDIDATES), -1).max(axis=1)
+    return _CANDIDATES[error <= tolerance * numpy.abs(metric).max()]
+
+class _SiteLookup(object):
+    """
+    Hashed grid of the atoms of a crystal, to find the atom within symprec
+    of a point with a binary search instead of a comparison with all the
+    atoms.
+
+    The unit cell is divided in bins at least 4 symprec wide. Along each
+    axis, an atom is filed in the grid in which it is farthest from a bin
+    boundary: the unshifted one, or the one shifted by half a bin. A point
+    within symprec of the atom then falls in the same bin, in the same
+    grid, and is found by trying the 8 combinations of grids.
+    """
+
+    def __init__(self, cell, fractional, types, symprec):
+        self.cell = cell
+        self.fractional = fractional
+        self.types = types
+        self.symprec = symprec
+        # fractional coordinate change along each axis for a cartesian
+        # displacement of length 1
+        reciprocal_norms = numpy.sqrt((numpy.linalg.inv(cell)**2).sum(axis=0))
+        self.nbins = numpy.maximum(1, numpy.minimum(
+            1 << 20, (1. / (4. * symprec * reciprocal_norms)).astype(numpy.int64)))
+
+        scaled = (fractional % 1.) * self.nbins
+        offset = scaled % 1.
+        shifts = (numpy.abs(offset - 0.5) > 0.25).astype(numpy.int64)
+        keys = self._get_keys(scaled, shifts)
+        self._order = keys.argsort(kind='mergesort')
+        self._keys = keys[self._order]
+        if len(self._keys) > 1 and (self._keys[1:] == self._keys[:-1]).any():
+            raise ValueError("Some atoms are closer than the symmetry "
+                             "tolerance")
+
+    def _get_keys(self, scaled, shifts):
+        bins = numpy.floor(scaled + 0.5 * shifts).astype(numpy.int64) % self.nbins
+        key = shifts[..., 0] * 4 + shifts[..., 1] * 2 + shifts[..., 2]
+        for axis in range(3):
+            key = key * self.nbins[axis] + bins[..., axis]
+        return key
+
+    def match(self, points, types):
+        """
+        Return, for each point (Mx3 fractional coordinates), whether an
+        atom of the given kind lies within symprec.
+        """
+        scaled = (points % 1.) * self.nbins
+        matched = numpy.zeros(len(points), dtype=bool)
+        for shifts in itertools.product((0, 1), repeat=3):
+            keys = self._get_keys(scaled, numpy.array(shifts, dtype=numpy.int64))
+            positions = numpy.minimum(numpy.searchsorted(self._keys, keys),
+                                      len(self._keys) - 1)
+            found = self._keys[positions] == keys
+            atoms = self._order[positions]
+            diff = points - self.fractional[atoms]
+            diff -= numpy.rint(diff)
+            distance = numpy.sqrt((diff.dot(self.cell)**2).sum(axis=1))
+            matched |= (found & (self.types[atoms] == types) &
+                        (distance < self.symprec))
+        return matched
+
+# atoms on which the candidate translations are checked first, number of
+# candidates checked together and number of points matched per call
+_SAMPLE_SIZE = 32
+_CANDIDATE_BLOCK_SIZE = 256
+_BLOCK_SIZE = 4096
+
+def _get_unmatched_atom(lookup, points, types):
+    """
+    Return the index of the first point that is not on an atom of its
+    kind, or None if all are.
+    """
+    for start in range(0, len(points), _BLOCK_SIZE):
+        matched = lookup.match(points[start:start + _BLOCK_SIZE],
+                               types[start:start + _BLOCK_SIZE])
+        if not matched.all():
+            return start + int(matched.argmin())
+    return None
+
+def _find_translation(lookup, rotated, types, sample, breakers, candidates):
+    """
+    Return True if one of the candidate translations maps the rotated
+    atoms onto the crystal.
+
+    The candidates are first checked on the atoms that broke previous
+    candidates (e.g. a displaced atom), one at a time, then on the sample
+    of the atoms at once, and only the remaining ones on all the atoms.
+    The atoms that break a candidate, and the atom of the sample that
+    breaks the most, are added to breakers.
+    """
+    for atom in breakers:
+        if not len(candidates):
+            return False
+        candidates = candidates[lookup.match(rotated[atom] + candidates,
+                                             types[atom])]
+    if len(candidates):
+        points = rotated[sample][None, :, :] + candidates[:, None, :]
+        matched = lookup.match(
+            points.reshape(-1, 3), numpy.tile(types[sample], len(candidates))
+            ).reshape(len(candidates), -1)
+        rejections = (~matched).sum(axis=0)
+        if rejections.any() and sample[rejections.argmax()] not in breakers:
+            breakers.insert(0, sample[rejections.argmax()])
+        candidates = candidates[matched.all(axis=1)]
+    while len(candidates):
+        unmatched = _get_unmatched_atom(lookup, rotated + candidates[0], types)
+        if unmatched is None:
+            return True
+        if unmatched not in breakers:
+            breakers.insert(0, unmatched)
+        candidates = candidates[1:]
+        candidates = candidates[lookup.match(rotated[unmatched] + candidates,
+                                             types[unmatched])]
+    return False
+
+def get_crystal_rotations(cell, positions, types, symprec=DEFAULT_SYMPREC):
+    """
+    Return the rotations of the space group of a crystal (its point group,
+    in fractional coordinates), as an array of shape (nrot, 3, 3).
+
+    Each candidate rotation and translation is checked in O(N log N) time
+    and O(N) memory for N atoms (see _SiteLookup).
+
+    :param cell: 3x3 array, one lattice vector per row
+    :param positions: Nx3 array of cartesian positions
+    :param types: the N kind names of the atoms
+    :param symprec: tolerance on the positions, in angstrom
+    """
+    cell = numpy.asarray(cell, dtype=numpy.float64)
+    fractional = get_fractional_coordinates(cell, positions)
+    types = numpy.asarray(types)
+    lattice_rotations = get_lattice_rotations(cell)
+    if len(fractional) == 0:
+        return lattice_rotations
+
+    # the translations are guessed from the atoms of the rarest kind
+    kinds, counts = numpy.unique(types, return_counts=True)
+    reference_kind = kinds[counts.argmin()]
+    reference = numpy.nonzero(types == reference_kind)[0]
+    lookup = _SiteLookup(cell, fractional, types, symprec)
+    sample = numpy.unique(numpy.linspace(
+        0, len(fractional) - 1, min(len(fractional), _SAMPLE_SIZE)).astype(int))
+    breakers = []
+
+    rotations = []
+    for rotation in lattice_rotations:
+        rotated = fractional.dot(rotation.T)
+        translations = fractional[reference] - rotated[reference[0]]
+        for start in range(0, len(translations), _CANDIDATE_BLOCK_SIZE):
+            if _find_translation(
+                    lookup, rotated, types, sample, breakers,
+                    translations[start:start + _CANDIDATE_BLOCK_SIZE]):
+                rotations.append(rotation)
+                break
+    return numpy.array(rotations)
+
+def count_irreducible_kpoints(mesh, offset, rotations, time_reversal=True):
+    """
+    Return the number of irreducible k-points of a mesh.
+
+    Only the rotations that map the (possibly shifted) mesh onto itself
+    are used; with time_reversal, k and -k are also equivalent.
+
+    :param mesh: the number of k-points along each reciprocal vector
+    :param offset: the shift of the mesh, in units of the mesh step
+    :param rotations: the rotations of the crystal, in fractional
+        coordinates of the direct lattice
+    """
+    mesh = numpy.array(mesh, dtype=int)
+    offset = numpy.array(offset, dtype=numpy.float64)
+    indices = numpy.indices(mesh).reshape(3, -1).T
+    kpoints = (indices + offset) / mesh
+
+    # a rotation R of the direct lattice acts as R^-T on k
+    operations = [numpy.rint(numpy.linalg.inv(r).T).astype(int)
+                  for r in rotations]
+    if time_reversal:
+        operations += [-op for op in operations]
+
+    representatives = numpy.arange(len(kpoints))
+    for op in operations:
+        mapped = kpoints.dot(op.T) * mesh - offset
+        rounded = numpy.rint(mapped)
+        if numpy.abs(mapped - rounded).max() > 1e-6:
+            continue
+        mapped_indices = numpy.ravel_multi_index(
+            (rounded.astype(int) % mesh).T, mesh)
+        representatives = numpy.minimum(representatives, mapped_indices)
+    # the group of operations is closed, so the smallest index of each
+    # orbit identifies it
+    return len(numpy.unique(representatives))
+
+def get_irreducible_kpoint_count(structure, mesh, offset=(0., 0., 0.),
+                                 symprec=DEFAULT_SYMPREC):
+    """
+    Return the number of irreducible k-points of a mesh for a StructureData.
+    """
+    rotations = get_crystal_rotations(
+        structure.cell, [site.position for site in structure.sites],
+        [site.kind_name for site in structure.sites], symprec=symprec)
+    return count_irreducible_kpoints(mesh, offset, rotations)
@@ -7,15 +7,17 @@ def lapwbasis():
 @click.option('--fmt', type=str, help='Format of the species: \"xml\" or \"json\""', required=True)
 @click.option('--name', type=str, help='Name of the LAPW basis set', required=True)
 @click.option('--description', type=str, help='Description of the set', required=False)
+@click.option('--timing', is_flag=True, help='Print the time spent in each phase of the upload')
 @click.argument('path', type=str, required=True)
-def upload_command(path, fmt, name, description):
+def upload_command(path, fmt, name, description, timing):
     """Upload a new set of LAPW basis files"""
     import os.path
+    import sys
 
     stop_if_existing = False
 
     if not fmt in ["xml", "json"]:
-        print >> sys.stderr, ("wrong species format: %s"%parsed_args.fmt)
+        print >> sys.stderr, ("wrong species format: %s"%fmt)
         sys.exit(1)
     
     folder = os.path.abspath(path)
@@ -30,12 +32,26 @@ def upload_command(path, fmt, name, description):
 
     if not description: description=""
 
-    files_found, files_uploaded = lapwbasis.upload_family(folder, name, description, fmt, stop_if_existing)
+    stage_names = {'read': 'Reading species files', 'store': 'Storing species'}
+
+    def progress(stage, done, total):
+        click.echo("\r{}: {}/{}".format(stage_names[stage], done, total), nl=(done == total))
+
+    from aiida_exciting.timing import get_timer
+    timer = get_timer(timing)
+
+    files_found, files_uploaded = lapwbasis.upload_family(folder, name, description, fmt, stop_if_existing,
+                                                          progress=progress, timer=timer)
 
     print "Species files found: {}. New files uploaded: {}".format(files_found, files_uploaded)
+    for phase, record in sorted(timer.as_dict().iteritems()):
+        print "{}: {:.3f} s, memory growth {} kB".format(phase, record['wall_time'], record['memory_growth_kb'])
 
 @lapwbasis.command('list')
-def list_command():
+@click.option('--user', type=str, help='Show only the sets of this user (email)', required=False)
+@click.option('--element', 'elements', type=str, multiple=True, help='Show only the sets containing this element (can be repeated)')
+@click.option('--json', 'as_json', is_flag=True, help='Print the sets as JSON, for scripts')
+def list_command(user, elements, as_json):
     """List the uploaded sets of LAPW basis files"""
     
     with_description = True
@@ -45,18 +61,119 @@ def list_command():
     from aiida.orm import DataFactory
 
     LapwbasisData = DataFactory('exciting.lapwbasis')
-    groups = LapwbasisData.get_lapwbasis_groups()
+    families = LapwbasisData.get_lapwbasis_family_summaries(
+        filter_elements=list(elements) or None, user=user)
 
-    if groups:
-        for g in groups:
-            sp = LapwbasisData.query(dbgroups=g.dbgroup).distinct()
-            num_sp = sp.count()
+    if as_json:
+        import json
+        print json.dumps(families, indent=2)
+        return
 
+    if families:
+        for family in families:
             if with_description:
-                description_string = ": {}".format(g.description)
+                description_string = ": {}".format(family['description'])
             else:
                 description_string = ""
 
-            print "* {} [{} species]{}".format(g.name, num_sp, description_string)
+            print "* {} [{} species]{}".format(family['name'], family['num_species'], description_string)
     else:
         print "No LAPW basis sets were found."
+
+@lapwbasis.command('reindex')
+@click.option('--name', 'names', type=str, multiple=True, help='Name of the LAPW basis set to index (default: all; can be repeated)')
+def reindex_command(names):
+    """Rebuild the element index of the sets of LAPW basis files"""
+    from aiida import load_dbenv
+    load_dbenv()
+    from aiida_exciting.data.lapwbasis import LapwbasisData, update_lapwbasis_family_index
+
+    if not names:
+        names = [g.name for g in LapwbasisData.get_lapwbasis_groups()]
+
+    for name in names:
+        md5s = update_lapwbasis_family_index(name)
+        print "* {}: {}".format(name, " ".join(sorted(md5s)))
+
+@lapwbasis.command('delete')
+@click.option('--name', type=str, help='Name of the LAPW basis set to delete', required=True)
+@click.option('--force', is_flag=True, help='Do not ask for confirmation')
+def delete_command(name, force):
+    """Delete a set of LAPW basis files (the species files are kept)"""
+    if not force:
+        click.confirm("Delete the LAPW basis set {}?".format(name), abort=True)
+
+    from aiida import load_dbenv
+    load_dbenv()
+    from aiida_exciting.data.lapwbasis import delete_lapwbasis_family
+
+    delete_lapwbasis_family(name)
+    print "LAPW basis set {} deleted.".format(name)
+
+@lapwbasis.group('cache')
+def cache():
+    """Manage the remote cache of LAPW species files"""
+
+def _get_cache_computer(computer):
+    from aiida import load_dbenv
+    load_dbenv()
+    from aiida.orm import Computer
+
+    return Computer.get(computer)
+
+@cache.command('sync')
+@click.option('--computer', type=str, help='Name of the computer hosting the cache', required=True)
+@click.option('--path', type=str, help='Absolute path of the cache directory on the computer', required=True)
+@click.option('--name', type=str, help='Name of the LAPW basis set to cache (default: all)', required=False)
+def cache_sync_command(computer, path, name):
+    """Upload the species files that are missing in the remote cache"""
+    computer = _get_cache_computer(computer)
+    from aiida_exciting.data.lapwbasis import LapwbasisData
+    from aiida_exciting.data.lapwbasis_cache import sync_remote_cache
+
+    if name:
+        groups = [LapwbasisData.get_lapwbasis_group(name)]
+    else:
+        groups = LapwbasisData.get_lapwbasis_groups()
+
+    nodes = {}
+    for g in groups:
+        for node in g.nodes:
+            if isinstance(node, LapwbasisData):
+                nodes[node.md5] = node
+
+    nuploaded = sync_remote_cache(computer, path, nodes.values())
+
+    print "Species files: {}. New files uploaded: {}".format(len(nodes), nuploaded)
+
+@cache.command('list')
+@click.option('--computer', type=str, help='Name of the computer hosting the cache', required=True)
+@click.option('--path', type=str, help='Absolute path of the cache directory on the computer', required=True)
+def cache_list_command(computer, path):
+    """List the species files in the remote cache"""
+    computer = _get_cache_computer(computer)
+    from aiida_exciting.data.lapwbasis_cache import list_remote_cache
+
+    entries = list_remote_cache(computer, path)
+    if entries:
+        for md5, size, nodes in entries:
+            if nodes:
+                nodes_string = ", ".join("{} (pk {})".format(n.filename, n.pk) for n in nodes)
+            else:
+                nodes_string = "unused"
+            print "* {} [{} bytes]: {}".format(md5, size, nodes_string)
+    else:
+        print "The cache is empty."
+
+@cache.command('prune')
+@click.option('--computer', type=str, help='Name of the computer hosting the cache', required=True)
+@click.option('--path', type=str, help='Absolute path of the cache directory on the computer', required=True)
+@click.option('--all', 'remove_all', is_flag=True, help='Remove all files, not only the unused ones')
+def cache_prune_command(computer, path, remove_all):
+    """Remove unused species files from the remote cache"""
+    computer = _get_cache_computer(computer)
+    from aiida_exciting.data.lapwbasis_cache import prune_remote_cache
+
+    removed = prune_remote_cache(computer, path, remove_all=remove_all)
+
+    print "Species files removed: {}".format(len(removed))
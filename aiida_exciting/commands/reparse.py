@@ -0,0 +1,45 @@
+import click
+@click.group()
+def exciting():
+    """Help for exciting command"""
+
+@exciting.command('reparse')
+@click.option('--group', type=str, help='Reparse only the calculations in this group', required=False)
+@click.option('--pk', 'pks', type=int, multiple=True, help='Reparse only this calculation (can be repeated)')
+@click.option('--pk-min', type=int, help='Reparse only the calculations with a larger or equal pk', required=False)
+@click.option('--pk-max', type=int, help='Reparse only the calculations with a smaller or equal pk', required=False)
+@click.option('--state', 'states', type=click.Choice(['FINISHED', 'FAILED']), multiple=True, help='State of the calculations to reparse (default: FINISHED; can be repeated)')
+@click.option('--label', type=str, default='reparse', help='Name of this reparsing: calculations already reparsed with it are skipped')
+@click.option('--retry-failed', is_flag=True, help='Reparse again the calculations whose reparsing failed')
+@click.option('--processes', type=int, help='Number of parsing processes (default: one per CPU)', required=False)
+@click.option('--batch-size', type=int, default=100, help='Number of calculations stored per database transaction')
+@click.option('--dry-run', is_flag=True, help='Parse the files without storing anything')
+def reparse_command(group, pks, pk_min, pk_max, states, label, retry_failed, processes, batch_size, dry_run):
+    """Reparse the retrieved files of exciting calculations"""
+    from aiida import load_dbenv
+    load_dbenv()
+    from aiida_exciting.parsers.reparse import select_calculations, reparse_calculations
+
+    selected = select_calculations(label, group=group, pks=pks, pk_min=pk_min, pk_max=pk_max,
+                                   states=states or ('FINISHED',), retry_failed=retry_failed)
+    if not selected:
+        print "No calculations to reparse."
+        return
+
+    def progress(done, total, nfailed, elapsed):
+        click.echo("\rProcessed {}/{} calculations ({:.1f}/s), failures: {}".format(
+            done, total, done / max(elapsed, 1e-9), nfailed), nl=(done == total))
+
+    nreparsed, nparsed, failures = reparse_calculations(selected, label, processes=processes,
+                                                        batch_size=batch_size, dry_run=dry_run,
+                                                        progress=progress)
+
+    if dry_run:
+        print "Dry run, nothing stored. Calculations parsed: {}. Failures: {}".format(
+            nparsed, len(failures))
+    else:
+        print "Calculations reparsed: {}. Failures: {}".format(nreparsed, len(failures))
+    for pk, reason in failures[:20]:
+        print "* pk {}: {}".format(pk, reason)
+    if len(failures) > 20:
+        print "... and {} more".format(len(failures) - 20)
@@ -4,30 +4,40 @@ This module manages the LAPW species files in the local repository.
 
 from aiida.orm.data.singlefile import SinglefileData
 from aiida.common.utils import classproperty
+from aiida_exciting.data.species import parse_species_file, read_species_files
+from aiida_exciting.timing import NULL_TIMER
 
 LAPWBASIS_GROUP_TYPE = 'data.lapwbasis.family'
 
-def parse_species_file(filename, fmt):
-    """
-    Parse xml or json species file
-    """
-    properties = {}
-    if fmt == 'xml':
-        from xml.dom.minidom import parse
-        species = parse(filename)
-        node = species.getElementsByTagName('sp')[0]
-        properties['chemical_symbol'] = node.attributes['chemicalSymbol'].value
-    if fmt == 'json':
-        import json
-        with open(filename) as data_file:    
-            data = json.load(data_file)
-            properties['chemical_symbol'] = data['symbol']
-    return properties
+# properties of the species files stored as LapwbasisData attributes,
+# besides the chemical symbol
+BASIS_ATTRIBUTES = ['muffin_tin_radius', 'num_core_states',
+                    'num_valence_states', 'num_local_orbitals',
+                    'linearization_energy', 'linearization_energies']
+
+# type of the companion group, with the name of the family, holding the
+# ParameterData that indexes the elements of the family; the family group
+# itself only holds LapwbasisData
+LAPWBASIS_INDEX_GROUP_TYPE = 'data.lapwbasis.family_index'
+
+# extras of the index node: a version marker, the sorted list of elements,
+# the map chemical symbol -> md5 and a True flag per element, so that the
+# families covering a set of elements are found with a single query
+LAPWBASIS_INDEX_EXTRA = 'lapwbasis_family_index'
+LAPWBASIS_INDEX_VERSION = 1
+LAPWBASIS_ELEMENTS_EXTRA = 'lapwbasis_elements'
+LAPWBASIS_MD5_EXTRA = 'lapwbasis_md5'
+LAPWBASIS_ELEMENT_EXTRA_PREFIX = 'lapwbasis_has_'
 
 def upload_family(folder, group_name, group_description,
-                  fmt, stop_if_existing=True):
+                  fmt, stop_if_existing=True, progress=None, threads=None,
+                  timer=NULL_TIMER):
     """
     Upload a set of LAPW species files in a given group.
+
+    The files are hashed and parsed concurrently in a thread pool, and the
+    species already in the database are found with a single query over all
+    the md5 checksums.
     
     :param folder: a path containing all LAPW species files to be added.
         Only files ending in .xml or .json (case-insensitive) are considered.
@@ -39,6 +49,15 @@ def upload_family(folder, group_name, group_description,
     :param stop_if_existing: if True, check for the md5 of the files and,
         if the file already exists in the DB, raises a MultipleObjectsError.
         If False, simply adds the existing LapwbasisData node to the group.
+    :param progress: if given, a callable progress(stage, done, total)
+        called while files are read (stage 'read') and nodes are stored
+        (stage 'store')
+    :param threads: number of threads used to read the files (default: one
+        per CPU)
+    :param timer: a aiida_exciting.timing.PhaseTimer, to record the time
+        spent reading the files, querying the md5 checksums, storing the
+        nodes and updating the element index of the family; the phases are
+        also logged
     """
     import os
 
@@ -47,6 +66,7 @@ def upload_family(folder, group_name, group_description,
     from aiida.orm import Group
     from aiida.common.exceptions import UniquenessError, NotExistent
     from aiida.backends.utils import get_automatic_user
+    from aiida_exciting.transaction import batch_transaction
 
     if not os.path.isdir(folder):
         raise ValueError("folder must be a directory")
@@ -55,6 +75,8 @@ def upload_family(folder, group_name, group_description,
     # go to the real file if it is a symlink
     files = [os.path.realpath(os.path.join(folder, i)) for i in os.listdir(folder) if
              os.path.isfile(os.path.join(folder, i)) and i.lower().endswith('.'+fmt)]
+    # sorted, so that duplicated files are always resolved in the same way
+    files.sort()
 
     nfiles = len(files)
 
@@ -74,42 +96,383 @@ def upload_family(folder, group_name, group_description,
     # Always update description, even if the group already existed
     group.description = group_description
 
-    # find species that are already in the group
-    md5_list = []
-    if not group_created:
-        for aiida_n in group.nodes:
-            # Skip other nodes
-            if isinstance(aiida_n, LapwbasisData):
-                md5_list.append(aiida_n.md5)
+    # hash and parse the files, concurrently if there are many
+    with timer.phase('read_files'):
+        file_info = read_species_files(files, fmt, progress=progress,
+                                       threads=threads)
+
+    with timer.phase('query_md5'):
+        # find species that are already in the group
+        if group_created:
+            md5_list = set()
+        else:
+            md5_list = LapwbasisData.get_md5_in_group(group)
+
+        # find the species already in the DB, with a single query
+        existing = LapwbasisData.from_md5_list(
+            set(md5sum for f, md5sum, properties in file_info))
 
     # NOTE: GROUP IS SAVED ONLY AFTER CHECKS OF UNICITY
     
     species_list = []
-    for f in files:
-        sp = LapwbasisData.get_or_create(f, fmt, use_first=not stop_if_existing)
-        if not sp[0].md5 in md5_list:
-            md5_list.append(sp[0].md5)
-            species_list.append(sp)
-
-    # At this point, save the group, if still unstored
-    if group_created:
-        group.store()
-
-    # save species in the database, and add them to group    
-    for sp, created in species_list:
-        if created:
-            sp.store()
-            aiidalogger.debug("New node {} created for file {}".format(sp.uuid, sp.filename))
+    for f, md5sum, properties in file_info:
+        if md5sum in md5_list:
+            continue
+        species = existing.get(md5sum, [])
+        if len(species) == 0:
+            sp = (LapwbasisData._from_properties(f, md5sum, properties), True)
+        elif len(species) == 1 or not stop_if_existing:
+            sp = (species[0], False)
         else:
-            aiidalogger.debug("Reusing node {} for file {}".format(sp.uuid, sp.filename))
-
-    # Add elements to the group all togetehr
-    group.add_nodes(sp for sp, created in species_list)
+            raise ValueError("More than one copy of a species file "
+                             "with the same MD5 has been found in the "
+                             "DB. pks={}".format(",".join([str(i.pk) for i in species])))
+        md5_list.add(md5sum)
+        species_list.append(sp)
+
+    # At this point, save the group, if still unstored, and the species,
+    # and add them to the group, in a single transaction
+    with timer.phase('store_nodes'), batch_transaction():
+        if group_created:
+            group.store()
+        for i, (sp, created) in enumerate(species_list):
+            if created:
+                sp.store()
+                aiidalogger.debug("New node {} created for file {}".format(sp.uuid, sp.filename))
+            else:
+                aiidalogger.debug("Reusing node {} for file {}".format(sp.uuid, sp.filename))
+            if progress is not None:
+                progress('store', i + 1, len(species_list))
+
+        # Add elements to the group all togetehr
+        group.add_nodes([sp for sp, created in species_list])
+    clear_lapwbasis_family_cache(group_name)
+    with timer.phase('update_index'):
+        _update_family_index(group)
+    timer.log(aiidalogger, 'upload_family')
 
     nuploaded = len([sp for sp, created in species_list if created])
 
     return nfiles, nuploaded
 
+class LapwbasisFamilyCache(object):
+    """
+    In-process LRU cache of the {chemical symbol: LapwbasisData} maps of
+    LAPW basis families.
+
+    A cached entry is validated on every access against the number of
+    members of the family and the largest member pk, read with a single
+    aggregate query, and reloaded if they changed, so that species added
+    or removed by other processes are seen. upload_family and the index
+    update clear the entry of the family they modify. A change that keeps
+    both (removing a member and adding an older node in its place, from
+    another process) is not detected until the entry is cleared or
+    evicted.
+    """
+
+    def __init__(self, maxsize=32):
+        from collections import OrderedDict
+
+        self.maxsize = maxsize
+        # family name -> (fingerprint, species map)
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _get_fingerprint(family_name):
+        """
+        Return (number of members, largest member pk) of a family.
+
+        :raise NotExistent: if the family does not exist
+        """
+        from aiida.orm import Group
+        from aiida.orm.querybuilder import QueryBuilder
+        from aiida.common.exceptions import NotExistent
+
+        qb = QueryBuilder()
+        qb.append(Group, filters={'name': family_name,
+                                  'type': LAPWBASIS_GROUP_TYPE}, tag='group')
+        # the QueryBuilder projects a column only once: count the uuids
+        qb.append(LapwbasisData, member_of='group', tag='species',
+                  project=[{'uuid': {'func': 'count'}}, {'id': {'func': 'max'}}])
+        count, max_pk = qb.first()
+        if count == 0:
+            # an empty family, or no family at all
+            try:
+                LapwbasisData.get_lapwbasis_group(family_name)
+            except NotExistent:
+                raise NotExistent("No LAPW basis family named {}".format(
+                    family_name))
+            return 0, None
+        return count, max_pk
+
+    @staticmethod
+    def _load(family_name):
+        from aiida.orm import Group
+        from aiida.orm.querybuilder import QueryBuilder
+
+        qb = QueryBuilder()
+        qb.append(Group, filters={'name': family_name,
+                                  'type': LAPWBASIS_GROUP_TYPE}, tag='group')
+        qb.append(LapwbasisData, member_of='group', project=['*'],
+                  tag='species')
+        qb.order_by({'species': ['id']})
+        species = {}
+        for node, in qb.iterall():
+            species[node.chemical_symbol] = node
+        return species
+
+    def get(self, family_name):
+        """
+        Return the {chemical symbol: LapwbasisData} map of a family.
+
+        :raise NotExistent: if the family does not exist
+        """
+        fingerprint = self._get_fingerprint(family_name)
+        entry = self._entries.pop(family_name, None)
+        if entry is None or entry[0] != fingerprint:
+            entry = (fingerprint, self._load(family_name))
+        self._entries[family_name] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry[1]
+
+    def clear(self, family_name=None):
+        """
+        Drop the cached map of a family, or of all families if None.
+        """
+        if family_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(family_name, None)
+
+_family_cache = LapwbasisFamilyCache()
+
+def get_lapwbasis_family_map(family_name):
+    """
+    Return the {chemical symbol: LapwbasisData} map of a LAPW basis
+    family, from the in-process cache.
+    """
+    return _family_cache.get(family_name)
+
+def clear_lapwbasis_family_cache(family_name=None):
+    """
+    Clear the in-process cache of a family, or of all families if None.
+    """
+    _family_cache.clear(family_name)
+
+def get_lapwbasis_for_structures(structures, family_name):
+    """
+    Resolve the LAPW species of many structures at once.
+
+    :param structures: a list of StructureData
+    :param family_name: the name of the LAPW basis family
+    :return: a list with, for each structure, a dictionary
+        chemical symbol -> LapwbasisData
+    :raise NotExistent: if the family does not contain one of the elements
+    """
+    from aiida.common.exceptions import NotExistent
+
+    family = get_lapwbasis_family_map(family_name)
+    result = []
+    for structure in structures:
+        symbols = set(kind.symbol for kind in structure.kinds)
+        missing = symbols - set(family)
+        if missing:
+            raise NotExistent("The LAPW basis family {} has no species for "
+                              "{}".format(family_name,
+                                          ", ".join(sorted(missing))))
+        result.append(dict((symbol, family[symbol]) for symbol in symbols))
+    return result
+
+def _get_element_extra(symbol):
+    return LAPWBASIS_ELEMENT_EXTRA_PREFIX + symbol
+
+def _get_index_group(group):
+    """
+    Return the companion index group of a family group, creating it if
+    needed.
+    """
+    from aiida.orm import Group
+
+    index_group, created = Group.get_or_create(
+        name=group.name, type_string=LAPWBASIS_INDEX_GROUP_TYPE,
+        user=group.user,
+        description="Element index of the LAPW basis family {}".format(
+            group.name))
+    return index_group
+
+def _get_family_index_node(group):
+    """
+    Return the index node of a family group, or None.
+    """
+    from aiida.orm import Group
+    from aiida.orm.data.parameter import ParameterData
+    from aiida.orm.querybuilder import QueryBuilder
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'name': group.name,
+                              'type': LAPWBASIS_INDEX_GROUP_TYPE},
+              tag='group')
+    qb.append(ParameterData, member_of='group', project=['*'],
+              filters={'extras.{}'.format(LAPWBASIS_INDEX_EXTRA):
+                       LAPWBASIS_INDEX_VERSION})
+    for node, in qb.iterall():
+        return node
+    return None
+
+def _update_family_index(group):
+    from aiida.orm import Group
+    from aiida.orm.data.parameter import ParameterData
+    from aiida.orm.querybuilder import QueryBuilder
+
+    # as in get_lapwbasis_family_map, the last species of an element wins
+    qb = QueryBuilder()
+    qb.append(Group, filters={'id': group.pk}, tag='group')
+    qb.append(LapwbasisData, member_of='group', tag='species',
+              project=['attributes.chemical_symbol', 'attributes.md5'])
+    qb.order_by({'species': ['id']})
+    md5s = dict(qb.all())
+
+    index = _get_family_index_node(group)
+    if index is None:
+        index = ParameterData(dict={})
+        index.label = group.name
+        index.description = ("Element index of the LAPW basis family "
+                             "{}".format(group.name))
+        index.store()
+        index.set_extra(LAPWBASIS_INDEX_EXTRA, LAPWBASIS_INDEX_VERSION)
+        index_group = _get_index_group(group)
+        index_group.add_nodes([index])
+    else:
+        for key in index.get_extras():
+            if (key.startswith(LAPWBASIS_ELEMENT_EXTRA_PREFIX) and
+                    key[len(LAPWBASIS_ELEMENT_EXTRA_PREFIX):] not in md5s):
+                index.del_extra(key)
+
+    extras = {LAPWBASIS_ELEMENTS_EXTRA: sorted(md5s),
+              LAPWBASIS_MD5_EXTRA: md5s}
+    extras.update((_get_element_extra(symbol), True) for symbol in md5s)
+    index.set_extras(extras)
+    clear_lapwbasis_family_cache(group.name)
+    return md5s
+
+def delete_lapwbasis_family(family_name):
+    """
+    Delete a LAPW basis family of the current user, together with its
+    companion index group. The species nodes are kept.
+
+    :raise NotExistent: if the family does not exist
+    :raise ModificationNotAllowed: if the family belongs to another user
+    """
+    from aiida.orm import Group
+    from aiida.common.exceptions import NotExistent, ModificationNotAllowed
+    from aiida.backends.utils import get_automatic_user
+
+    group = LapwbasisData.get_lapwbasis_group(family_name)
+    if group.user != get_automatic_user():
+        raise ModificationNotAllowed("The LAPW basis family {} belongs to "
+                                     "user {}, therefore you cannot delete "
+                                     "it".format(family_name, group.user.email))
+    try:
+        index_group = Group.get(name=family_name,
+                                type_string=LAPWBASIS_INDEX_GROUP_TYPE)
+    except NotExistent:
+        index_group = None
+
+    group.delete()
+    if index_group is not None:
+        index_group.delete()
+    clear_lapwbasis_family_cache(family_name)
+
+def update_lapwbasis_family_index(family_name):
+    """
+    Rebuild the element index of a LAPW basis family from its members.
+
+    upload_family keeps the index up to date; call this after adding or
+    removing species of a family in any other way, or to index a family
+    uploaded before the index existed.
+
+    :return: the indexed map chemical symbol -> md5
+    """
+    return _update_family_index(LapwbasisData.get_lapwbasis_group(family_name))
+
+def get_lapwbasis_family_md5_map(family_name):
+    """
+    Return the indexed map chemical symbol -> md5 of a LAPW basis family,
+    without loading its species, or None if the family has no index.
+    """
+    from aiida.orm import Group
+    from aiida.orm.data.parameter import ParameterData
+    from aiida.orm.querybuilder import QueryBuilder
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'name': family_name,
+                              'type': LAPWBASIS_INDEX_GROUP_TYPE}, tag='group')
+    qb.append(ParameterData, member_of='group',
+              filters={'extras.{}'.format(LAPWBASIS_INDEX_EXTRA):
+                       LAPWBASIS_INDEX_VERSION},
+              project=['extras.{}'.format(LAPWBASIS_MD5_EXTRA)])
+    for md5s, in qb.iterall():
+        return md5s
+    return None
+
+def _get_index_query(filters, project, user=None):
+    from aiida.orm import Group, User
+    from aiida.orm.data.parameter import ParameterData
+    from aiida.orm.querybuilder import QueryBuilder
+
+    filters['extras.{}'.format(LAPWBASIS_INDEX_EXTRA)] = LAPWBASIS_INDEX_VERSION
+    qb = QueryBuilder()
+    qb.append(ParameterData, filters=filters, project=project, tag='index')
+    qb.append(Group, group_of='index',
+              filters={'type': LAPWBASIS_INDEX_GROUP_TYPE},
+              project=['name'], tag='group')
+    if user is not None:
+        qb.append(User, owner_of='group', filters={'email': user})
+    return qb
+
+def get_lapwbasis_families_for_elements(elements, user=None):
+    """
+    Return the sorted names of the indexed LAPW basis families with a
+    species for every element, with a single query on the element flags
+    of the family indexes.
+
+    :param elements: a string or a list of chemical symbols
+    :param user: if given, only the families of this user (email)
+    """
+    if isinstance(elements, basestring):
+        elements = [elements]
+    filters = dict(('extras.{}'.format(_get_element_extra(_.capitalize())), True)
+                   for _ in elements)
+    qb = _get_index_query(filters, [], user=user)
+    return sorted(set(name for name, in qb.iterall()))
+
+def get_lapwbasis_families_for_structures(structures, user=None):
+    """
+    Return the indexed LAPW basis families covering the elements of each
+    of many structures, reading the family indexes with a single query.
+
+    :param structures: a list of StructureData
+    :param user: if given, only the families of this user (email)
+    :return: a list with, for each structure, the sorted names of the
+        families with a species for each of its elements
+    """
+    qb = _get_index_query({}, ['extras.{}'.format(LAPWBASIS_ELEMENTS_EXTRA)],
+                          user=user)
+    families = sorted((name, frozenset(elements))
+                      for elements, name in qb.iterall())
+
+    # screened structures often share their composition
+    covering = {}
+    result = []
+    for structure in structures:
+        symbols = frozenset(kind.symbol for kind in structure.kinds)
+        if symbols not in covering:
+            covering[symbols] = [name for name, elements in families
+                                 if symbols <= elements]
+        result.append(list(covering[symbols]))
+    return result
+
 class LapwbasisData(SinglefileData):
 
     @classproperty
@@ -124,6 +487,37 @@ class LapwbasisData(SinglefileData):
     def md5(self):
         return self.get_attr('md5', None)
 
+    @property
+    def muffin_tin_radius(self):
+        return self.get_attr('muffin_tin_radius', None)
+
+    @property
+    def num_core_states(self):
+        return self.get_attr('num_core_states', None)
+
+    @property
+    def num_valence_states(self):
+        return self.get_attr('num_valence_states', None)
+
+    @property
+    def num_local_orbitals(self):
+        return self.get_attr('num_local_orbitals', None)
+
+    @property
+    def linearization_energy(self):
+        """
+        Trial energy of the default basis (Ha)
+        """
+        return self.get_attr('linearization_energy', None)
+
+    @property
+    def linearization_energies(self):
+        """
+        Trial energies of the custom basis (Ha), as a dictionary
+        angular momentum (string) -> energy
+        """
+        return self.get_attr('linearization_energies', None)
+
     @classmethod
     def get_or_create(cls, filename, fmt, use_first=False):
         """
@@ -150,10 +544,7 @@ class LapwbasisData(SinglefileData):
 
         if len(species) == 0:
             properties = parse_species_file(filename, fmt)
-            instance = cls(file=filename)
-            instance._set_attr('chemical_symbol', properties['chemical_symbol'])
-            instance._set_attr('md5', md5sum)
-            return (instance, True)
+            return (cls._from_properties(filename, md5sum, properties), True)
         elif len(species) == 1 or use_first:
             return (species[0], False)
         else:
@@ -161,6 +552,19 @@ class LapwbasisData(SinglefileData):
                              "with the same MD5 has been found in the "
                              "DB. pks={}".format(",".join([str(i.pk) for i in species])))
     
+    @classmethod
+    def _from_properties(cls, filename, md5sum, properties):
+        """
+        Return a new, unstored LapwbasisData for a parsed species file.
+        """
+        instance = cls(file=filename)
+        instance._set_attr('chemical_symbol', properties['chemical_symbol'])
+        instance._set_attr('md5', md5sum)
+        for key in BASIS_ATTRIBUTES:
+            if key in properties:
+                instance._set_attr(key, properties[key])
+        return instance
+
     @classmethod
     def from_md5(cls, md5):
         """
@@ -170,6 +574,41 @@ class LapwbasisData(SinglefileData):
         the species will not be found.
         """
         return list(cls.query(dbattributes__key='md5', dbattributes__tval=md5))
+
+    @classmethod
+    def from_md5_list(cls, md5_list):
+        """
+        Return all LAPW species that match any of the given MD5 hashes,
+        with a single query.
+
+        :return: a dictionary md5 -> list of LapwbasisData
+        """
+        from aiida.orm.querybuilder import QueryBuilder
+
+        md5_list = list(md5_list)
+        species = {}
+        if not md5_list:
+            return species
+        qb = QueryBuilder()
+        qb.append(cls, filters={'attributes.md5': {'in': md5_list}},
+                  project=['*'])
+        for node, in qb.iterall():
+            species.setdefault(node.md5, []).append(node)
+        return species
+
+    @classmethod
+    def get_md5_in_group(cls, group):
+        """
+        Return the set of the MD5 hashes of the LAPW species in a group,
+        without loading the nodes.
+        """
+        from aiida.orm import Group
+        from aiida.orm.querybuilder import QueryBuilder
+
+        qb = QueryBuilder()
+        qb.append(Group, filters={'id': group.pk}, tag='group')
+        qb.append(cls, member_of='group', project=['attributes.md5'])
+        return set(md5 for md5, in qb.iterall())
     
     @classmethod
     def get_lapwbasis_group(cls, group_name):
@@ -196,20 +635,91 @@ class LapwbasisData(SinglefileData):
         if user is not None:
             group_query_params['user'] = user
 
-        if isinstance(filter_elements, basestring):
-            filter_elements = [filter_elements]
+        all_lapwbasis_groups = Group.query(**group_query_params)
 
         if filter_elements is not None:
-            actual_filter_elements = {_.capitalize() for _ in filter_elements}
-
-            group_query_params['node_attributes'] = {
-                'chemical_symbol': actual_filter_elements}
-
-        all_lapwbasis_groups = Group.query(**group_query_params)
+            if isinstance(filter_elements, basestring):
+                filter_elements = [filter_elements]
+            if user is None or isinstance(user, basestring):
+                email = user
+            else:
+                email = user.email
+
+            # the element flags of the family indexes answer the filter
+            covering = set(get_lapwbasis_families_for_elements(
+                filter_elements, user=email))
+            indexed = set(name for name, in
+                          _get_index_query({}, [], user=email).iterall())
+            if any(g.name not in indexed for g in all_lapwbasis_groups):
+                # families uploaded before the index existed
+                group_query_params['node_attributes'] = {
+                    'chemical_symbol': {_.capitalize() for _ in filter_elements}}
+                covering.update(g.name for g in Group.query(**group_query_params)
+                                if g.name not in indexed)
+            all_lapwbasis_groups = [g for g in all_lapwbasis_groups
+                                    if g.name in covering]
 
         groups = [(g.name, g) for g in all_lapwbasis_groups]
         # Sort by name
         groups.sort()
         # Return the groups, without name
         return [_[1] for _ in groups]
-        
+
+    @classmethod
+    def get_lapwbasis_family_summaries(cls, filter_elements=None, user=None):
+        """
+        Return name, description, owner, number of species and element set
+        of the LAPW basis families, with a single query.
+
+        :param filter_elements: A string or a list of strings.
+               If present, returns only the families that contain one
+               Lapwbasis for every element present in the list.
+        :param user: if None (default), return the families of all users.
+               If defined, it should be the email of the user.
+        :return: a list of dictionaries with keys 'name', 'description',
+               'user', 'num_species' and 'elements' (sorted list), sorted
+               by name.
+        """
+        from aiida.orm import Group, User
+        from aiida.orm.querybuilder import QueryBuilder
+
+        qb = QueryBuilder()
+        qb.append(Group, filters={'type': cls.lapwbasisfamily_type_string},
+                  tag='group', project=['id', 'name', 'description'])
+        user_filters = {}
+        if user is not None:
+            user_filters['email'] = user
+        qb.append(User, owner_of='group', filters=user_filters,
+                  project=['email'])
+        qb.append(cls, member_of='group', outerjoin=True,
+                  project=['id', 'attributes.chemical_symbol'])
+
+        families = {}
+        for gid, name, description, email, node_id, symbol in qb.iterall():
+            family = families.setdefault(gid, {
+                'name': name, 'description': description, 'user': email,
+                'nodes': set(), 'elements': set()})
+            if node_id is not None:
+                family['nodes'].add(node_id)
+                family['elements'].add(symbol)
+
+        if isinstance(filter_elements, basestring):
+            filter_elements = [filter_elements]
+        if filter_elements is not None:
+            required = {_.capitalize() for _ in filter_elements}
+        else:
+            required = set()
+
+        summaries = []
+        for family in families.itervalues():
+            if not required.issubset(family['elements']):
+                continue
+            summaries.append({
+                'name': family['name'],
+                'description': family['description'],
+                'user': family['user'],
+                'num_species': len(family['nodes']),
+                'elements': sorted(family['elements']),
+                })
+        summaries.sort(key=lambda _: _['name'])
+        return summaries
@@ -0,0 +1,143 @@
+"""
+This module manages a content-addressed cache of LAPW species files on the
+remote computers.
+
+Each species file is uploaded once per computer as <cache_dir>/<md5>, using
+the md5 attribute of LapwbasisData. The calculations that set the
+'LAPWBASIS_REMOTE_CACHE' key of their settings to <cache_dir> then symlink
+the cached files into their working directory instead of uploading them.
+
+The remote directories in which a species file has been cached are stored
+in the 'remote_cache' extra of its LapwbasisData node, as a dictionary
+computer uuid -> cache directory.
+"""
+import os
+
+REMOTE_CACHE_EXTRA = 'remote_cache'
+
+def get_cached_path(cache_dir, lapwbasis):
+    """
+    Return the remote path of a species file in the cache.
+    """
+    return os.path.join(cache_dir, lapwbasis.md5)
+
+def is_cached(computer, cache_dir, lapwbasis):
+    """
+    Return True if the species file is known to be in the cache directory
+    of the computer.
+    """
+    cached = lapwbasis.get_extra(REMOTE_CACHE_EXTRA, {})
+    return cached.get(computer.uuid, None) == cache_dir
+
+def _set_cached(computer, lapwbasis, cache_dir):
+    cached = dict(lapwbasis.get_extra(REMOTE_CACHE_EXTRA, {}))
+    if cache_dir is None:
+        cached.pop(computer.uuid, None)
+    else:
+        cached[computer.uuid] = cache_dir
+    lapwbasis.set_extra(REMOTE_CACHE_EXTRA, cached)
+
+def _get_transport(computer):
+    from aiida.backends.utils import get_authinfo, get_automatic_user
+
+    return get_authinfo(computer, get_automatic_user()).get_transport()
+
+def _get_lapwbasis_nodes(md5_list=None, family_members=True):
+    """
+    Return the LapwbasisData nodes that belong to a family (or all of them
+    if family_members is False), optionally only those with the given md5
+    checksums.
+    """
+    from aiida.orm import Group
+    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_exciting.data.lapwbasis import LapwbasisData, LAPWBASIS_GROUP_TYPE
+
+    filters = {}
+    if md5_list is not None:
+        filters['attributes.md5'] = {'in': list(md5_list)}
+
+    qb = QueryBuilder()
+    if family_members:
+        qb.append(Group, filters={'type': LAPWBASIS_GROUP_TYPE}, tag='group')
+        qb.append(LapwbasisData, member_of='group', filters=filters,
+                  project=['*'])
+    else:
+        qb.append(LapwbasisData, filters=filters, project=['*'])
+    nodes = {}
+    for node, in qb.iterall():
+        nodes[node.pk] = node
+    return nodes.values()
+
+def sync_remote_cache(computer, cache_dir, lapwbasis_nodes):
+    """
+    Upload to the cache the species files that are not there yet.
+
+    :param computer: the Computer hosting the cache
+    :param cache_dir: the absolute path of the cache directory
+    :param lapwbasis_nodes: the LapwbasisData nodes to cache
+    :return: the number of files uploaded
+    """
+    if not os.path.isabs(cache_dir):
+        raise ValueError("The cache directory must be an absolute path")
+
+    nuploaded = 0
+    with _get_transport(computer) as t:
+        if not t.isdir(cache_dir):
+            t.makedirs(cache_dir)
+        present = set(t.listdir(cache_dir))
+        for lapwbasis in lapwbasis_nodes:
+            if lapwbasis.md5 not in present:
+                t.put(lapwbasis.get_file_abs_path(),
+                      get_cached_path(cache_dir, lapwbasis))
+                present.add(lapwbasis.md5)
+                nuploaded += 1
+            if not is_cached(computer, cache_dir, lapwbasis):
+                _set_cached(computer, lapwbasis, cache_dir)
+    return nuploaded
+
+def list_remote_cache(computer, cache_dir):
+    """
+    List the content of the cache.
+
+    :return: a list of (md5, size in bytes, list of LapwbasisData nodes)
+        tuples, sorted by md5
+    """
+    with _get_transport(computer) as t:
+        if not t.isdir(cache_dir):
+            return []
+        entries = [(md5, t.get_attribute(os.path.join(cache_dir, md5)).st_size)
+                   for md5 in t.listdir(cache_dir)]
+
+    nodes = {}
+    for node in _get_lapwbasis_nodes([md5 for md5, size in entries]):
+        nodes.setdefault(node.md5, []).append(node)
+    return sorted((md5, size, nodes.get(md5, [])) for md5, size in entries)
+
+def prune_remote_cache(computer, cache_dir, remove_all=False):
+    """
+    Remove files from the cache.
+
+    :param remove_all: if False (default), remove only the files that do
+        not correspond to any species of a LAPW basis family; if True,
+        empty the cache.
+    :return: the list of md5 checksums removed
+    """
+    removed = []
+    with _get_transport(computer) as t:
+        if not t.isdir(cache_dir):
+            return removed
+        present = t.listdir(cache_dir)
+        if remove_all:
+            used = set()
+        else:
+            used = set(node.md5 for node in _get_lapwbasis_nodes(present))
+        for md5 in present:
+            if md5 not in used:
+                t.remove(os.path.join(cache_dir, md5))
+                removed.append(md5)
+
+    # also the species that are no longer in a family remember the cache
+    for node in _get_lapwbasis_nodes(removed, family_members=False):
+        if is_cached(computer, cache_dir, node):
+            _set_cached(computer, node, None)
+    return removed
@@ -0,0 +1,217 @@
+"""
+Parsing of the header and basis descriptors of exciting species files.
+
+Only the beginning of the xml files is read: parsing stops as soon as the
+basis element of the species has been closed, so the radial grids and any
+other trailing data are never processed.
+"""
+
+# size of the blocks in which the xml files are fed to the parser
+_CHUNK_SIZE = 1 << 14
+# up to this number of files, read_species_files reads them sequentially:
+# starting and joining the thread pool costs about 0.1 s, more than reading
+# a hundred species files
+_SEQUENTIAL_MAX_FILES = 128
+
+class _HeaderComplete(Exception):
+    pass
+
+class SpeciesHeaderTarget(object):
+    """
+    ElementTree parser target collecting the species properties.
+
+    It raises _HeaderComplete when the basis (or the species) element ends.
+    """
+
+    def __init__(self):
+        self._path = []
+        self.properties = {}
+        self._core = 0
+        self._valence = 0
+        self._nlo = 0
+        self._custom = {}
+
+    def start(self, tag, attrib):
+        self._path.append(tag)
+        path = tuple(self._path[1:])
+        props = self.properties
+        if path == ('sp',):
+            props['chemical_symbol'] = attrib['chemicalSymbol']
+        elif path == ('sp', 'muffinTin'):
+            _set_float(props, 'muffin_tin_radius', attrib.get('radius'))
+        elif path == ('sp', 'atomicState'):
+            if attrib.get('core', 'false').lower() == 'true':
+                self._core += 1
+            else:
+                self._valence += 1
+        elif path == ('sp', 'basis', 'default'):
+            _set_float(props, 'linearization_energy',
+                       attrib.get('trialEnergy'))
+        elif path == ('sp', 'basis', 'custom'):
+            try:
+                self._custom[str(int(attrib['l']))] = float(
+                    attrib['trialEnergy'])
+            except (KeyError, ValueError):
+                pass
+        elif path == ('sp', 'basis', 'lo'):
+            self._nlo += 1
+
+    def end(self, tag):
+        path = tuple(self._path[1:])
+        self._path.pop()
+        if path in (('sp', 'basis'), ('sp',)):
+            raise _HeaderComplete()
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self
+
+    def get_properties(self):
+        properties = dict(self.properties)
+        properties['num_core_states'] = self._core
+        properties['num_valence_states'] = self._valence
+        properties['num_local_orbitals'] = self._nlo
+        properties['linearization_energies'] = dict(self._custom)
+        return properties
+
+def _set_float(properties, key, value):
+    try:
+        properties[key] = float(value)
+    except (TypeError, ValueError):
+        pass
+
+def parse_species_xml(filename):
+    """
+    Parse the header and the basis descriptors of an xml species file.
+    """
+    try:
+        import xml.etree.cElementTree as ET
+    except ImportError:
+        import xml.etree.ElementTree as ET
+
+    target = SpeciesHeaderTarget()
+    parser = ET.XMLParser(target=target)
+    with open(filename, 'rb') as handle:
+        try:
+            while True:
+                chunk = handle.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+            parser.close()
+        except _HeaderComplete:
+            pass
+    if 'chemical_symbol' not in target.properties:
+        raise ValueError("No species found in {}".format(filename))
+    return target.get_properties()
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+def parse_species_json(filename):
+    """
+    Parse a json species file. The chemical symbol is read from the
+    'symbol' key, as in the json files the plugin always accepted; the
+    optional basis descriptors use the element and attribute names of the
+    <sp> element of the xml format::
+
+        {"symbol": "Si",
+         "muffinTin": {"radius": 2.1},
+         "atomicState": [{"core": true}, {"core": false}],
+         "basis": {"default": {"trialEnergy": 0.15},
+                   "custom": [{"l": 0, "trialEnergy": -0.4}],
+                   "lo": [{}, {}]}}
+
+    A single atomicState, custom or lo entry may be given as an object
+    instead of a list.
+    """
+    import json
+
+    with open(filename) as data_file:
+        data = json.load(data_file)
+
+    properties = {'chemical_symbol': data['symbol']}
+    _set_float(properties, 'muffin_tin_radius',
+               data.get('muffinTin', {}).get('radius'))
+
+    states = _as_list(data.get('atomicState'))
+    core = [s for s in states if str(s.get('core', False)).lower() == 'true']
+    properties['num_core_states'] = len(core)
+    properties['num_valence_states'] = len(states) - len(core)
+
+    basis = data.get('basis', {})
+    _set_float(properties, 'linearization_energy',
+               basis.get('default', {}).get('trialEnergy'))
+    custom = {}
+    for entry in _as_list(basis.get('custom')):
+        try:
+            custom[str(int(entry['l']))] = float(entry['trialEnergy'])
+        except (KeyError, ValueError):
+            pass
+    properties['linearization_energies'] = custom
+    properties['num_local_orbitals'] = len(_as_list(basis.get('lo')))
+    return properties
+
+def parse_species_file(filename, fmt):
+    """
+    Parse xml or json species file
+
+    :return: a dictionary with the chemical symbol and, when present in the
+        file, the basis descriptors: muffin_tin_radius, num_core_states,
+        num_valence_states, num_local_orbitals, linearization_energy (of
+        the default basis) and linearization_energies (a dictionary
+        angular momentum -> trial energy, for the custom basis).
+    """
+    if fmt == 'xml':
+        return parse_species_xml(filename)
+    if fmt == 'json':
+        return parse_species_json(filename)
+    raise ValueError("Unknown species file format: {}".format(fmt))
+
+def _hash_and_parse(args):
+    """
+    Return (filename, md5, properties) for a species file.
+    """
+    from aiida.common.utils import md5_file
+
+    filename, fmt = args
+    return filename, md5_file(filename), parse_species_file(filename, fmt)
+
+def read_species_files(files, fmt, progress=None, threads=None):
+    """
+    Hash and parse species files, concurrently in a thread pool if there
+    are many of them.
+
+    :param files: the absolute paths of the files
+    :param fmt: format of the species files ('xml' or 'json')
+    :param progress: if given, called as progress('read', done, total)
+    :param threads: number of threads (default: one per CPU)
+    :return: a list of (filename, md5, properties) tuples, in the order of
+        files
+    """
+    from multiprocessing.pool import ThreadPool
+
+    file_info = []
+    if len(files) <= _SEQUENTIAL_MAX_FILES or threads == 1:
+        for f in files:
+            file_info.append(_hash_and_parse((f, fmt)))
+            if progress is not None:
+                progress('read', len(file_info), len(files))
+        return file_info
+
+    pool = ThreadPool(threads)
+    try:
+        for info in pool.imap(_hash_and_parse, [(f, fmt) for f in files]):
+            file_info.append(info)
+            if progress is not None:
+                progress('read', len(file_info), len(files))
+    finally:
+        pool.close()
+        pool.join()
+    return file_info
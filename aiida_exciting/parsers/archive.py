@@ -0,0 +1,89 @@
+"""
+Handling of the compressed archive in which the output files are retrieved
+when the COMPRESS_RETRIEVED setting is used. The output file is retrieved
+next to the archive, so that a job that failed before writing it can still
+be diagnosed.
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+from aiida_exciting.timing import NULL_TIMER
+
+RETRIEVE_ARCHIVE_NAME = 'aiida_retrieved.tar.gz'
+
+def get_archive_command(patterns):
+    """
+    Return the shell command, run at the end of the job, that bundles the
+    files matching the given patterns into RETRIEVE_ARCHIVE_NAME.
+
+    Directories are stripped from the member names, so that the archive
+    has the flat layout of the uncompressed retrieved folder; patterns
+    that do not match any file are ignored.
+    """
+    return ("tar -czf {} --ignore-failed-read --transform='s,^.*/,,' {} "
+            "2>/dev/null || true".format(RETRIEVE_ARCHIVE_NAME,
+                                         " ".join(patterns)))
+
+def extract_archive(archive, dest):
+    """
+    Extract the regular files of the archive into dest, streaming it
+    through decompression without seeking.
+    """
+    with tarfile.open(archive, 'r|gz') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            # never write outside of dest
+            filename = os.path.join(dest, os.path.basename(member.name))
+            source = tar.extractfile(member)
+            with open(filename, 'wb') as handle:
+                shutil.copyfileobj(source, handle)
+
+@contextmanager
+def retrieved_directory(out_dir, list_of_files, timer=NULL_TIMER,
+                        logger=None):
+    """
+    Context manager yielding (directory, list of files) with the retrieved
+    output files, whether they were retrieved one by one or (partly) in an
+    archive; in the latter case the archive is extracted in a temporary
+    directory, removed on exit, next to links to the other files.
+
+    If the archive is missing or cannot be extracted, only the files
+    retrieved as they are (the output file) are yielded.
+
+    :param timer: if given, the extraction is timed as its
+        'extract_archive' phase
+    :param logger: if given, a failed extraction is logged as a warning
+    """
+    if RETRIEVE_ARCHIVE_NAME not in list_of_files:
+        yield out_dir, list_of_files
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        try:
+            with timer.phase('extract_archive'):
+                extract_archive(os.path.join(out_dir, RETRIEVE_ARCHIVE_NAME),
+                                tmpdir)
+        except (tarfile.TarError, EnvironmentError, EOFError, zlib.error) as e:
+            if logger is not None:
+                logger.warning("Cannot extract {}, parsing only the files "
+                               "retrieved as they are: {}".format(
+                                   RETRIEVE_ARCHIVE_NAME, e))
+            yield out_dir, [f for f in list_of_files
+                            if f != RETRIEVE_ARCHIVE_NAME]
+            return
+        files = [f for f in list_of_files if f != RETRIEVE_ARCHIVE_NAME]
+        files.extend(f for f in os.listdir(tmpdir) if f not in files)
+        for filename in list_of_files:
+            if filename != RETRIEVE_ARCHIVE_NAME and \
+                    not os.path.exists(os.path.join(tmpdir, filename)):
+                os.symlink(os.path.join(out_dir, filename),
+                           os.path.join(tmpdir, filename))
+        yield tmpdir, files
+    finally:
+        shutil.rmtree(tmpdir)
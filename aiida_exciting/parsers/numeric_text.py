@@ -0,0 +1,59 @@
+"""
+Vectorized readers of the plain-text numeric output of exciting.
+
+The numbers are converted by numpy in a single call per file (or per
+chunk), without python loops over the lines.
+"""
+import re
+
+import numpy
+
+_BLANK_LINE = re.compile(r'\n[ \t\r]*\n')
+
+def read_numbers(text):
+    """
+    Convert a whitespace-separated string of numbers to a float array.
+    """
+    # numpy returns [-1.] for a string made only of whitespace
+    if text.isspace():
+        return numpy.empty(0)
+    return numpy.fromstring(text, dtype=numpy.float64, sep=' ')
+
+def iter_line_chunks(handle, chunk_size):
+    """
+    Yield the text of an open file in chunks of about chunk_size bytes, cut
+    at line ends.
+    """
+    tail = ''
+    while True:
+        data = handle.read(chunk_size)
+        if not data:
+            break
+        text = tail + data
+        end = text.rfind('\n') + 1
+        tail = text[end:]
+        if end:
+            yield text[:end]
+    if tail:
+        yield tail
+
+def read_blocks(filename, ncols):
+    """
+    Read a file made of blocks of equal length separated by blank lines,
+    such as BAND.OUT or TDOS.OUT.
+
+    :param ncols: the number of columns of each line
+    :return: an array of shape (nblocks, nlines, ncols)
+    """
+    with open(filename) as handle:
+        text = handle.read().strip()
+    if not text:
+        raise ValueError("{} is empty".format(filename))
+    blank = _BLANK_LINE.search(text)
+    first_block = text[:blank.start()] if blank else text
+    nlines = first_block.count('\n') + 1
+    numbers = read_numbers(text)
+    if len(numbers) % (ncols * nlines):
+        raise ValueError("{} does not contain blocks of {} lines with {} "
+                         "columns".format(filename, nlines, ncols))
+    return numbers.reshape(-1, nlines, ncols)
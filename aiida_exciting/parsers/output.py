@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from aiida.parsers.parser import Parser
-from aiida.orm.data.parameter import ParameterData
-from aiida_exciting.calculations.exciting import ExcitingCalculation
-from aiida_exciting.parsers.parse_xml_output import parse_xml_output
+from aiida_exciting.timing import get_timer, NULL_TIMER
+# The calculation and data classes, numpy and the file parsers are imported
+# where they are used, so that loading the plugin entry point stays cheap
 
 __copyright__ = u"Copyright (c), 2015, ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE (Theory and Simulation of Materials (THEOS) and National Centre for Computational Design and Discovery of Novel Materials (NCCR MARVEL)), Switzerland and ROBERT BOSCH LLC, USA. All rights reserved."
 __license__ = "MIT license, see LICENSE.txt file"
@@ -21,6 +21,8 @@ class OutputParser(Parser):
         """
         Initialize the instance of PwParser
         """
+        from aiida_exciting.calculations.exciting import ExcitingCalculation
+
         # check for valid input
         if not isinstance(calc, ExcitingCalculation):
             raise RuntimeError("Input calc must be an ExcitingCalculation")
@@ -33,6 +35,7 @@ class OutputParser(Parser):
         Does all the logic here.
         """
         from aiida.common.exceptions import InvalidOperation
+        from aiida_exciting.parsers.archive import retrieved_directory
         import os
         import glob
 
@@ -56,143 +59,327 @@ class OutputParser(Parser):
             self.logger.error("No retrieved folder found")
             return False, ()
         
-        # check what is inside the folder
-        list_of_files = out_folder.get_folder_list()
+        timer = get_timer(self._get_timing_enabled())
+
+        # check what is inside the folder; if the files were retrieved
+        # in a compressed archive, parse them from its extracted content
+        with retrieved_directory(out_folder.get_abs_path('.'),
+                                 out_folder.get_folder_list(), timer,
+                                 self.logger) as (out_dir, list_of_files):
+            results = parse_output_files(out_dir, list_of_files, timer)
+
+        successful, new_nodes_list = self.get_nodes_from_results(results, timer)
+
+        if timer.enabled:
+            timer.log(self.logger, 'parser')
+            for linkname, node in new_nodes_list:
+                if linkname == self.get_linkname_outparams():
+                    node._set_attr('parser_timing', timer.as_dict())
+        return successful, new_nodes_list
+
+    def _get_timing_enabled(self):
+        """
+        Return True if phase timing was requested with the TIMING key of
+        the settings of the calculation.
+        """
+        try:
+            settings = self._calc.inp.settings
+        except AttributeError:
+            return False
+        return bool(settings.get_dict().get('TIMING', False))
+
+    def get_nodes_from_results(self, results, timer=NULL_TIMER):
+        """
+        Build the output nodes from the results of parse_output_files.
+
+        :param results: the value returned by parse_output_files
+        :param timer: the timer of the parsing phases
+        :return: (successful, list of (link name, node))
+        """
+        from aiida.orm.data.parameter import ParameterData
+
         # at least the stdout should exist
         #if not self._calc._OUTPUT_FILE_NAME in list_of_files:
         #    self.logger.error("Standard output not found")
         #    successful = False
         #    return successful, ()
 
-        if not 'info.xml' in list_of_files:
+        if results is None:
             self.logger.error("info.xml file is not found")
             return False, ()
 
-        fname = os.path.join(out_folder.get_abs_path('.'), 'info.xml')
-        status, out_dict = parse_xml_output(fname)
-
-        if status == False:
-            return False, {}
+        status = results['status']
+        out_dict = results['out_dict']
+        scf_history = results['scf_history']
+        trajectory = results['trajectory']
 
         new_nodes_list = []
 
+        # the SCF history is kept also for unfinished runs, to diagnose them
+        if scf_history:
+            new_nodes_list.append((self.get_linkname_scf_history(),
+                                   self._get_scf_history_node(scf_history)))
+
+        # and so are the steps of a structure optimization
+        relaxed_structure = None
+        if trajectory is not None:
+            with timer.phase('create_trajectory'):
+                trajectory_node, relaxed_structure = \
+                    self._get_trajectory_nodes(trajectory)
+            new_nodes_list.append((self.get_linkname_outtrajectory(),
+                                   trajectory_node))
+
+        # a properties run from a parent calculation has no SCF cycle, and
+        # only the requested properties are checked
+        parameters_dict = self._get_parameters_dict()
+        groundstate_skipped = self._is_groundstate_skipped(parameters_dict)
+        if status == False and not groundstate_skipped:
+            return False, new_nodes_list
+        if groundstate_skipped:
+            out_dict['groundstate_skipped'] = True
+
         # convert the dictionary into an AiiDA object
-        output_params = ParameterData(dict=out_dict)
+        with timer.phase('create_nodes'):
+            output_params = ParameterData(dict=out_dict)
         # return it to the execmanager
         new_nodes_list.append((self.get_linkname_outparams(), output_params))
 
-        return True, new_nodes_list
-
-
-
-    #    # if there is something more, I note it down, so to call the raw parser
-    #    # with the right options
-    #    # look for xml
-    #    has_xml = False
-    #    if self._calc._DATAFILE_XML_BASENAME in list_of_files:
-    #        has_xml = True
-    #    # look for bands
-    #    has_bands = False
-    #    if glob.glob(os.path.join(out_folder.get_abs_path('.'),
-    #                              'K*[0-9]')):
-    #        # Note: assuming format of kpoints subfolder is K*[0-9]
-    #        has_bands = True
-    #        # TODO: maybe it can be more general than bands only?
-    #    out_file = os.path.join(out_folder.get_abs_path('.'),
-    #                            self._calc._OUTPUT_FILE_NAME)
-    #    xml_file = os.path.join(out_folder.get_abs_path('.'),
-    #                            self._calc._DATAFILE_XML_BASENAME)
-    #    dir_with_bands = out_folder.get_abs_path('.')
-
-    #    # call the raw parsing function
-    #    parsing_args = [out_file, input_dict, parser_opts]
-    #    if has_xml:
-    #        parsing_args.append(xml_file)
-    #    if has_bands:
-    #        if not has_xml:
-    #            self.logger.warning("Cannot parse bands if xml file not "
-    #                                "found")
-    #        else:
-    #            parsing_args.append(dir_with_bands)
-
-    #    out_dict, trajectory_data, structure_data, raw_successful = parse_raw_output(*parsing_args)
-
-    #    # if calculation was not considered failed already, use the new value
-    #    successful = raw_successful if successful else successful
-
-    #    new_nodes_list = []
-
-    #    # I eventually save the new structure. structure_data is unnecessary after this
-    #    in_struc = self._calc.get_inputs_dict()['structure']
-    #    type_calc = input_dict['CONTROL']['calculation']
-    #    struc = in_struc
-    #    if type_calc in ['relax', 'vc-relax', 'md', 'vc-md']:
-    #        if 'cell' in structure_data.keys():
-    #            struc = convert_qe2aiida_structure(structure_data, input_structure=in_struc)
-    #            new_nodes_list.append((self.get_linkname_outstructure(), struc))
-
-    #    k_points_list = trajectory_data.pop('k_points', None)
-    #    k_points_weights_list = trajectory_data.pop('k_points_weights', None)
-
-    #    if k_points_list is not None:
-
-    #        # build the kpoints object
-    #        if out_dict['k_points_units'] not in ['2 pi / Angstrom']:
-    #            raise QEOutputParsingError('Error in kpoints units (should be cartesian)')
-    #        # converting bands into a BandsData object (including the kpoints)
-
-    #        kpoints_from_output = KpointsData()
-    #        kpoints_from_output.set_cell_from_structure(struc)
-    #        kpoints_from_output.set_kpoints(k_points_list, cartesian=True,
-    #                                        weights=k_points_weights_list)
-    #        kpoints_from_input = self._calc.inp.kpoints
-    #        try:
-    #            kpoints_from_input.get_kpoints()
-    #        except AttributeError:
-    #            new_nodes_list += [(self.get_linkname_out_kpoints(), kpoints_from_output)]
-
-    #    # convert the dictionary into an AiiDA object
-    #    output_params = ParameterData(dict=out_dict)
-    #    # return it to the execmanager
-    #    new_nodes_list.append((self.get_linkname_outparams(), output_params))
-
-    #    if trajectory_data:
-    #        import numpy
-    #        from aiida.orm.data.array.trajectory import TrajectoryData
-    #        from aiida.orm.data.array import ArrayData
-
-    #        try:
-    #            positions = numpy.array(trajectory_data.pop('atomic_positions_relax'))
-    #            try:
-    #                cells = numpy.array(trajectory_data.pop('lattice_vectors_relax'))
-    #                # if KeyError, the MD was at fixed cell
-    #            except KeyError:
-    #                cells = numpy.array([in_struc.cell] * len(positions))
-
-    #            symbols = numpy.array([str(i.kind_name) for i in in_struc.sites])
-    #            steps = numpy.arange(len(positions))  # a growing integer per step
-    #            # I will insert time parsing when they fix their issues about time 
-    #            # printing (logic is broken if restart is on)
-
-    #            traj = TrajectoryData()
-    #            traj.set_trajectory(steps=steps,
-    #                                cells=cells,
-    #                                symbols=symbols,
-    #                                positions=positions,
-    #            )
-    #            for x in trajectory_data.iteritems():
-    #                traj.set_array(x[0], numpy.array(x[1]))
-    #            # return it to the execmanager
-    #            new_nodes_list.append((self.get_linkname_outtrajectory(), traj))
-
-    #        except KeyError:  # forces in scf calculation (when outputed)
-    #            arraydata = ArrayData()
-    #            for x in trajectory_data.iteritems():
-    #                arraydata.set_array(x[0], numpy.array(x[1]))
-    #            # return it to the execmanager
-    #            new_nodes_list.append((self.get_linkname_outarray(), arraydata))
-
-    #    return successful, new_nodes_list
+        if relaxed_structure is not None:
+            new_nodes_list.append((self.get_linkname_outstructure(),
+                                   relaxed_structure))
+
+        successful = True
+        properties = parameters_dict.get('properties', {})
+
+        with timer.phase('create_nodes'):
+            bands = self._get_bands_node(results['bands'])
+        if bands is not None:
+            new_nodes_list.append((self.get_linkname_bands(), bands))
+        elif 'bandstructure' in properties:
+            self.logger.error("The band structure was requested, but no band "
+                              "file was found")
+            successful = False
+
+        with timer.phase('create_nodes'):
+            dos = self._get_dos_node(results['dos'])
+        if dos is not None:
+            new_nodes_list.append((self.get_linkname_dos(), dos))
+        elif 'dos' in properties:
+            self.logger.error("The DOS was requested, but TDOS.OUT was not "
+                              "found")
+            successful = False
+
+        if results['xs'] is not None:
+            with timer.phase('create_nodes'):
+                spectra, excitons = self._get_xs_nodes(results['xs'],
+                                                       parameters_dict)
+            if spectra is not None:
+                new_nodes_list.append((self.get_linkname_spectra(), spectra))
+            if excitons is not None:
+                new_nodes_list.append((self.get_linkname_excitons(), excitons))
+        else:
+            spectra = None
+        if spectra is None and 'xs' in parameters_dict:
+            self.logger.error("Excited states were requested, but no EPSILON "
+                              "or LOSS file was found")
+            successful = False
+
+        return successful, new_nodes_list
+
+    def _get_parameters_dict(self):
+        try:
+            return self._calc.inp.parameters.get_dict()
+        except AttributeError:
+            return {}
+
+    def _is_groundstate_skipped(self, parameters_dict):
+        """
+        Return True if the SCF cycle was skipped, restarting from a parent
+        calculation (see ExcitingCalculation).
+        """
+        from aiida_exciting.calculations.input_xml import get_restart_mode
+
+        do = parameters_dict.get('groundstate', {}).get('do', None)
+        if do is None:
+            inputs = self._calc.get_inputs_dict()
+            if self._calc.get_linkname('parent_folder') not in inputs:
+                return False
+            do = get_restart_mode(parameters_dict)
+        return do == 'skip'
+
+    def get_linkname_bands(self):
+        """
+        Returns the name of the link to the output BandsData.
+        Node exists if the band structure or eigenvalue files were retrieved.
+        """
+        return 'output_band'
+
+    def _get_bands_node(self, bands_data):
+        """
+        Build a BandsData, with energies in eV, from the band data returned
+        by read_bands.
+
+        :return: the BandsData, or None if no band file was retrieved
+        """
+        from aiida.orm.data.array.bands import BandsData
+        from aiida_exciting.parsers.parse_xml_output import ha2ev
+
+        if bands_data is None:
+            return None
+
+        structure = self._calc.get_inputs_dict()[self._calc.get_linkname('structure')]
+        bands = BandsData()
+        bands.set_cell_from_structure(structure)
+        bands.set_kpoints(bands_data['kpoints'], labels=bands_data['labels'])
+        bands.set_bands(bands_data['energies'] * ha2ev, units='eV',
+                        occupations=bands_data['occupations'])
+        return bands
+
+    def get_linkname_dos(self):
+        """
+        Returns the name of the link to the ArrayData with the density of
+        states. Node exists if TDOS.OUT was retrieved.
+        """
+        return 'output_dos'
+
+    def _get_dos_node(self, dos_data):
+        """
+        Build an ArrayData with the density of states returned by read_dos.
+
+        :return: the ArrayData, or None if TDOS.OUT was not retrieved
+        """
+        from aiida.orm.data.array import ArrayData
+
+        if dos_data is None:
+            return None
+
+        arraydata = ArrayData()
+        for name, values in dos_data.iteritems():
+            arraydata.set_array(name, values)
+        return arraydata
+
+    def get_linkname_spectra(self):
+        """
+        Returns the name of the link to the ArrayData with the spectra of an
+        excited-state calculation (one array per EPSILON or LOSS file).
+        """
+        return 'output_spectra'
+
+    def get_linkname_excitons(self):
+        """
+        Returns the name of the link to the ArrayData with the exciton
+        energies and oscillator strengths of a BSE calculation (one array
+        per EXCITON file).
+        """
+        return 'output_excitons'
+
+    def _get_xs_nodes(self, xs_data, parameters_dict):
+        """
+        Build the ArrayData of the spectra and of the excitons returned by
+        read_xs_files, with energies in eV. Each array is the table of a
+        file, with the columns written by exciting; the 'files' attribute
+        maps the array names to the file names.
+
+        :return (spectra, excitons): the ArrayData, None when there is no
+            file of that kind
+        """
+        from aiida.orm.data.array import ArrayData
+        from aiida_exciting.calculations.input_xml import format_attribute_value
+        from aiida_exciting.parsers.parse_xml_output import ha2ev
+        from aiida_exciting.parsers.parse_xs_output import scale_energies
+
+        tevout = parameters_dict.get('xs', {}).get('tevout', False)
+        scale = 1. if format_attribute_value(tevout) == 'true' else ha2ev
+
+        nodes = []
+        for key in ['spectra', 'excitons']:
+            if not xs_data[key]:
+                nodes.append(None)
+                continue
+            arraydata = ArrayData()
+            files = {}
+            for name, (filename, kind, table) in xs_data[key].iteritems():
+                arraydata.set_array(name, scale_energies(table, kind, scale))
+                files[name] = filename
+            arraydata._set_attr('files', files)
+            arraydata._set_attr('energy_units', 'eV')
+            nodes.append(arraydata)
+        return tuple(nodes)
+
+    def get_linkname_scf_history(self):
+        """
+        Returns the name of the link to the ArrayData with the SCF
+        convergence history (one array per series, one entry per iteration).
+        """
+        return 'output_scf_history'
+
+    def _get_scf_history_node(self, scf_history):
+        """
+        Convert the SCF history series into an ArrayData node.
+        Energies are stored in eV and times in seconds.
+        """
+        import numpy
+        from aiida.orm.data.array import ArrayData
+
+        arraydata = ArrayData()
+        for name, series in scf_history.iteritems():
+            values = numpy.frombuffer(series, dtype=numpy.float64)
+            if name == 'iteration':
+                values = values.astype(numpy.int64)
+            arraydata.set_array(name, values)
+        return arraydata
+
+
+
+    def get_linkname_outtrajectory(self):
+        """
+        Returns the name of the link to the output_trajectory.
+        Node exists if the run is a structure optimization.
+        """
+        return 'output_trajectory'
+
+    def get_linkname_outstructure(self):
+        """
+        Returns the name of the link to the output_structure, the structure
+        of the last optimization step. Node exists if the run is a
+        successful structure optimization.
+        """
+        return 'output_structure'
+
+    def _get_trajectory_nodes(self, trajectory):
+        """
+        Build the TrajectoryData of the optimization steps, with the forces
+        (eV/angstrom) and total energies (eV), and the StructureData of the
+        last step. The atoms are in the order of the input sites.
+        """
+        import numpy
+        from aiida.orm.data.array.trajectory import TrajectoryData
+        from aiida_exciting.calculations.input_xml import group_sites_by_kind
+        from aiida_exciting.parsers.parse_relax_output import \
+            get_input_order_trajectory
+
+        in_structure = self._calc.inp.structure
+        sites = in_structure.sites
+        kinds = in_structure.kinds
+        # exciting lists the atoms by species, as written in input.xml
+        sites_by_kind = group_sites_by_kind([site.kind_name for site in sites],
+                                            [kind.name for kind in kinds])
+        site_order = numpy.concatenate([sites_by_kind[kind.name]
+                                        for kind in kinds])
+        steps = get_input_order_trajectory(trajectory, site_order,
+                                           in_structure.cell)
+
+        traj = TrajectoryData()
+        traj.set_trajectory(numpy.arange(len(steps['energy'])), steps['cells'],
+                            numpy.array([str(site.kind_name) for site in sites]),
+                            steps['positions'])
+        traj.set_array('forces', steps['forces'])
+        traj.set_array('energy', steps['energy'])
+
+        structure = in_structure.copy()
+        structure.reset_cell(steps['cells'][-1].tolist())
+        structure.reset_sites_positions(steps['positions'][-1].tolist())
+        return traj, structure
 
 #    def get_parser_settings_key(self):
 #        """
@@ -201,20 +388,6 @@ class OutputParser(Parser):
 #        """
 #        return 'parser_options'
 #
-#    def get_linkname_outstructure(self):
-#        """
-#        Returns the name of the link to the output_structure
-#        Node exists if positions or cell changed.
-#        """
-#        return 'output_structure'
-#
-#    def get_linkname_outtrajectory(self):
-#        """
-#        Returns the name of the link to the output_trajectory.
-#        Node exists in case of calculation='md', 'vc-md', 'relax', 'vc-relax'
-#        """
-#        return 'output_trajectory'
-#
 #    def get_linkname_outarray(self):
 #        """
 #        Returns the name of the link to the output_array
@@ -228,3 +401,106 @@ class OutputParser(Parser):
 #        Node exists if cell has changed and no bands are stored.
 #        """
 #        return 'output_kpoints'
+
+def parse_output_files(out_dir, list_of_files, timer=NULL_TIMER):
+    """
+    Parse the retrieved output files into plain python and numpy objects.
+
+    No database access is needed, so that the files of many calculations
+    can be parsed in worker processes (see commands/reparse.py); the nodes
+    are built by OutputParser.get_nodes_from_results.
+
+    :param out_dir: the directory with the retrieved files
+    :param list_of_files: the names of the retrieved files
+    :param timer: the timer of the parsing phases
+    :return: None if info.xml was not retrieved, otherwise a dictionary
+        with status, out_dict, scf_history and trajectory (see
+        parse_xml_output_with_trajectory), bands (see read_bands), dos
+        (see read_dos) and xs (see parse_xs_output.read_xs_files)
+    """
+    import os
+    from aiida_exciting.parsers.parse_relax_output import \
+        parse_xml_output_with_trajectory
+    from aiida_exciting.parsers.parse_xs_output import read_xs_files
+
+    if not 'info.xml' in list_of_files:
+        return None
+
+    with timer.phase('parse_info_xml'):
+        status, out_dict, scf_history, trajectory = \
+            parse_xml_output_with_trajectory(os.path.join(out_dir, 'info.xml'))
+    with timer.phase('parse_bands'):
+        bands = read_bands(out_dir, list_of_files)
+    with timer.phase('parse_dos'):
+        dos = read_dos(out_dir, list_of_files)
+    with timer.phase('parse_xs'):
+        xs = read_xs_files(out_dir, list_of_files)
+
+    return {'status': status, 'out_dict': out_dict,
+            'scf_history': scf_history, 'trajectory': trajectory,
+            'bands': bands, 'dos': dos, 'xs': xs}
+
+def read_bands(out_dir, list_of_files):
+    """
+    Read the band structure along the path (BAND.OUT and the vertices in
+    bandstructure.xml) if available, otherwise the eigenvalues on the
+    k-point mesh (EIGVAL.OUT).
+
+    :return: a dictionary with kpoints, energies (Ha), occupations and
+        labels (None when not available), or None if no band file was
+        retrieved
+    """
+    import os
+    from aiida_exciting.parsers import parse_bands_output
+
+    occupations = None
+    labels = None
+    if 'BAND.OUT' in list_of_files and 'bandstructure.xml' in list_of_files:
+        distances, energies = parse_bands_output.read_band_out(
+            os.path.join(out_dir, 'BAND.OUT'))
+        vertices = parse_bands_output.read_bandstructure_vertices(
+            os.path.join(out_dir, 'bandstructure.xml'))
+        kpoints, labels = parse_bands_output.get_path_kpoints(distances, vertices)
+    elif 'EIGVAL.OUT' in list_of_files:
+        kpoints, energies, occupations = parse_bands_output.read_eigval_out(
+            os.path.join(out_dir, 'EIGVAL.OUT'))
+    else:
+        return None
+    return {'kpoints': kpoints, 'energies': energies,
+            'occupations': occupations, 'labels': labels}
+
+def read_dos(out_dir, list_of_files):
+    """
+    Read the total and the atom- and lm-projected density of states, with
+    energies in eV and DOS in states/eV:
+
+    * energy: the energy grid (nE)
+    * tdos: the total DOS (nspin x nE)
+    * pdos: the projected DOS of all atoms in a single array
+      (natoms x nspin x nlm x nE), with lm = l**2 + l + m
+    * pdos_species, pdos_atom: the species and atom index of each row
+      of pdos, as numbered by exciting (starting from 1)
+
+    :return: a dictionary name -> array, or None if TDOS.OUT was not
+        retrieved
+    """
+    import os
+    from aiida_exciting.parsers import parse_dos_output
+    from aiida_exciting.parsers.parse_xml_output import ha2ev
+
+    if parse_dos_output.TDOS_FILE_NAME not in list_of_files:
+        return None
+
+    energies, tdos = parse_dos_output.read_tdos_out(
+        os.path.join(out_dir, parse_dos_output.TDOS_FILE_NAME))
+    dos = {'energy': energies * ha2ev, 'tdos': tdos / ha2ev}
+
+    pdos_files = parse_dos_output.get_pdos_files(list_of_files)
+    if pdos_files:
+        pdos, species, atoms = parse_dos_output.read_pdos_files(
+            [(os.path.join(out_dir, f), s, a) for f, s, a in pdos_files],
+            tdos.shape[0], len(energies))
+        dos['pdos'] = pdos / ha2ev
+        dos['pdos_species'] = species
+        dos['pdos_atom'] = atoms
+    return dos
@@ -0,0 +1,132 @@
+"""
+Vectorized readers of exciting's eigenvalue and band-structure output.
+
+The numeric blocks are converted by numpy in one call per file (or per
+chunk, for EIGVAL.OUT), without python loops over the lines; energies are
+returned in Hartree.
+"""
+import re
+
+import numpy
+
+from aiida_exciting.parsers.parse_xml_output import _get_parser
+from aiida_exciting.parsers.numeric_text import (read_numbers, read_blocks,
+                                                 iter_line_chunks)
+
+_CHUNK_SIZE = 1 << 16
+
+# the text annotations of EIGVAL.OUT: ': nkpt', ': k-point, vkl' and the
+# '(state, eigenvalue and occupancy below)' lines
+_EIGVAL_ANNOTATIONS = re.compile(r':[^\n]*|\([^\n]*')
+
+def read_eigval_out(filename, chunk_size=_CHUNK_SIZE):
+    """
+    Read EIGVAL.OUT in chunks of chunk_size bytes cut at line ends. The
+    annotations are stripped from each chunk and its numbers copied into
+    an array sized from the header, so that the text of the file is never
+    held in memory as a whole.
+
+    :return (vkl, eigenvalues, occupancies): the k-points in lattice
+        coordinates (nkpt x 3), and the eigenvalues (Ha) and occupancies of
+        the states (nkpt x nstsv)
+    """
+    header = numpy.empty(0)
+    numbers = None
+    filled = 0
+    with open(filename) as handle:
+        for text in iter_line_chunks(handle, chunk_size):
+            values = read_numbers(_EIGVAL_ANNOTATIONS.sub(' ', text))
+            if numbers is None:
+                # nkpt and nstsv, then the blocks of the k-points
+                header = numpy.concatenate((header, values))
+                if len(header) < 2:
+                    continue
+                nkpt, nstsv = int(header[0]), int(header[1])
+                expected = 2 + nkpt * (4 + 3 * nstsv)
+                numbers = numpy.empty(expected)
+                values = header
+            # the values beyond the expected ones are only counted
+            end = min(filled + len(values), expected)
+            numbers[filled:end] = values[:end - filled]
+            filled += len(values)
+    if numbers is None:
+        raise ValueError("{} is empty or truncated".format(filename))
+    if filled != expected:
+        raise ValueError("{} contains {} values, {} expected for {} k-points "
+                         "and {} states".format(filename, filled, expected,
+                                                nkpt, nstsv))
+    blocks = numbers[2:].reshape(nkpt, 4 + 3 * nstsv)
+    vkl = blocks[:, 1:4]
+    states = blocks[:, 4:].reshape(nkpt, nstsv, 3)
+    return vkl, states[:, :, 1], states[:, :, 2]
+
+def read_band_out(filename):
+    """
+    Read BAND.OUT, with one block of (distance, energy) lines per band.
+
+    :return (distances, energies): the distance along the path of each
+        k-point (nk), and the energies (Ha) of the bands (nk x nbands)
+    """
+    bands = read_blocks(filename, 2)
+    return bands[0, :, 0], bands[:, :, 1].T
+
+class BandstructureVertexTarget(object):
+    """
+    ElementTree parser target collecting the vertices of bandstructure.xml.
+    """
+
+    def __init__(self):
+        self.vertices = []
+
+    def start(self, tag, attrib):
+        if tag == 'vertex':
+            self.vertices.append((float(attrib['distance']),
+                                  attrib.get('label', ''),
+                                  [float(x) for x in attrib['coord'].split()]))
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self
+
+def read_bandstructure_vertices(filename):
+    """
+    Read the vertices of the band path from bandstructure.xml.
+
+    :return: a list of (distance, label, coordinates) tuples, with the
+        coordinates in units of the reciprocal lattice vectors
+    """
+    target = BandstructureVertexTarget()
+    parser = _get_parser(target)
+    with open(filename, 'rb') as handle:
+        while True:
+            chunk = handle.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    return parser.close().vertices
+
+def get_path_kpoints(distances, vertices):
+    """
+    Reconstruct the k-points of a band path from their distances.
+
+    :param distances: the distance of each k-point along the path
+    :param vertices: the vertices, as returned by read_bandstructure_vertices
+    :return (kpoints, labels): the k-points in units of the reciprocal
+        lattice vectors (nk x 3), and the (index, label) of the vertices
+    """
+    vertex_distances = numpy.array([v[0] for v in vertices])
+    vertex_coords = numpy.array([v[2] for v in vertices])
+    kpoints = numpy.empty((len(distances), 3))
+    for i in range(3):
+        kpoints[:, i] = numpy.interp(distances, vertex_distances,
+                                     vertex_coords[:, i])
+    indices = numpy.searchsorted(distances, vertex_distances)
+    indices = numpy.minimum(indices, len(distances) - 1)
+    labels = [(int(index), vertex[1])
+              for index, vertex in zip(indices, vertices) if vertex[1]]
+    return kpoints, labels
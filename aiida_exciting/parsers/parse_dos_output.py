@@ -0,0 +1,72 @@
+"""
+Vectorized readers of exciting's density-of-states output.
+
+TDOS.OUT holds one block of (energy, dos) lines per spin channel; each
+PDOS_Sss_Aaaaa.OUT file holds, for one atom, one such block per spin
+channel and (l, m) projection. Energies are returned in Hartree and
+densities of states in states/Hartree.
+"""
+import os
+import re
+
+import numpy
+
+from aiida_exciting.parsers.numeric_text import read_blocks
+
+TDOS_FILE_NAME = 'TDOS.OUT'
+PDOS_FILE_PATTERN = 'PDOS_S*_A*.OUT'
+
+_PDOS_FILE_NAME = re.compile(r'^PDOS_S(\d+)_A(\d+)\.OUT$')
+
+def read_tdos_out(filename):
+    """
+    Read TDOS.OUT.
+
+    :return (energies, dos): the energy grid (nE), and the total density
+        of states of each spin channel (nspin x nE)
+    """
+    blocks = read_blocks(filename, 2)
+    return blocks[0, :, 0], blocks[:, :, 1]
+
+def get_pdos_files(list_of_files):
+    """
+    Return the projected DOS files in a list of file names, sorted by
+    species and atom, as a list of (filename, species, atom) tuples.
+    """
+    pdos_files = []
+    for filename in list_of_files:
+        match = _PDOS_FILE_NAME.match(os.path.basename(filename))
+        if match:
+            pdos_files.append((int(match.group(1)), int(match.group(2)),
+                               filename))
+    pdos_files.sort()
+    return [(filename, species, atom) for species, atom, filename in pdos_files]
+
+def read_pdos_files(pdos_files, nspin, nenergies):
+    """
+    Read the projected DOS files into one array.
+
+    :param pdos_files: the files as returned by get_pdos_files, with
+        absolute paths
+    :param nspin: the number of spin channels
+    :param nenergies: the number of points of the energy grid
+    :return (pdos, species, atoms): the projected DOS, of shape
+        (nfiles x nspin x nlm x nE), and the species and atom index of each
+        file
+    """
+    pdos = None
+    for i, (filename, species, atom) in enumerate(pdos_files):
+        blocks = read_blocks(filename, 2)
+        if blocks.shape[1] != nenergies or blocks.shape[0] % nspin:
+            raise ValueError("{} does not match the energy grid of the "
+                             "total DOS".format(filename))
+        if pdos is None:
+            pdos = numpy.empty((len(pdos_files), nspin,
+                                blocks.shape[0] // nspin, nenergies))
+        elif blocks.shape[0] != nspin * pdos.shape[2]:
+            raise ValueError("{} has a different number of projections than "
+                             "the other PDOS files".format(filename))
+        pdos[i] = blocks[:, :, 1].reshape(nspin, -1, nenergies)
+    species = numpy.array([f[1] for f in pdos_files], dtype=numpy.int64)
+    atoms = numpy.array([f[2] for f in pdos_files], dtype=numpy.int64)
+    return pdos, species, atoms
@@ -0,0 +1,181 @@
+"""
+Streaming parser of the structure-optimization steps of exciting's info.xml.
+
+The steps are read in the same single pass as the groundstate results and
+the SCF history. The per-step values are appended to flat arrays of
+doubles while the file is parsed, and reshaped into numpy arrays at the
+end: no per-step python objects are kept, whatever the number of steps
+and atoms.
+"""
+from array import array
+
+import numpy
+
+from aiida_exciting.parsers.parse_xml_output import (ScfHistoryTarget,
+                                                     scan_info_xml,
+                                                     _get_results,
+                                                     ha2ev, au2angs)
+
+# elements and attributes of the structure-optimization output
+OPTIMIZATION_STEP_TAG = 'optimization-step'
+STEP_ENERGY_ATTRIBUTE = 'totalEnergy'
+BASEVECT_TAG = 'basevect'
+ATOM_TAG = 'atom'
+ATOM_COORD_ATTRIBUTES = ('x', 'y', 'z')
+TOTAL_FORCE_TAG = 'totalforce'
+FORCE_ATTRIBUTES = ('x', 'y', 'z')
+
+def _read_vector(attrib, names):
+    nan = float('nan')
+    values = []
+    for name in names:
+        try:
+            values.append(float(attrib[name]))
+        except (KeyError, ValueError):
+            values.append(nan)
+    return values
+
+class RelaxationTarget(ScfHistoryTarget):
+    """
+    ScfHistoryTarget that also collects the structure-optimization steps.
+
+    For each step it keeps the lattice vectors (bohr; NaN if the step does
+    not report them), the atomic positions (lattice coordinates), the
+    total forces (Ha/bohr; NaN if missing) and the total energy (Ha), with
+    the atoms in the order of exciting's species blocks.
+    """
+
+    def __init__(self):
+        super(RelaxationTarget, self).__init__()
+        self.nsteps = 0
+        self.natoms = None
+        self.cells = array('d')
+        self.positions = array('d')
+        self.forces = array('d')
+        self.energies = array('d')
+        self._in_step = False
+        self._text = None
+
+    def start(self, tag, attrib):
+        super(RelaxationTarget, self).start(tag, attrib)
+        if tag == OPTIMIZATION_STEP_TAG:
+            self._in_step = True
+            self._step_cell = []
+            self._step_atoms = 0
+            self._step_forces = 0
+            self.energies.extend(_read_vector(attrib, (STEP_ENERGY_ATTRIBUTE,)))
+        elif not self._in_step:
+            return
+        elif tag == BASEVECT_TAG:
+            self._text = []
+        elif tag == ATOM_TAG:
+            # atoms without forces are padded when the next atom starts
+            self._pad_forces(self._step_atoms)
+            self.positions.extend(_read_vector(attrib, ATOM_COORD_ATTRIBUTES))
+            self._step_atoms += 1
+        elif tag == TOTAL_FORCE_TAG and self._step_forces < self._step_atoms:
+            self.forces.extend(_read_vector(attrib, FORCE_ATTRIBUTES))
+            self._step_forces += 1
+
+    def data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        if self._in_step:
+            if tag == BASEVECT_TAG and self._text is not None:
+                self._step_cell.extend(float(e) for e in
+                                       "".join(self._text).split()[:3])
+                self._text = None
+            elif tag == OPTIMIZATION_STEP_TAG:
+                self._end_step()
+        super(RelaxationTarget, self).end(tag)
+
+    def _pad_forces(self, natoms):
+        missing = natoms - self._step_forces
+        if missing > 0:
+            self.forces.extend([float('nan')] * (3 * missing))
+            self._step_forces = natoms
+
+    def _end_step(self):
+        self._in_step = False
+        if self.natoms is None:
+            self.natoms = self._step_atoms
+        elif self._step_atoms != self.natoms:
+            raise ValueError("Optimization step {} has {} atoms instead of "
+                             "{}".format(self.nsteps + 1, self._step_atoms,
+                                         self.natoms))
+        self._pad_forces(self._step_atoms)
+        if len(self._step_cell) == 9:
+            self.cells.extend(self._step_cell)
+        else:
+            self.cells.extend([float('nan')] * 9)
+        self.nsteps += 1
+
+    def get_trajectory(self):
+        """
+        Return the steps as a dictionary of numpy arrays, in angstrom and
+        eV: cells (nsteps x 3 x 3; a step that does not report them has
+        the cell of the previous one, or NaN), fractional_positions
+        (nsteps x natoms x 3), forces (nsteps x natoms x 3) and energy
+        (nsteps); None if there is no optimization step.
+        """
+        if not self.nsteps:
+            return None
+        shape = (self.nsteps, self.natoms, 3)
+        cells = numpy.frombuffer(self.cells, dtype=numpy.float64).reshape(
+            self.nsteps, 3, 3) * au2angs
+        for step in range(1, self.nsteps):
+            if numpy.isnan(cells[step]).any():
+                cells[step] = cells[step - 1]
+        return {
+            'cells': cells,
+            'fractional_positions': numpy.frombuffer(
+                self.positions, dtype=numpy.float64).reshape(shape),
+            'forces': numpy.frombuffer(self.forces, dtype=numpy.float64
+                                       ).reshape(shape) * (ha2ev / au2angs),
+            'energy': numpy.frombuffer(self.energies,
+                                       dtype=numpy.float64) * ha2ev,
+            }
+
+def parse_xml_output_with_trajectory(filename):
+    """
+    Like parse_xml_output_with_history, but also return the steps of a
+    structure optimization.
+
+    :return (status, res, history, trajectory): trajectory is the
+        dictionary returned by RelaxationTarget.get_trajectory, or None
+    """
+    target = scan_info_xml(filename, RelaxationTarget())
+    status, res = _get_results(target)
+    return status, res, target.history, target.get_trajectory()
+
+def get_input_order_trajectory(trajectory, site_order, input_cell):
+    """
+    Return the cells, cartesian positions (angstrom) and forces of a
+    trajectory with the atoms in the order of the sites of the input
+    structure, instead of exciting's species blocks.
+
+    :param trajectory: the dictionary returned by
+        RelaxationTarget.get_trajectory
+    :param site_order: the index of the input site of each atom, in the
+        order of the species blocks of input.xml
+    :param input_cell: the lattice vectors of the input structure, used
+        for the steps before the first one reporting the cell
+    :return: a dictionary with cells, positions, forces and energy
+    """
+    site_order = numpy.asarray(site_order)
+    fractional = trajectory['fractional_positions']
+    if len(site_order) != fractional.shape[1]:
+        raise ValueError("The trajectory has {} atoms, the structure "
+                         "{}".format(fractional.shape[1], len(site_order)))
+
+    cells = trajectory['cells'].copy()
+    cells[numpy.isnan(cells).any(axis=2).any(axis=1)] = input_cell
+
+    positions = numpy.empty_like(fractional)
+    positions[:, site_order] = numpy.einsum('sai,sij->saj', fractional, cells)
+    forces = numpy.empty_like(trajectory['forces'])
+    forces[:, site_order] = trajectory['forces']
+    return {'cells': cells, 'positions': positions, 'forces': forces,
+            'energy': trajectory['energy']}
@@ -1,30 +1,214 @@
+from array import array
+
 ha2ev = 27.21138505
 au2angs = 0.5291772108
 
+# size of the blocks in which info.xml is fed to the parser
+_CHUNK_SIZE = 1 << 16
+
+class InfoXmlTarget(object):
+    """
+    ElementTree parser target that scans exciting's info.xml in a single pass.
+
+    No element tree is built: the target only keeps the groundstate status,
+    the attributes of the last SCF iteration seen so far (with its
+    energies and timing) and the crystal volume. It can be fed a file that
+    is still being written by exciting; the collected state always reflects
+    the data read so far.
+    """
+
+    def __init__(self):
+        self._path = []
+        self.status = None
+        self.niter = 0
+        self.last_iter = None
+        self.last_energies = None
+        self.last_timing = None
+        self.crystal = None
+
+    def start(self, tag, attrib):
+        self._path.append(tag)
+        # path relative to the root element
+        path = tuple(self._path[1:])
+        if path == ('groundstate',):
+            if self.status is None:
+                self.status = attrib.get('status', '')
+        elif path == ('groundstate', 'scl', 'iter'):
+            self.niter += 1
+            self.last_iter = dict(attrib)
+            self.last_energies = None
+            self.last_timing = None
+        elif path == ('groundstate', 'scl', 'iter', 'energies'):
+            self.last_energies = dict(attrib)
+        elif path == ('groundstate', 'scl', 'iter', 'timing'):
+            self.last_timing = dict(attrib)
+        elif path == ('groundstate', 'scl', 'structure', 'crystal'):
+            if self.crystal is None:
+                self.crystal = dict(attrib)
+
+    def end(self, tag):
+        self._path.pop()
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self
+
+# (element below scl/iter, attribute, name of the series, conversion factor)
+SCF_HISTORY_FIELDS = [
+    ('iter', 'iteration', 'iteration', 1.),
+    ('energies', 'totalEnergy', 'total_energy', ha2ev),
+    ('iter', 'deltae', 'energy_accuracy', ha2ev),
+    ('iter', 'chgdst', 'charge_distance', 1.),
+    ('iter', 'rms', 'potential_rms', 1.),
+    ('energies', 'fermiEnergy', 'fermi_energy', ha2ev),
+    ('timing', 'itertime', 'iteration_time', 1.),
+    ('timing', 'timetot', 'total_time', 1.),
+    ]
+
+class ScfHistoryTarget(InfoXmlTarget):
+    """
+    InfoXmlTarget that also collects the per-iteration SCF history.
+
+    Each series is kept in a compact array of doubles; a series that is
+    missing in some iterations is padded with NaN, and series that never
+    appear are not reported.
+    """
+
+    def __init__(self):
+        super(ScfHistoryTarget, self).__init__()
+        self._row = None
+        self.history = {}
+
+    def start(self, tag, attrib):
+        super(ScfHistoryTarget, self).start(tag, attrib)
+        path = tuple(self._path[1:])
+        if path == ('groundstate', 'scl', 'iter'):
+            self._row = {}
+            self._collect('iter', attrib)
+        elif (self._row is not None and len(path) == 4 and
+              path[:3] == ('groundstate', 'scl', 'iter')):
+            self._collect(tag, attrib)
+
+    def end(self, tag):
+        if self._row is not None and tuple(self._path[1:]) == (
+                'groundstate', 'scl', 'iter'):
+            self._push_row()
+        super(ScfHistoryTarget, self).end(tag)
+
+    def _collect(self, tag, attrib):
+        for element, attr, name, factor in SCF_HISTORY_FIELDS:
+            if element == tag and attr in attrib:
+                try:
+                    self._row[name] = float(attrib[attr]) * factor
+                except ValueError:
+                    pass
+
+    def _push_row(self):
+        nan = float('nan')
+        nrows = self.niter - 1
+        for name in self._row:
+            if name not in self.history:
+                self.history[name] = array('d', [nan] * nrows)
+        for name, column in self.history.iteritems():
+            column.append(self._row.get(name, nan))
+        self._row = None
+
+def _get_parser(target):
+    try:
+        import xml.etree.cElementTree as ET
+    except ImportError:
+        import xml.etree.ElementTree as ET
+    return ET.XMLParser(target=target)
+
+def scan_info_xml(filename, target=None):
+    """
+    Feed info.xml through a streaming parser and return the parser target.
+
+    :param filename: the path of the info.xml file
+    :param target: the parser target; a new InfoXmlTarget by default
+    """
+    if target is None:
+        target = InfoXmlTarget()
+    parser = _get_parser(target)
+    with open(filename, 'rb') as handle:
+        while True:
+            chunk = handle.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    return parser.close()
+
+class IncrementalInfoXmlParser(object):
+    """
+    Parse an info.xml that is still being written by exciting.
+
+    The file content is passed with feed() as it grows; the parser is never
+    closed, so the unterminated document is not an error, and the target
+    holds the state of all the data fed so far.
+    """
+
+    def __init__(self, target=None):
+        if target is None:
+            target = ScfHistoryTarget()
+        self.target = target
+        self.nbytes = 0
+        self._parser = _get_parser(target)
+
+    def feed(self, data):
+        """
+        Feed the next block of the file and return the parser target.
+        """
+        self._parser.feed(data)
+        self.nbytes += len(data)
+        return self.target
+
 def parse_xml_output(filename):
-    import xml.etree.ElementTree as ET
-    tree = ET.parse(filename)
-    root = tree.getroot()
+    """
+    Parse the groundstate results of exciting's info.xml.
 
-    node = root.findall('./groundstate')[0]
-    if node.attrib.get('status', '') != 'finished':
+    The file is read once with a streaming parser, so memory use does not
+    grow with the number of SCF iterations. The energy and its accuracy are
+    taken from the last SCF iteration.
+
+    :return (status, res): status is False if the groundstate is not
+        finished; res is the dictionary of parsed results.
+    """
+    return _get_results(scan_info_xml(filename))
+
+def parse_xml_output_with_history(filename):
+    """
+    Like parse_xml_output, but also return the SCF convergence history.
+
+    :return (status, res, history): history maps the name of each series
+        (see SCF_HISTORY_FIELDS) to an array of doubles with one entry per
+        SCF iteration. Energies are in eV, times in seconds.
+    """
+    target = scan_info_xml(filename, ScfHistoryTarget())
+    status, res = _get_results(target)
+    return status, res, target.history
+
+def _get_results(target):
+    if target.status != 'finished':
         return False, {}
-        
-    # count number of iterations
-    niter = len(root.findall('./groundstate/scl/iter'))
-
-    # get node with last iteration
-    node_iter = root.findall("./groundstate/scl/iter[@iteration='%i']"%niter)[0]
-    node = root.findall("./groundstate/scl/iter[@iteration='%i']/energies"%niter)[0]
-    node_cryst = root.findall("./groundstate/scl/structure/crystal")[0]
-    
+
+    if target.last_energies is None or target.crystal is None:
+        return False, {}
+
     res = {}
-    res['energy'] = float(node.attrib['totalEnergy']) * ha2ev
-    res['energy_accuracy'] = float(node_iter.attrib['deltae']) * ha2ev
+    res['energy'] = float(target.last_energies['totalEnergy']) * ha2ev
+    res['energy_accuracy'] = float(target.last_iter['deltae']) * ha2ev
     res['energy_units'] = 'eV'
     res['energy_accuracy_units'] = 'eV'
-    res['volume'] = float(node_cryst.attrib['unitCellVolume']) * (au2angs**3)
+    res['volume'] = float(target.crystal['unitCellVolume']) * (au2angs**3)
     res['volume_units'] = 'angstrom^3'
+    res['number_of_iterations'] = target.niter
+    try:
+        res['wall_time'] = float(target.last_timing['timetot'])
+        res['wall_time_units'] = 's'
+    except (TypeError, KeyError, ValueError):
+        pass
 
     return True, res
 
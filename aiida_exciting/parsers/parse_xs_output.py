@@ -0,0 +1,126 @@
+"""
+Chunked readers of exciting's excited-states (xs) output.
+
+The spectra (EPSILON_*.OUT, LOSS_*.OUT) and the exciton eigenvalues of BSE
+(EXCITON_*.OUT) are tables of numbers with '#' comment lines; a fine
+frequency grid or a large BSE Hamiltonian makes them large. They are read
+in chunks of bytes, each converted by numpy in a single call and appended
+to a flat array of doubles, so that the text of a file is never held in
+memory as a whole and no python objects are created per line.
+
+Energies are in the units written by exciting: Hartree, or eV when the
+xs attribute tevout is true.
+"""
+import os
+import re
+from array import array
+
+import numpy
+
+from aiida_exciting.parsers.numeric_text import read_numbers
+
+# kinds of xs output files, and the columns holding energies
+SPECTRUM_KINDS = ['EPSILON', 'LOSS']
+EXCITON_KIND = 'EXCITON'
+ENERGY_COLUMNS = {'EPSILON': [0], 'LOSS': [0], 'EXCITON': [1, 2]}
+
+# retrieve patterns, for exciting versions writing the files in the
+# working directory or in one subdirectory per kind
+XS_FILE_PATTERNS = ['{0}_*.OUT', '{0}/{0}_*.OUT']
+
+CHUNK_SIZE = 1 << 22
+
+_XS_FILE_NAME = re.compile(r'^(EPSILON|LOSS|EXCITON)_(.+)\.OUT$')
+_COMMENT_LINE = re.compile(r'^[ \t]*#.*$', re.M)
+_INVALID_NAME_CHARS = re.compile(r'[^0-9a-zA-Z_]')
+
+def get_xs_retrieve_list():
+    """
+    Return the retrieve list entries of the xs output files.
+    """
+    return [[pattern.format(kind), '.', 0]
+            for kind in SPECTRUM_KINDS + [EXCITON_KIND]
+            for pattern in XS_FILE_PATTERNS]
+
+def get_xs_files(list_of_files):
+    """
+    Return the xs output files in a list of file names, sorted, as a list
+    of (filename, kind, array name) tuples. The array name is the file
+    name without extension, with the characters that are not allowed in
+    the name of an array replaced by underscores.
+    """
+    xs_files = []
+    for filename in sorted(list_of_files):
+        match = _XS_FILE_NAME.match(os.path.basename(filename))
+        if match:
+            name = _INVALID_NAME_CHARS.sub('_', "{}_{}".format(*match.groups()))
+            xs_files.append((filename, match.group(1), name))
+    return xs_files
+
+def _append_numbers(text, numbers, ncols, filename):
+    if '#' in text:
+        text = _COMMENT_LINE.sub('', text)
+    if ncols is None:
+        for line in text.splitlines():
+            if line.strip():
+                ncols = len(line.split())
+                break
+        else:
+            return None
+    values = read_numbers(text)
+    if len(values) % ncols:
+        raise ValueError("{} is not a table of {} columns".format(filename,
+                                                                  ncols))
+    numbers.fromstring(values.tostring())
+    return ncols
+
+def read_table(filename, chunk_size=CHUNK_SIZE):
+    """
+    Read a table of numbers, skipping the lines starting with '#', in
+    chunks of chunk_size bytes cut at line ends.
+
+    :return: an array of shape (nlines, ncols)
+    """
+    numbers = array('d')
+    ncols = None
+    tail = ''
+    with open(filename) as handle:
+        while True:
+            data = handle.read(chunk_size)
+            if not data:
+                break
+            text = tail + data
+            end = text.rfind('\n') + 1
+            tail = text[end:]
+            ncols = _append_numbers(text[:end], numbers, ncols, filename)
+    ncols = _append_numbers(tail, numbers, ncols, filename)
+    if ncols is None:
+        raise ValueError("{} contains no data".format(filename))
+    return numpy.frombuffer(numbers, dtype=numpy.float64).reshape(-1, ncols)
+
+def read_xs_files(out_dir, list_of_files, chunk_size=CHUNK_SIZE):
+    """
+    Read the xs output files.
+
+    :return: a dictionary with 'spectra' (the EPSILON and LOSS files) and
+        'excitons' (the EXCITON files), each a dictionary array name ->
+        (filename, kind, table); None if there is no xs output file
+    """
+    xs_files = get_xs_files(list_of_files)
+    if not xs_files:
+        return None
+    results = {'spectra': {}, 'excitons': {}}
+    for filename, kind, name in xs_files:
+        table = read_table(os.path.join(out_dir, filename), chunk_size)
+        key = 'excitons' if kind == EXCITON_KIND else 'spectra'
+        results[key][name] = (os.path.basename(filename), kind, table)
+    return results
+
+def scale_energies(table, kind, scale):
+    """
+    Multiply the energy columns of a table by scale, in place, and return
+    the table.
+    """
+    columns = [c for c in ENERGY_COLUMNS[kind] if c < table.shape[1]]
+    table[:, columns] *= scale
+    return table
@@ -0,0 +1,194 @@
+"""
+Reparsing of the retrieved files of finished exciting calculations with the
+current OutputParser.
+
+The retrieved files are parsed in a pool of worker processes, which do not
+access the database (see output.parse_output_files); the nodes are built
+and stored by the main process, one database transaction per batch of
+calculations. The new nodes are the outputs of an InlineCalculation per
+reparsed calculation, with the retrieved folder as input, since outputs
+cannot be added to a finished calculation.
+
+Each reparsed calculation is marked with an extra named after the label of
+the reparsing, so that an interrupted run can be resumed.
+"""
+import time
+
+from aiida_exciting.parsers.archive import retrieved_directory
+from aiida_exciting.parsers.output import parse_output_files
+from aiida_exciting.transaction import batch_transaction
+
+# prefix of the extra marking the calculations reparsed with a label
+REPARSE_EXTRA_PREFIX = 'reparse_'
+REPARSE_OK = 'ok'
+REPARSE_FAILED = 'failed'
+# function name of the InlineCalculations that own the new outputs
+REPARSE_FUNCTION_NAME = 'exciting_reparse'
+
+def get_reparse_extra(label):
+    """
+    Return the name of the extra marking the calculations reparsed with
+    the given label.
+    """
+    return REPARSE_EXTRA_PREFIX + label
+
+def select_calculations(label, group=None, pks=None, pk_min=None,
+                        pk_max=None, states=('FINISHED',), retry_failed=False):
+    """
+    Return the sorted pks of the ExcitingCalculations to reparse.
+
+    :param label: the label of the reparsing; calculations already reparsed
+        with it are skipped
+    :param group: only the calculations in the group with this name
+    :param pks: only the calculations with these pks
+    :param pk_min: only the calculations with pk >= pk_min
+    :param pk_max: only the calculations with pk <= pk_max
+    :param states: the states of the calculations to reparse
+    :param retry_failed: if True, calculations whose reparsing failed are
+        selected again
+    """
+    from aiida.orm import Group
+    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_exciting.calculations.exciting import ExcitingCalculation
+
+    filters = {'attributes.state': {'in': list(states)}}
+    id_filters = []
+    if pks:
+        id_filters.append({'in': list(pks)})
+    if pk_min is not None:
+        id_filters.append({'>=': pk_min})
+    if pk_max is not None:
+        id_filters.append({'<=': pk_max})
+    if id_filters:
+        filters['id'] = {'and': id_filters}
+
+    qb = QueryBuilder()
+    if group is not None:
+        qb.append(Group, filters={'name': group}, tag='group')
+        qb.append(ExcitingCalculation, member_of='group', filters=filters,
+                  project=['id', 'extras.{}'.format(get_reparse_extra(label))])
+    else:
+        qb.append(ExcitingCalculation, filters=filters,
+                  project=['id', 'extras.{}'.format(get_reparse_extra(label))])
+
+    skipped = (REPARSE_OK,) if retry_failed else (REPARSE_OK, REPARSE_FAILED)
+    return sorted(pk for pk, mark in qb.iterall() if mark not in skipped)
+
+def _parse_item(item):
+    """
+    Parse the retrieved files of a calculation, in a worker process.
+
+    :return: (pk, results of parse_output_files, error message or None)
+    """
+    pk, out_dir, list_of_files = item
+    try:
+        with retrieved_directory(out_dir, list_of_files) as (directory, files):
+            return pk, parse_output_files(directory, files), None
+    except Exception as e:
+        return pk, None, "{}: {}".format(type(e).__name__, e)
+
+def _store_reparsed(calc, retrieved, label, new_nodes_list):
+    """
+    Store the new output nodes of a calculation as the outputs of an
+    InlineCalculation with the retrieved folder as input.
+    """
+    from aiida.orm.calculation.inline import InlineCalculation
+    from aiida.common.links import LinkType
+
+    inline = InlineCalculation()
+    inline.label = label
+    inline.description = "Reparsing of calculation {}".format(calc.uuid)
+    inline._set_attr('function_name', REPARSE_FUNCTION_NAME)
+    inline._set_attr('reparsed_calculation', calc.uuid)
+    inline.add_link_from(retrieved, label='retrieved')
+    inline.store()
+    for linkname, node in new_nodes_list:
+        node.add_link_from(inline, label=linkname, link_type=LinkType.CREATE)
+        node.store()
+    return inline
+
+def reparse_calculations(pks, label, processes=None, batch_size=100,
+                         dry_run=False, progress=None):
+    """
+    Reparse the retrieved files of ExcitingCalculations.
+
+    :param pks: the pks of the calculations (see select_calculations)
+    :param label: the label of the reparsing, set on the InlineCalculations
+        and used to mark the reparsed calculations
+    :param processes: the number of worker processes (default: one per CPU)
+    :param batch_size: the number of calculations stored per transaction
+    :param dry_run: if True, parse without storing anything
+    :param progress: if given, called as progress(done, total, nfailed,
+        elapsed seconds) after each batch
+    :return: (number of reparsed calculations, whose new outputs were
+        stored; number of calculations parsed successfully, stored or not;
+        list of (pk, reason) of the failures). In a dry run the first is 0.
+    """
+    from multiprocessing import Pool, cpu_count
+    from aiida.orm import load_node
+    from aiida_exciting.parsers.output import OutputParser
+
+    extra = get_reparse_extra(label)
+    nreparsed = 0
+    nparsed = 0
+    failures = []
+    start = time.time()
+
+    pool = Pool(processes)
+    try:
+        for first in range(0, len(pks), batch_size):
+            calcs = {}
+            retrieved = {}
+            items = []
+            unretrieved = []
+            for pk in pks[first:first + batch_size]:
+                calc = load_node(pk)
+                folder = calc.get_outputs_dict().get(
+                    calc._get_linkname_retrieved(), None)
+                if folder is None:
+                    failures.append((pk, "no retrieved folder"))
+                    unretrieved.append(calc)
+                    continue
+                calcs[pk] = calc
+                retrieved[pk] = folder
+                items.append((pk, folder.get_abs_path('.'),
+                              folder.get_folder_list()))
+
+            # nodes are built while the workers parse the next items
+            results = []
+            chunksize = max(1, len(items) // (4 * (processes or cpu_count())))
+            for pk, parsed, error in pool.imap_unordered(_parse_item, items,
+                                                         chunksize):
+                if error is not None:
+                    failures.append((pk, error))
+                    results.append((pk, False, ()))
+                    continue
+                successful, new_nodes_list = OutputParser(
+                    calcs[pk]).get_nodes_from_results(parsed)
+                if not successful:
+                    failures.append((pk, "the parser reported a failure"))
+                results.append((pk, successful, new_nodes_list))
+
+            if not dry_run:
+                with batch_transaction():
+                    for pk, successful, new_nodes_list in results:
+                        if successful:
+                            _store_reparsed(calcs[pk], retrieved[pk], label,
+                                            new_nodes_list)
+                        calcs[pk].set_extra(
+                            extra, REPARSE_OK if successful else REPARSE_FAILED)
+                    for calc in unretrieved:
+                        calc.set_extra(extra, REPARSE_FAILED)
+            nsuccessful = len([r for r in results if r[1]])
+            nparsed += nsuccessful
+            if not dry_run:
+                nreparsed += nsuccessful
+
+            if progress is not None:
+                progress(min(first + batch_size, len(pks)), len(pks),
+                         len(failures), time.time() - start)
+    finally:
+        pool.close()
+        pool.join()
+
+    return nreparsed, nparsed, failures
@@ -0,0 +1,120 @@
+"""
+Lightweight, opt-in timing of the phases of the plugin.
+
+Usage::
+
+    timer = get_timer(enabled)
+    with timer.phase('write_input'):
+        ...
+    timer.log(logger, 'prepare')
+    attributes = timer.as_dict()
+
+When timing is disabled, get_timer returns a timer whose phases are a
+shared no-op context manager, so the instrumented code pays one method
+call per phase.
+"""
+import resource
+import time
+
+def _get_max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+class NullTimer(object):
+    """
+    Timer that records nothing.
+    """
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def as_dict(self):
+        return {}
+
+    def log(self, logger, label):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class _Phase(object):
+
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+
+    def __enter__(self):
+        self._start_rss = _get_max_rss()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._timer._record(self._name, time.time() - self._start,
+                            _get_max_rss() - self._start_rss)
+        return False
+
+class PhaseTimer(object):
+    """
+    Timer recording the wall time and the memory growth of named phases.
+
+    The memory growth is the increase, in kB, of the maximum resident set
+    size of the process during the phase: the memory the phase needed
+    beyond the largest footprint reached before it (so 0 for a phase that
+    fits in memory the process already used). Phases that run more than
+    once accumulate their wall time and keep their largest growth.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._phases = []
+        self._records = {}
+
+    def phase(self, name):
+        """
+        Return a context manager timing the phase `name`.
+        """
+        return _Phase(self, name)
+
+    def _record(self, name, wall_time, growth):
+        record = self._records.get(name, None)
+        if record is None:
+            self._phases.append(name)
+            self._records[name] = {'wall_time': wall_time,
+                                   'memory_growth_kb': growth}
+        else:
+            record['wall_time'] += wall_time
+            record['memory_growth_kb'] = max(record['memory_growth_kb'],
+                                             growth)
+
+    def as_dict(self):
+        """
+        Return {phase: {'wall_time': seconds, 'memory_growth_kb': kB}}.
+        """
+        return dict((name, dict(record))
+                    for name, record in self._records.iteritems())
+
+    def log(self, logger, label):
+        """
+        Log one line per phase, in the order in which they first ran.
+        """
+        for name in self._phases:
+            record = self._records[name]
+            logger.info("{} timing: {}: {:.4f} s, memory growth {} kB".format(
+                label, name, record['wall_time'], record['memory_growth_kb']))
+
+def get_timer(enabled):
+    """
+    Return a PhaseTimer if enabled, otherwise the shared NullTimer.
+    """
+    if enabled:
+        return PhaseTimer()
+    return NULL_TIMER
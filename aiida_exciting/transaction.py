@@ -0,0 +1,19 @@
+"""
+Grouping of many database writes in a single transaction.
+"""
+from contextlib import contextmanager
+
+@contextmanager
+def batch_transaction():
+    """
+    Group the database writes of a batch in a single transaction, when the
+    backend supports it.
+    """
+    from aiida.backends.settings import BACKEND
+
+    if BACKEND == 'django':
+        from django.db import transaction
+        with transaction.atomic():
+            yield
+    else:
+        yield
@@ -0,0 +1,95 @@
+"""
+Benchmark of the streaming info.xml parser against the previous
+ElementTree implementation on synthetic files of growing size.
+
+Run from the repository root, with the plugin installed:
+
+    python benchmarks/bench_parse_xml_output.py [niter ...]
+"""
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from generators import info_xml_path
+from aiida_exciting.parsers.parse_xml_output import (parse_xml_output,
+                                                     ha2ev, au2angs)
+
+DEFAULT_NITER = [10, 100, 1000, 10000, 100000]
+
+def parse_xml_output_tree(filename):
+    """
+    The ElementTree implementation of parse_xml_output that predates the
+    streaming parser, kept as reference.
+    """
+    import xml.etree.ElementTree as ET
+    tree = ET.parse(filename)
+    root = tree.getroot()
+
+    node = root.findall('./groundstate')[0]
+    if node.attrib.get('status', '') != 'finished':
+        return False, {}
+
+    niter = len(root.findall('./groundstate/scl/iter'))
+
+    node_iter = root.findall("./groundstate/scl/iter[@iteration='%i']"%niter)[0]
+    node = root.findall("./groundstate/scl/iter[@iteration='%i']/energies"%niter)[0]
+    node_cryst = root.findall("./groundstate/scl/structure/crystal")[0]
+
+    res = {}
+    res['energy'] = float(node.attrib['totalEnergy']) * ha2ev
+    res['energy_accuracy'] = float(node_iter.attrib['deltae']) * ha2ev
+    res['energy_units'] = 'eV'
+    res['energy_accuracy_units'] = 'eV'
+    res['volume'] = float(node_cryst.attrib['unitCellVolume']) * (au2angs**3)
+    res['volume_units'] = 'angstrom^3'
+
+    return True, res
+
+def _run(func, filename, queue):
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    result = func(filename)
+    elapsed = time.time() - t0
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, rss_peak - rss_start, result))
+
+def measure(func, filename):
+    """
+    Run func(filename) in a fresh process.
+
+    :return (seconds, peak memory growth in kB, result)
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run, args=(func, filename, queue))
+    proc.start()
+    res = queue.get()
+    proc.join()
+    return res
+
+def main(niter_list):
+    folder = tempfile.mkdtemp()
+    try:
+        print "{:>8} {:>12} {:>12} {:>12} {:>12} {:>8}".format(
+            'niter', 'tree [s]', 'tree [kB]', 'stream [s]', 'stream [kB]',
+            'speedup')
+        for niter in niter_list:
+            filename = info_xml_path(folder, niter)
+            t_tree, m_tree, r_tree = measure(parse_xml_output_tree, filename)
+            t_stream, m_stream, r_stream = measure(parse_xml_output, filename)
+            # the streaming parser reports more results than the reference
+            shared = set(r_tree[1]) & set(r_stream[1])
+            if r_tree[0] != r_stream[0] or \
+                    any(r_tree[1][k] != r_stream[1][k] for k in shared):
+                raise AssertionError("Results differ for niter={}: {} != {}"
+                                     .format(niter, r_tree, r_stream))
+            print "{:>8} {:>12.4f} {:>12} {:>12.4f} {:>12} {:>8.1f}".format(
+                niter, t_tree, m_tree, t_stream, m_stream,
+                t_tree / max(t_stream, 1e-9))
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main([int(i) for i in sys.argv[1:]] or DEFAULT_NITER)
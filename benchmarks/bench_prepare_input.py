@@ -0,0 +1,107 @@
+"""
+Benchmark of the input.xml generation of ExcitingCalculation as a function
+of the number of atoms: the batched coordinate conversion and streaming
+writer against the previous per-site numpy.matrix loop and ElementTree.
+
+Run from the repository root, with the plugin installed:
+
+    python benchmarks/bench_prepare_input.py [natoms ...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+from generators import make_structure_arrays
+from aiida_exciting.calculations.input_xml import (get_fractional_coordinates,
+                                                   group_sites_by_kind,
+                                                   write_input_xml)
+
+DEFAULT_NATOMS = [10, 100, 1000, 5000, 10000, 20000]
+
+GROUNDSTATE = {'rgkmax': '7.0', 'ngridk': '2 2 2'}
+
+def prepare_input_tree(filename, cell, positions, site_kinds, kinds):
+    """
+    The input.xml generation of _prepare_for_submission that predates the
+    streaming writer, kept as reference.
+    """
+    import xml.etree.ElementTree as ET
+    from numpy import matrix
+
+    root = ET.Element("input")
+    ET.SubElement(root, "title").text = "input file created with AiiDA"
+    struct = ET.SubElement(root, "structure", attrib={'speciespath' : './', 'autormt' : 'true'})
+    cryst = ET.SubElement(struct, "crystal", attrib={'scale' : '1.889725989'})
+
+    lat_vec = matrix(cell)
+    inv_lat_vec = lat_vec.T.I;
+
+    for vector in cell:
+        ET.SubElement(cryst, "basevect").text = " ".join(['%18.10f'%e for e in vector])
+
+    for kind in kinds:
+        s = ET.SubElement(struct, "species", attrib={'speciesfile' : kind + '.xml'})
+        for position, kind_name in zip(positions, site_kinds):
+            if kind_name == kind:
+                pos_cart = matrix(position)
+                pos_lat = inv_lat_vec * pos_cart.T
+                ET.SubElement(s, "atom", attrib={'coord' : " ".join(['%18.10f'%e for e in pos_lat])})
+
+    ET.SubElement(root, "groundstate", attrib=dict(GROUNDSTATE))
+
+    tree = ET.ElementTree(root)
+    tree.write(filename)
+
+def prepare_input_stream(filename, cell, positions, site_kinds, kinds):
+    frac_coords = get_fractional_coordinates(cell, positions)
+    sites_by_kind = group_sites_by_kind(site_kinds, kinds)
+    species = [(kind + '.xml', frac_coords[sites_by_kind[kind]])
+               for kind in kinds]
+    with open(filename, 'w') as handle:
+        write_input_xml(handle, cell, species, dict(GROUNDSTATE))
+
+def read_coords(filename):
+    """
+    Return the atomic coordinates written in an input.xml, per species.
+    """
+    import xml.etree.ElementTree as ET
+    root = ET.parse(filename).getroot()
+    return [numpy.array([[float(x) for x in atom.attrib['coord'].split()]
+                         for atom in species.findall('atom')])
+            for species in root.findall('./structure/species')]
+
+def timed(func, *args):
+    t0 = time.time()
+    func(*args)
+    return time.time() - t0
+
+def main(natoms_list):
+    folder = tempfile.mkdtemp()
+    try:
+        print "{:>8} {:>12} {:>12} {:>8}".format('natoms', 'tree [s]',
+                                                 'stream [s]', 'speedup')
+        for natoms in natoms_list:
+            cell, positions, site_kinds = make_structure_arrays(natoms)
+            kinds = sorted(set(site_kinds))
+            tree_file = os.path.join(folder, 'tree.xml')
+            stream_file = os.path.join(folder, 'stream.xml')
+            t_tree = timed(prepare_input_tree, tree_file, cell, positions,
+                           site_kinds, kinds)
+            t_stream = timed(prepare_input_stream, stream_file, cell,
+                             positions, site_kinds, kinds)
+            for c_tree, c_stream in zip(read_coords(tree_file),
+                                        read_coords(stream_file)):
+                if not numpy.allclose(c_tree, c_stream, atol=1e-9):
+                    raise AssertionError("Coordinates differ for natoms={}"
+                                         .format(natoms))
+            print "{:>8} {:>12.4f} {:>12.4f} {:>8.1f}".format(
+                natoms, t_tree, t_stream, t_tree / max(t_stream, 1e-9))
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main([int(i) for i in sys.argv[1:]] or DEFAULT_NATOMS)
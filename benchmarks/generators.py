@@ -0,0 +1,177 @@
+"""
+Generators of synthetic exciting files used by the benchmarks.
+"""
+import os
+
+_ITER_TEMPLATE = (
+    '      <iter iteration="%(n)i" rms="%(rms).10e" rmslog10="-%(n)i" '
+    'deltae="%(deltae).10e" deltaelog10="-%(n)i" chgdst="%(chgdst).10e" '
+    'chgdstlog10="-%(n)i">\n'
+    '        <energies totalEnergy="%(etot).10f" fermiEnergy="0.1871234567" '
+    'sum-of-eigenvalues="-20.1234567890" electronic-kinetic="578.1234567890" '
+    'core-electron-kinetic="0.0000000000" Coulomb="-1154.1234567890" '
+    'Coulomb-potential="-777.1234567890" nuclear-nuclear="-79.1234567890" '
+    'electron-nuclear="-1230.1234567890" Hartree="155.1234567890" '
+    'Madelung="-694.1234567890" xc-potential="-34.1234567890" '
+    'exchange="-23.1234567890" correlation="-1.1234567890"/>\n'
+    '        <charges totalcharge="28.0000000000" core="4.0000000000" '
+    'core_leakage="0.0000000000" valence="24.0000000000" '
+    'interstitial="7.1234567890" muffin-tin-total="20.8765432110">\n'
+    '          <atom species="Si" muffin-tin="10.4382716055"/>\n'
+    '          <atom species="Si" muffin-tin="10.4382716055"/>\n'
+    '        </charges>\n'
+    '        <timing itertime="%(itertime).4f" timetot="%(timetot).4f" '
+    'timeinit="0.5200" timemat="0.1100" timefv="0.0200" timesv="0.0000" '
+    'timerho="0.0700" timepot="0.0300" timefor="0.0000"/>\n'
+    '      </iter>\n')
+
+def write_info_xml(filename, niter, finished=True):
+    """
+    Write a synthetic info.xml with `niter` groundstate SCF iterations.
+
+    :param finished: if False, the groundstate is marked as unfinished and
+        the file is left unterminated, as while exciting is still running.
+    """
+    with open(filename, 'w') as handle:
+        handle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        handle.write('<info date="2016-01-01" time="00:00:00" '
+                     'versionhash="synthetic" title="benchmark">\n')
+        handle.write('  <groundstate status="%s">\n'
+                     % ('finished' if finished else 'unfinished'))
+        handle.write('    <scl>\n')
+        handle.write('      <structure>\n')
+        handle.write('        <crystal unitCellVolume="270.0114725000" '
+                     'BrillouinZoneVolume="0.9186522600" '
+                     'nktot="512" ngridk="8 8 8"/>\n')
+        handle.write('      </structure>\n')
+        timetot = 0.
+        for n in range(1, niter + 1):
+            timetot += 0.25
+            handle.write(_ITER_TEMPLATE % {
+                'n': n,
+                'rms': 1. / n,
+                'deltae': 0.1 / n,
+                'chgdst': 0.01 / n,
+                'etot': -578.6 - 1. / n,
+                'itertime': 0.25,
+                'timetot': timetot,
+                })
+        if not finished:
+            return
+        handle.write('    </scl>\n')
+        handle.write('  </groundstate>\n')
+        handle.write('</info>\n')
+
+def info_xml_path(folder, niter, finished=True):
+    """
+    Return the path of a synthetic info.xml in folder, creating it if needed.
+    """
+    filename = os.path.join(folder, 'info_%i%s.xml'
+                            % (niter, '' if finished else '_running'))
+    if not os.path.exists(filename):
+        write_info_xml(filename, niter, finished=finished)
+    return filename
+
+def make_structure_arrays(natoms, symbols=('Si', 'O', 'Ga', 'N'), seed=0):
+    """
+    Return a synthetic supercell as plain arrays.
+
+    :return (cell, positions, site_kinds): cell is a 3x3 array in angstrom,
+        positions an Nx3 array of cartesian positions and site_kinds the
+        kind name of each site, with kinds interleaved along the sites.
+    """
+    import numpy
+
+    rng = numpy.random.RandomState(seed)
+    # roughly 10 angstrom^3 per atom, slightly sheared cell
+    side = (10. * natoms) ** (1. / 3.)
+    cell = numpy.array([[side, 0., 0.],
+                        [0.1 * side, side, 0.],
+                        [0., 0.2 * side, side]])
+    frac = rng.random_sample((natoms, 3))
+    positions = numpy.dot(frac, cell)
+    site_kinds = [symbols[i % len(symbols)] for i in range(natoms)]
+    return cell, positions, site_kinds
+
+_SPECIES_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<spdb>
+  <sp chemicalSymbol="%(symbol)s" name="%(name)s" z="-%(z).4f" mass="%(mass).5f">
+    <muffinTin rmin="0.100000E-05" radius="2.0000" rinf="21.8982" radialmeshPoints="300"/>
+%(states)s    <basis>
+      <default type="lapw" trialEnergy="0.1500" searchE="false"/>
+      <custom l="0" type="lapw" trialEnergy="0.1500" searchE="true"/>
+      <custom l="1" type="lapw" trialEnergy="0.1500" searchE="true"/>
+      <lo l="0">
+        <wf matchingOrder="0" trialEnergy="0.1500" searchE="true"/>
+        <wf matchingOrder="1" trialEnergy="0.1500" searchE="true"/>
+      </lo>
+    </basis>
+  </sp>
+  <!-- synthetic padding, in place of the radial data of real files -->
+%(padding)s</spdb>
+'''
+
+def write_species_file(filename, index):
+    """
+    Write a synthetic xml species file, unique for each index.
+    """
+    states = "".join(
+        '    <atomicState n="%i" l="0" kappa="1" occ="2.00000" core="%s"/>\n'
+        % (n, 'true' if n < 3 else 'false') for n in range(1, 6))
+    padding = "".join('  <!-- %064i -->\n' % i for i in range(2000))
+    with open(filename, 'w') as handle:
+        handle.write(_SPECIES_TEMPLATE % {
+            'symbol': 'X%i' % index,
+            'name': 'synthetic species %i' % index,
+            'z': 1. + index,
+            'mass': 1822.88848 * (1. + index),
+            'states': states,
+            'padding': padding,
+            })
+
+def species_folder_path(folder, nspecies):
+    """
+    Return a folder with nspecies synthetic species files, creating it if
+    needed.
+    """
+    path = os.path.join(folder, 'species_%i' % nspecies)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+        for index in range(nspecies):
+            write_species_file(os.path.join(path, 'X%i.xml' % index), index)
+    return path
+
+_EPSILON_HEADER = (
+    "# Macroscopic dielectric function, BSE singlet\n"
+    "#   Frequency       Re(eps)         Im(eps)         Re(eps) (KK)\n")
+
+def epsilon_out_path(folder, npoints):
+    """
+    Return the path of a synthetic EPSILON_*.OUT spectrum with npoints
+    frequencies, creating it if needed.
+    """
+    filename = os.path.join(folder, 'EPSILON_BSE-singlet_OC11_%i.OUT' % npoints)
+    if not os.path.exists(filename):
+        with open(filename, 'w') as handle:
+            handle.write(_EPSILON_HEADER)
+            for i in xrange(npoints):
+                w = 1e-4 * i
+                handle.write("%18.10E%18.10E%18.10E%18.10E\n" % (
+                    w, 1. + 1. / (1. + w * w), w / (1. + w * w),
+                    1. + 0.9 / (1. + w * w)))
+    return filename
+
+def make_silicon_supercell(ncells, displacement=0.05):
+    """
+    Return the cell, positions and kind names of a diamond-silicon
+    supercell of ncells x ncells x ncells primitive cells (2 ncells**3
+    atoms), with the first atom displaced along x to lower the symmetry.
+    """
+    import numpy
+
+    primitive = numpy.array([[0., .5, .5], [.5, 0., .5], [.5, .5, 0.]]) * 5.43
+    basis = numpy.array([[0., 0., 0.], [.25, .25, .25]]).dot(primitive)
+    shifts = numpy.indices((ncells,) * 3).reshape(3, -1).T.dot(primitive)
+    positions = (shifts[:, None, :] + basis[None, :, :]).reshape(-1, 3)
+    positions[0, 0] += displacement
+    return primitive * ncells, positions, ['Si'] * len(positions)
@@ -0,0 +1,238 @@
+"""
+Import time of the entry points of the plugin, checked against a budget.
+
+Each entry point declared in setup.py is loaded in a fresh interpreter,
+timing the import of its module and the lookup of its object; the modules
+imported meanwhile are recorded, so that a heavy dependency pulled back
+onto the startup path is reported even when the machine is fast. The
+entry points that AiiDA only loads with its database environment (see
+DBENV_GROUPS) are timed after load_dbenv, which needs a configured profile.
+Run from the repository root, with the plugin and AiiDA installed:
+
+    python benchmarks/import_time.py                  # time and check
+    python benchmarks/import_time.py --profile 15     # slowest imports
+    python benchmarks/import_time.py --record         # update the budgets
+
+The budgets are in benchmarks/import_budget.json: for each entry point,
+the largest import time in seconds (null: not checked) and the modules it
+must not load. The exit status is 1 if any entry point fails to load,
+exceeds its time budget or loads a forbidden module.
+"""
+import __builtin__
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SETUP_PY = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'setup.py')
+DEFAULT_BUDGET = os.path.join(BENCHMARKS_DIR, 'import_budget.json')
+
+# entry point groups loaded by AiiDA after load_dbenv; the command line
+# groups are loaded by verdi before it
+DBENV_GROUPS = ['aiida.calculations', 'aiida.data', 'aiida.parsers']
+
+class ImportProfiler(object):
+    """
+    Wrap the __import__ builtin and record, for each imported name that
+    loads new modules, the cumulative time and the time spent outside the
+    nested imports.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._stack = []
+        self._import = None
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._profiled_import
+
+    def uninstall(self):
+        __builtin__.__import__ = self._import
+
+    def _profiled_import(self, name, globals=None, locals=None, fromlist=None,
+                         level=-1):
+        nmodules = len(sys.modules)
+        self._stack.append(0.)
+        t0 = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - t0
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if len(sys.modules) > nmodules:
+                cumulative, own = self.records.get(name, (0., 0.))
+                self.records[name] = (cumulative + elapsed,
+                                      own + elapsed - nested)
+
+    def top(self, n):
+        """
+        Return the n slowest imports as (name, cumulative, own) seconds.
+        """
+        items = sorted(self.records.iteritems(), key=lambda i: -i[1][0])
+        return [(name, c, o) for name, (c, o) in items[:n]]
+
+def get_entry_points(setup_py=SETUP_PY):
+    """
+    Return the entry points of setup.py as a list of (group, name, module,
+    object name), without running it.
+    """
+    with open(setup_py) as handle:
+        tree = ast.parse(handle.read(), setup_py)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.keyword) and node.arg == 'entry_points':
+            entry_points = ast.literal_eval(node.value)
+            break
+    else:
+        raise ValueError("No entry_points in {}".format(setup_py))
+
+    result = []
+    for group in sorted(entry_points):
+        for spec in entry_points[group]:
+            name, target = [s.strip() for s in spec.split('=', 1)]
+            module, attr = [s.strip() for s in target.split(':', 1)]
+            result.append((group, name, module, attr))
+    return result
+
+def load_entry_point(module, attr, profile=0, dbenv=False):
+    """
+    Import an entry point in this interpreter (which should be fresh) and
+    return a dictionary with the seconds taken, the new modules and, if
+    profile, the profile of the slowest imports.
+
+    :param dbenv: if True, the AiiDA database environment is loaded first,
+        untimed
+    """
+    if dbenv:
+        from aiida import load_dbenv
+        load_dbenv()
+    before = set(sys.modules)
+    profiler = ImportProfiler()
+    if profile:
+        profiler.install()
+    t0 = time.time()
+    try:
+        getattr(__import__(module, fromlist=[attr]), attr)
+    finally:
+        seconds = time.time() - t0
+        if profile:
+            profiler.uninstall()
+    return {'seconds': seconds,
+            'modules': sorted(m for m in set(sys.modules) - before
+                              if sys.modules[m] is not None),
+            'profile': profiler.top(profile)}
+
+def run_child(module, attr, profile=0, dbenv=False):
+    """
+    Load an entry point in a new interpreter and return the dictionary of
+    load_entry_point, or {'error': message} if it cannot be imported.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               module, attr, '--profile', str(profile)]
+    if dbenv:
+        command.append('--dbenv')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        lines = stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else
+                         "exit status {}".format(process.returncode)}
+    return json.loads(stdout)
+
+def is_forbidden(module, forbidden):
+    return any(module == f or module.startswith(f + '.') for f in forbidden)
+
+def check(key, result, budget):
+    """
+    Print the result of an entry point and return the list of problems.
+    """
+    if 'error' in result:
+        print "{:<45} FAILED: {}".format(key, result['error'])
+        return ["{}: {}".format(key, result['error'])]
+
+    problems = []
+    seconds = budget.get('seconds', None)
+    flag = ''
+    if seconds is not None and result['seconds'] > seconds:
+        flag = ' OVER BUDGET'
+        problems.append("{}: {:.3f} s, budget {:.3f} s".format(
+            key, result['seconds'], seconds))
+    print "{:<45} {:>8.3f} s {:>8} {:>5} modules{}".format(
+        key, result['seconds'],
+        '' if seconds is None else '/{:.3f}'.format(seconds),
+        len(result['modules']), flag)
+
+    forbidden = budget.get('forbidden', [])
+    loaded = [m for m in result['modules'] if is_forbidden(m, forbidden)]
+    if loaded:
+        print "    loads forbidden modules: {}".format(", ".join(loaded))
+        problems.append("{}: loads {}".format(key, ", ".join(loaded)))
+
+    for name, cumulative, own in result['profile']:
+        print "    {:<50} {:>8.4f} s {:>8.4f} s".format(name, cumulative, own)
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--budget', default=DEFAULT_BUDGET,
+                        help='the budget file')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of loads of each entry point (best is kept)')
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help='print the N slowest imports of each entry point')
+    parser.add_argument('--record', action='store_true',
+                        help='set the time budgets to the measured times '
+                             'multiplied by --headroom, plus --slack')
+    parser.add_argument('--headroom', type=float, default=2.,
+                        help='ratio of the recorded budgets to the times')
+    parser.add_argument('--slack', type=float, default=0.05,
+                        help='seconds added to the recorded budgets, for '
+                             'the noise of the interpreter startup')
+    parser.add_argument('--child', nargs=2, metavar=('MODULE', 'OBJECT'),
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--dbenv', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(load_entry_point(args.child[0], args.child[1],
+                                   args.profile, args.dbenv), sys.stdout)
+        return
+
+    with open(args.budget) as handle:
+        budgets = json.load(handle)
+
+    problems = []
+    for group, name, module, attr in get_entry_points():
+        key = "{}:{}".format(group, name)
+        result = None
+        for _ in range(args.repeat):
+            run = run_child(module, attr, args.profile,
+                            group in DBENV_GROUPS)
+            if 'error' in run or result is None or \
+                    run['seconds'] < result['seconds']:
+                result = run
+            if 'error' in run:
+                break
+        budget = budgets.setdefault(key, {})
+        if args.record and 'error' not in result:
+            budget['seconds'] = round(
+                result['seconds'] * args.headroom + args.slack, 3)
+        problems.extend(check(key, result, budget))
+        sys.stdout.flush()
+
+    if args.record:
+        with open(args.budget, 'w') as handle:
+            json.dump(budgets, handle, indent=2, sort_keys=True)
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Local stand-ins for the AiiDA nodes used by the benchmarks, exposing only
+the attributes that the plugin code reads. They allow running the
+benchmarks offline, without a database.
+"""
+from generators import make_structure_arrays
+
+class Kind(object):
+
+    def __init__(self, name, symbol=None):
+        self.name = name
+        self.symbol = symbol or name
+
+class Site(object):
+
+    def __init__(self, kind_name, position):
+        self.kind_name = kind_name
+        self.position = tuple(position)
+
+class StructureData(object):
+    """
+    Stand-in for aiida.orm.data.structure.StructureData.
+    """
+
+    def __init__(self, cell, positions, site_kinds):
+        self.cell = [list(v) for v in cell]
+        self.sites = [Site(k, p) for k, p in zip(site_kinds, positions)]
+        self.kinds = [Kind(name) for name in sorted(set(site_kinds))]
+
+    @classmethod
+    def synthetic(cls, natoms, **kwargs):
+        return cls(*make_structure_arrays(natoms, **kwargs))
+
+class KpointsData(object):
+    """
+    Stand-in for aiida.orm.data.array.kpoints.KpointsData with a mesh.
+    """
+
+    def __init__(self, mesh, offset=(0., 0., 0.)):
+        self._mesh = list(mesh)
+        self._offset = list(offset)
+
+    def get_kpoints_mesh(self):
+        return self._mesh, self._offset
+
+class ParameterData(object):
+    """
+    Stand-in for aiida.orm.data.parameter.ParameterData.
+    """
+
+    def __init__(self, dict):
+        self._dict = dict
+
+    def get_dict(self):
+        return dict(self._dict)
@@ -0,0 +1,214 @@
+"""
+Microbenchmark suite of the plugin: input generation, symmetry analysis,
+output parsing (including the spectra of excited-state runs) and
+species-file reading for family upload.
+
+All the inputs are synthetic and generated locally; the AiiDA nodes are
+replaced by the stand-ins of orm.py, so no database is needed. Run from
+the repository root, with the plugin installed:
+
+    python benchmarks/run.py                       # run and print
+    python benchmarks/run.py --save results.json   # also store the results
+    python benchmarks/run.py --compare benchmarks/baseline.json
+
+With --compare, the exit status is 1 if any case is slower than the
+baseline by more than the tolerance and by more than --min-seconds, so
+that the jitter of the sub-millisecond cases is not reported.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import generators
+import orm
+
+class Case(object):
+    """
+    A benchmark case: setup(size, folder) returns the function to time.
+    """
+
+    def __init__(self, name, setup, sizes, quick_sizes, unit):
+        self.name = name
+        self.setup = setup
+        self.sizes = sizes
+        self.quick_sizes = quick_sizes
+        self.unit = unit
+
+def setup_prepare_input(natoms, folder):
+    from aiida_exciting.calculations.input_xml import (get_species_coordinates,
+                                                       get_groundstate_attrib,
+                                                       write_input_xml)
+
+    structure = orm.StructureData.synthetic(natoms)
+    kpoints = orm.KpointsData([4, 4, 4])
+    parameters = orm.ParameterData({'groundstate': {'rgkmax': 7.0}})
+    speciesfiles = dict((kind.symbol, kind.symbol + '.xml')
+                        for kind in structure.kinds)
+    filename = os.path.join(folder, 'input.xml')
+
+    def run():
+        species = get_species_coordinates(structure, speciesfiles)
+        kmesh, koffset = kpoints.get_kpoints_mesh()
+        groundstate_attrib = get_groundstate_attrib(parameters.get_dict(), kmesh)
+        with open(filename, 'w') as handle:
+            write_input_xml(handle, structure.cell, species, groundstate_attrib)
+    return run
+
+def setup_crystal_rotations(natoms, folder):
+    from aiida_exciting.calculations.symmetry import get_crystal_rotations
+
+    ncells = int(round((natoms / 2.) ** (1. / 3.)))
+    cell, positions, types = generators.make_silicon_supercell(ncells)
+    return lambda: get_crystal_rotations(cell, positions, types)
+
+def setup_parse_xml_output(niter, folder):
+    from aiida_exciting.parsers.parse_xml_output import parse_xml_output
+
+    filename = generators.info_xml_path(folder, niter)
+    return lambda: parse_xml_output(filename)
+
+def setup_parse_scf_history(niter, folder):
+    from aiida_exciting.parsers.parse_xml_output import (
+        parse_xml_output_with_history)
+
+    filename = generators.info_xml_path(folder, niter)
+    return lambda: parse_xml_output_with_history(filename)
+
+def setup_parse_xs_spectrum(npoints, folder):
+    from aiida_exciting.parsers.parse_xs_output import read_table
+
+    filename = generators.epsilon_out_path(folder, npoints)
+    return lambda: read_table(filename)
+
+def setup_parse_species_file(nfiles, folder):
+    from aiida_exciting.data.species import parse_species_file
+
+    path = generators.species_folder_path(folder, nfiles)
+    files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+
+    def run():
+        for filename in files:
+            parse_species_file(filename, 'xml')
+    return run
+
+def setup_read_species_files(nfiles, folder):
+    from aiida_exciting.data.species import read_species_files
+
+    path = generators.species_folder_path(folder, nfiles)
+    files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    return lambda: read_species_files(files, 'xml')
+
+CASES = [
+    Case('prepare_input', setup_prepare_input,
+         [10, 100, 1000, 5000, 10000, 20000], [10, 1000], 'atoms'),
+    Case('crystal_rotations', setup_crystal_rotations,
+         [16, 128, 1024, 8192], [16, 1024], 'atoms'),
+    Case('parse_xml_output', setup_parse_xml_output,
+         [1, 100, 1000, 10000, 100000], [1, 1000], 'SCF iterations'),
+    Case('parse_scf_history', setup_parse_scf_history,
+         [1, 100, 1000, 10000, 100000], [1, 1000], 'SCF iterations'),
+    Case('parse_xs_spectrum', setup_parse_xs_spectrum,
+         [1000, 100000, 1000000], [1000, 100000], 'frequencies'),
+    Case('parse_species_file', setup_parse_species_file,
+         [10, 100], [10], 'files'),
+    Case('upload_family_read', setup_read_species_files,
+         [10, 100, 500], [10], 'files'),
+    ]
+
+def time_case(func, repeat):
+    """
+    Return the best wall time of `repeat` calls of func.
+    """
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        func()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run_suite(cases, quick=False, repeat=3):
+    """
+    Run the cases and return {case name: {size (as string): seconds}}.
+    """
+    results = {}
+    folder = tempfile.mkdtemp()
+    try:
+        for case in cases:
+            results[case.name] = {}
+            for size in (case.quick_sizes if quick else case.sizes):
+                func = case.setup(size, folder)
+                seconds = time_case(func, repeat)
+                results[case.name][str(size)] = seconds
+                print "{:<20} {:>8} {:<15} {:>10.4f} s".format(
+                    case.name, size, case.unit, seconds)
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+def compare(results, baseline, tolerance, min_seconds=0.):
+    """
+    Print the ratio to the baseline of each case and return the list of
+    the (case, size) that regressed by more than tolerance, and by more
+    than min_seconds in absolute terms.
+    """
+    regressions = []
+    print
+    print "{:<20} {:>8} {:>10} {:>10} {:>7}".format(
+        'case', 'size', 'baseline', 'current', 'ratio')
+    for name in sorted(results):
+        for size in sorted(results[name], key=int):
+            reference = baseline.get(name, {}).get(size, None)
+            if reference is None:
+                continue
+            current = results[name][size]
+            ratio = current / max(reference, 1e-9)
+            flag = ''
+            if ratio > tolerance and current - reference > min_seconds:
+                flag = ' SLOWER'
+                regressions.append((name, size))
+            print "{:<20} {:>8} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(
+                name, size, reference, current, ratio, flag)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--quick', action='store_true',
+                        help='run only the small sizes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of each case (best is kept)')
+    parser.add_argument('--case', action='append', dest='cases',
+                        help='run only this case (can be repeated)')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with this results file')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.002,
+                        help='smallest slowdown in seconds reported as a '
+                        'regression')
+    args = parser.parse_args()
+
+    cases = [c for c in CASES if not args.cases or c.name in args.cases]
+    results = run_suite(cases, quick=args.quick, repeat=args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump({'platform': platform.platform(),
+                       'python': platform.python_version(),
+                       'results': results}, handle, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)['results']
+        if compare(results, baseline, args.tolerance, args.min_seconds):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -21,7 +21,8 @@ if __name__ == '__main__':
                 "exciting.lapwbasis = aiida_exciting.data.lapwbasis:LapwbasisData"
             ],
             "aiida.cmdline.data": [
-                "lapwbasis = aiida_exciting.commands.lapwbasis:lapwbasis"
+                "lapwbasis = aiida_exciting.commands.lapwbasis:lapwbasis",
+                "exciting = aiida_exciting.commands.reparse:exciting"
             ],
             "aiida.calculations": [
                 "exciting.exciting = aiida_exciting.calculations.exciting:ExcitingCalculation"